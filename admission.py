@@ -0,0 +1,260 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# admission.py
+#
+# This file contains the admission control for the discord music bot's extraction-heavy commands (queueing,
+# searching, broadcasting): per-user and per-guild rate limits, and a cap on how many of them run at once, so one
+# noisy guild can't slow the bot down for everybody else.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import asyncio
+import collections
+import contextlib
+import logging
+import time
+
+from urllib.parse import urlparse, parse_qs
+
+import metrics
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+# Every user gets a burst of commands, then one every few seconds
+USER_RATE = 0.5
+USER_BURST = 5
+
+# Every guild gets a bigger burst, shared between its users
+GUILD_RATE = 1.0
+GUILD_BURST = 10
+
+# How many admitted commands can run at once, overall and per guild
+MAX_PENDING = 16
+MAX_PENDING_PER_GUILD = 2
+
+# How long (in seconds) a command waits for a slot when the bot is saturated, before it gets turned away
+DEFER_TIMEOUT = 5.0
+
+# How many tokens queueing a playlist costs (a single video costs one)
+PLAYLIST_COST = 3
+
+# How many users' and guilds' buckets we remember (full ones are the first to go)
+MAX_BUCKETS = 10000
+
+REASON_USER_RATE = "user_rate"
+REASON_GUILD_RATE = "guild_rate"
+REASON_GUILD_BUSY = "guild_busy"
+REASON_BUSY = "busy"
+
+log = logging.getLogger( __name__ )
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+Raised when a command doesn't get admitted; retry_after is how long (in seconds) it makes sense to wait, if known
+"""
+class Rejected( Exception ):
+
+    ## Constructor
+    def __init__( self, reason, retry_after=None ):
+        super().__init__( reason )
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+"""
+A token bucket: holds up to burst tokens, refilled at rate tokens per second
+"""
+class TokenBucket:
+
+    __slots__ = ( 'rate', 'burst', 'tokens', 'updated' )
+
+    ## Constructor
+    def __init__( self, rate, burst, now ):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float( burst )
+        self.updated = now
+
+    ## Tops the bucket up for the time that went by
+    def refill( self, now ):
+        self.tokens = min( self.burst, self.tokens + ( now - self.updated ) * self.rate )
+        self.updated = now
+
+    ## Returns how long (in seconds) until cost tokens are there, 0 if they are right now
+    def wait_time( self, cost, now ):
+        self.refill( now )
+        if self.tokens >= cost:
+            return 0.0
+        return ( cost - self.tokens ) / self.rate
+
+    def take( self, cost ):
+        self.tokens -= cost
+
+    ## Checks if the bucket has refilled completely (so forgetting it changes nothing)
+    def is_full( self, now ):
+        self.refill( now )
+        return self.tokens >= self.burst
+
+
+"""
+Decides which extraction-heavy commands get to run.
+
+A command needs room in its user's and its guild's token buckets, and one of the pending slots: a guild which
+already has MAX_PENDING_PER_GUILD commands running gets turned away right away, and when every slot overall is taken,
+a command waits (up to defer_timeout) for one to free up. The buckets only get charged once the command has its slot,
+so everything that gets turned away costs nothing (no extraction has been started yet, either).
+"""
+class AdmissionController:
+
+    ## Constructor
+    def __init__( self, enabled=True, user_rate=USER_RATE, user_burst=USER_BURST, guild_rate=GUILD_RATE,
+                  guild_burst=GUILD_BURST, max_pending=MAX_PENDING, max_pending_per_guild=MAX_PENDING_PER_GUILD,
+                  defer_timeout=DEFER_TIMEOUT, playlist_cost=PLAYLIST_COST, max_buckets=MAX_BUCKETS ):
+        # A bucket never holds more than its burst, so anything costing more could never get in
+        if playlist_cost > min( user_burst, guild_burst ):
+            raise ValueError( "playlist_cost ({}) can't be more than user_burst ({}) or guild_burst ({})".format(
+                playlist_cost, user_burst, guild_burst ) )
+
+        self.enabled = enabled
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.guild_rate = guild_rate
+        self.guild_burst = guild_burst
+        self.max_pending = max_pending
+        self.max_pending_per_guild = max_pending_per_guild
+        self.defer_timeout = defer_timeout
+        self.playlist_cost = playlist_cost
+        self.max_buckets = max_buckets
+
+        self.user_buckets = collections.OrderedDict()
+        self.guild_buckets = collections.OrderedDict()
+        self.pending = 0
+        self.guild_pending = collections.Counter()
+        self.admitted = 0
+        self.deferred = 0
+        self.rejected = collections.Counter()
+
+        self._slot_freed = None
+
+    ## Grabs (or creates) the bucket for a key, keeping the table bounded
+    def _bucket( self, buckets, key, rate, burst, now ):
+        bucket = buckets.get( key )
+        if bucket == None:
+            bucket = buckets[ key ] = TokenBucket( rate, burst, now )
+            if len( buckets ) > self.max_buckets:
+                self._prune( buckets, now )
+        else:
+            buckets.move_to_end( key )
+        return bucket
+
+    ## Forgets full buckets (oldest first) until the table fits again; busy ones get dropped last
+    def _prune( self, buckets, now ):
+        for key in [ key for key, bucket in buckets.items() if bucket.is_full( now ) ]:
+            del buckets[ key ]
+            if len( buckets ) <= self.max_buckets:
+                return
+        while len( buckets ) > self.max_buckets:
+            buckets.popitem( last=False )
+
+    def _reject( self, reason, guild_id, user_id, retry_after=None ):
+        self.rejected[ reason ] += 1
+        metrics.admission_rejections.inc( reason )
+        log.info( "Rejected command guild=%s user=%s reason=%s retry_after=%s", guild_id, user_id, reason,
+                  None if retry_after == None else round( retry_after, 1 ) )
+        raise Rejected( reason, retry_after )
+
+    ## Returns how many tokens queueing a URL costs. Only playlist URLs cost more: a video URL which also carries a
+    ## list= (a video opened from a playlist or mix) just queues its one video.
+    def cost_of( self, url ):
+        parsed = urlparse( url )
+        query = parse_qs( parsed.query )
+        is_video = 'v' in query or parsed.netloc.lower().endswith( 'youtu.be' )
+        if parsed.path.rstrip( '/' ).endswith( '/playlist' ) or ( 'list' in query and not is_video ):
+            return self.playlist_cost
+        return 1
+
+    ## Returns the user's and guild's buckets if both have cost tokens, raises Rejected if either doesn't
+    def _check_rates( self, guild_id, user_id, cost ):
+        now = time.monotonic()
+        user_bucket = self._bucket( self.user_buckets, user_id, self.user_rate, self.user_burst, now )
+        guild_bucket = self._bucket( self.guild_buckets, guild_id, self.guild_rate, self.guild_burst, now )
+
+        user_wait = user_bucket.wait_time( cost, now )
+        if user_wait > 0:
+            self._reject( REASON_USER_RATE, guild_id, user_id, user_wait )
+        guild_wait = guild_bucket.wait_time( cost, now )
+        if guild_wait > 0:
+            self._reject( REASON_GUILD_RATE, guild_id, user_id, guild_wait )
+        return user_bucket, guild_bucket
+
+    ## Waits (up to defer_timeout) for one of the pending slots, or raises Rejected
+    async def _acquire_slot( self, guild_id, user_id ):
+        if self.guild_pending[ guild_id ] >= self.max_pending_per_guild:
+            self._reject( REASON_GUILD_BUSY, guild_id, user_id )
+
+        if self.pending >= self.max_pending:
+            self.deferred += 1
+            if self._slot_freed == None:
+                self._slot_freed = asyncio.Condition()
+            try:
+                async with self._slot_freed:
+                    await asyncio.wait_for(
+                        self._slot_freed.wait_for( lambda: self.pending < self.max_pending ), self.defer_timeout
+                    )
+            except asyncio.TimeoutError:
+                self._reject( REASON_BUSY, guild_id, user_id, self.defer_timeout )
+
+            # Somebody from the same guild might have gotten in while we waited
+            if self.guild_pending[ guild_id ] >= self.max_pending_per_guild:
+                self._reject( REASON_GUILD_BUSY, guild_id, user_id )
+
+        self.pending += 1
+        self.guild_pending[ guild_id ] += 1
+
+    async def _release_slot( self, guild_id ):
+        self.pending -= 1
+        self.guild_pending[ guild_id ] -= 1
+        if self.guild_pending[ guild_id ] <= 0:
+            del self.guild_pending[ guild_id ]
+        if self._slot_freed != None:
+            async with self._slot_freed:
+                self._slot_freed.notify_all()
+
+    ## Admits a command (costing cost tokens) for as long as the context is open, or raises Rejected
+    @contextlib.asynccontextmanager
+    async def admit( self, guild_id, user_id, cost=1 ):
+        if not self.enabled:
+            yield
+            return
+        # Checked before waiting for a slot (so rate limited commands get turned away right away), and again once we
+        # have one, since the same user (or guild) might have used the tokens up in the meantime
+        self._check_rates( guild_id, user_id, cost )
+        await self._acquire_slot( guild_id, user_id )
+        try:
+            user_bucket, guild_bucket = self._check_rates( guild_id, user_id, cost )
+        except Rejected:
+            await self._release_slot( guild_id )
+            raise
+        user_bucket.take( cost )
+        guild_bucket.take( cost )
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            await self._release_slot( guild_id )
+
+    ## Returns the admission counters
+    def stats( self ):
+        return {
+            'admitted': self.admitted,
+            'deferred': self.deferred,
+            'rejected': sum( self.rejected.values() ),
+            'pending': self.pending
+        }
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,146 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# audio_cache.py
+#
+# This file contains the (opt-in) on-disk audio cache for the discord music bot. Tracks which get played often are
+# downloaded once and stored as Ogg/Opus, so replays don't need YouTube (or a transcode) at all.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import asyncio
+import collections
+import logging
+import os
+
+import ytdl_utils
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+CACHE_DIR = "audio_cache/"
+CACHE_EXT = ".opus"
+
+MAX_MEGABYTES = 1024
+
+# How many times a track has to be played before we bother downloading it
+MIN_PLAYS = 2
+
+# How many play counts we remember (for tracks which aren't cached yet)
+MAX_TRACKED_PLAYS = 10000
+
+log = logging.getLogger( __name__ )
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+Size-capped, LRU-evicted cache of Ogg/Opus files, keyed by video id.
+
+Downloads run on the extraction pool's download workers (so they never take a slot from queueing or searching), and
+youtube_dl's FFmpegExtractAudio postprocessor remuxes the (usually already Opus) audio into an .opus file without
+re-encoding it.
+"""
+class AudioCache:
+
+    ## Constructor
+    def __init__( self, pool, directory=CACHE_DIR, max_megabytes=MAX_MEGABYTES, min_plays=MIN_PLAYS ):
+        self.pool = pool
+        self.directory = directory
+        self.max_bytes = max_megabytes * 1024 * 1024
+        self.min_plays = min_plays
+
+        # video id -> file size, least recently used first
+        self.files = collections.OrderedDict()
+        self.total_bytes = 0
+        self.play_counts = collections.OrderedDict()
+        self.downloading = set()
+
+        os.makedirs( self.directory, exist_ok=True )
+        self._scan()
+
+    ## Picks up the files left behind by previous runs, oldest first
+    def _scan( self ):
+        found = []
+        for name in os.listdir( self.directory ):
+            if name.endswith( CACHE_EXT ):
+                path = os.path.join( self.directory, name )
+                stat = os.stat( path )
+                found.append( ( stat.st_mtime, name[ :-len( CACHE_EXT ) ], stat.st_size ) )
+
+        for _, video_id, size in sorted( found ):
+            self.files[ video_id ] = size
+            self.total_bytes += size
+
+    ## Builds the path of a cached track
+    def path_for( self, video_id ):
+        return os.path.join( self.directory, video_id + CACHE_EXT )
+
+    ## Returns the path of a cached track (marking it as recently used), or None if it isn't cached
+    def lookup( self, video_id ):
+        if video_id not in self.files:
+            return None
+
+        path = self.path_for( video_id )
+        if not os.path.exists( path ):
+            self.total_bytes -= self.files.pop( video_id )
+            return None
+
+        self.files.move_to_end( video_id )
+        # Keep the mtime fresh too, so the LRU order survives a restart
+        os.utime( path )
+        return path
+
+    ## Counts a play of a song, and downloads it in the background once it's popular enough
+    def record_play( self, song, guild_id=None ):
+        count = self.play_counts.pop( song.id, 0 ) + 1
+        self.play_counts[ song.id ] = count
+        while len( self.play_counts ) > MAX_TRACKED_PLAYS:
+            self.play_counts.popitem( last=False )
+
+        if count >= self.min_plays and song.id not in self.files and song.id not in self.downloading:
+            self.downloading.add( song.id )
+            asyncio.get_event_loop().create_task( self._download( song, guild_id ) )
+
+    ## Downloads a song into the cache
+    async def _download( self, song, guild_id ):
+        options = {
+            'outtmpl': os.path.join( self.directory, '%(id)s.%(ext)s' ),
+            'postprocessors': [ { 'key': 'FFmpegExtractAudio', 'preferredcodec': 'opus' } ]
+        }
+        try:
+            log.info( "Caching audio id=%s title=%r", song.id, song.title )
+            await ytdl_utils.YTDLSource.download_from_url( song.webpage_url, self.pool, guild_id, options )
+
+            path = self.path_for( song.id )
+            if os.path.exists( path ):
+                size = os.path.getsize( path )
+                self.files[ song.id ] = size
+                self.total_bytes += size
+                self.play_counts.pop( song.id, None )
+                self._evict()
+        except Exception:
+            log.exception( "Error while caching audio id=%s", song.id )
+        finally:
+            self.downloading.discard( song.id )
+
+    ## Drops the least recently used files until we're back under the size cap
+    def _evict( self ):
+        while self.total_bytes > self.max_bytes and len( self.files ) > 1:
+            video_id, size = self.files.popitem( last=False )
+            self.total_bytes -= size
+            try:
+                os.remove( self.path_for( video_id ) )
+            except OSError:
+                pass
+
+    ## Returns the cache counters
+    def stats( self ):
+        return {
+            'files': len( self.files ),
+            'megabytes': self.total_bytes / ( 1024 * 1024 ),
+            'downloading': len( self.downloading )
+        }
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,110 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# audio_sources.py
+#
+# This file contains the discord AudioSource wrappers used by the guild players.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import time
+import discord
+
+import metrics
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+# discord.py reads one 20ms frame per read() call
+FRAME_SECONDS = 0.02
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+Wraps an audio source and keeps track of where we are in the track, counting frames as discord.py reads them.
+Also measures the time to audio (how long it took from creating the source until its first frame came out), the
+gap since the previous track ended, and frames which took longer than a frame to read (underruns).
+"""
+class TrackedSource( discord.AudioSource ):
+
+    ## Constructor (previous_end is the perf_counter() time the previous track ended, if there was one)
+    def __init__( self, source, start=0, reason="play", previous_end=None ):
+        self.source = source
+        self.start = start
+        self.reason = reason
+        self.previous_end = previous_end
+        self.frames = 0
+        self.created_at = time.perf_counter()
+        self.time_to_audio = None
+
+    ## Reads the next frame (runs on discord.py's audio thread)
+    def read( self ):
+        started = time.perf_counter()
+        data = self.source.read()
+        finished = time.perf_counter()
+
+        if data:
+            if self.frames == 0:
+                self.time_to_audio = finished - self.created_at
+                metrics.time_to_audio_seconds.observe( self.time_to_audio, self.reason )
+                if self.previous_end != None:
+                    metrics.transition_gap_seconds.observe( finished - self.previous_end )
+            elif finished - started > FRAME_SECONDS:
+                metrics.frame_underruns.inc()
+            self.frames += 1
+        return data
+
+    def is_opus( self ):
+        return self.source.is_opus()
+
+    def cleanup( self ):
+        self.source.cleanup()
+
+    ## Position in the track (in seconds)
+    @property
+    def position( self ):
+        return self.start + self.frames * FRAME_SECONDS
+
+
+"""
+Fades from one (PCM) source into the next: for the first few seconds both get read, and mixed with equal power
+fades, then the outgoing source gets cleaned up and the incoming one plays on by itself.
+"""
+class CrossfadeSource( discord.AudioSource ):
+
+    ## Constructor
+    def __init__( self, outgoing, incoming, seconds ):
+        self.outgoing = outgoing
+        self.incoming = incoming
+        self.frames = max( 1, int( seconds / FRAME_SECONDS ) )
+        self.frame = 0
+
+        # Imported here rather than with the module, so importing the bot doesn't pay for NumPy
+        import pcm_effects
+        self._mix = pcm_effects.crossfade_frames
+
+    ## Reads the next frame (runs on discord.py's audio thread)
+    def read( self ):
+        data = self.incoming.read()
+        if self.outgoing == None or not data:
+            return data
+
+        mixed = self._mix( self.outgoing.read(), data, self.frame, self.frames )
+        self.frame += 1
+        if self.frame >= self.frames:
+            self.outgoing.cleanup()
+            self.outgoing = None
+        return mixed
+
+    def is_opus( self ):
+        return False
+
+    def cleanup( self ):
+        if self.outgoing != None:
+            self.outgoing.cleanup()
+            self.outgoing = None
+        self.incoming.cleanup()
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,99 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# bench_effects.py
+#
+# Offline benchmark for the PCM effect chain: runs one chain per simulated guild, each on its own thread (like
+# discord.py's audio threads) paced at one frame per 20ms, and reports how long each frame took to process against
+# the 20ms frame budget.
+#
+# Usage: python3 benchmarks/bench_effects.py --guilds 100 --seconds 10 --eq bass
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import argparse
+import os
+import sys
+import threading
+import time
+import numpy as np
+
+REPO_DIR = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, REPO_DIR )
+
+import pcm_effects
+
+from bench_player import summarize
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+FRAME_BUDGET = 0.02
+
+#-[ FUNCTION DEFS ]----------------------------------------------------------------------------------------------------#
+
+# Builds a second of test frames: a couple of tones plus a bit of noise, loud enough to keep the limiter busy
+def make_frames():
+    t = np.arange( pcm_effects.SAMPLE_RATE ) / pcm_effects.SAMPLE_RATE
+    signal = 0.5 * np.sin( 2 * np.pi * 80 * t ) + 0.3 * np.sin( 2 * np.pi * 2500 * t )
+    signal += 0.1 * np.random.default_rng( 0 ).standard_normal( len( t ) )
+    pcm = ( np.clip( np.stack( [ signal, signal ], axis=1 ), -1, 1 ) * 32767 ).astype( np.int16 )
+    step = pcm_effects.FRAME_SAMPLES
+    return [ pcm[ i:i + step ].tobytes() for i in range( 0, len( pcm ), step ) ]
+
+# Plays frames through one guild's chain at real time speed, recording how long each one took to process
+def run_guild( frames, args, timings ):
+    chain = pcm_effects.EffectChain( volume=args.volume, eq=args.eq )
+    frame_count = int( args.seconds / FRAME_BUDGET )
+    started = time.perf_counter()
+    for n in range( frame_count ):
+        processing_started = time.perf_counter()
+        chain.process( frames[ n % len( frames ) ] )
+        timings.append( time.perf_counter() - processing_started )
+
+        if not args.unpaced:
+            delay = started + ( n + 1 ) * FRAME_BUDGET - time.perf_counter()
+            if delay > 0:
+                time.sleep( delay )
+
+def run( args ):
+    frames = make_frames()
+    timings = [ [] for _ in range( args.guilds ) ]
+    threads = [ threading.Thread( target=run_guild, args=( frames, args, guild_timings ) )
+                for guild_timings in timings ]
+
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_started
+    cpu = time.process_time() - cpu_started
+
+    values = [ value for guild_timings in timings for value in guild_timings ]
+    over_budget = sum( 1 for value in values if value > FRAME_BUDGET )
+    ordered = sorted( values )
+    p99 = ordered[ min( len( ordered ) - 1, int( len( ordered ) * 0.99 ) ) ]
+
+    print( f"guilds={args.guilds} seconds={args.seconds} eq={args.eq} volume={args.volume} frames={len( values )}" )
+    print( f"Frame processing: {summarize( values )}  p99 {p99 * 1000:7.2f}ms" )
+    print( f"Over the {FRAME_BUDGET * 1000:.0f}ms budget: {over_budget} frames "
+           f"({over_budget / max( 1, len( values ) ) * 100:.2f}%)" )
+    print( f"CPU: {cpu:.2f}s ({cpu / wall * 100:.1f}% of a core, "
+           f"{cpu / max( 1, len( values ) ) * 1e6:.0f}us per frame)" )
+
+#-[ MAIN ]-------------------------------------------------------------------------------------------------------------#
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description="Offline PCM effect chain benchmark" )
+    parser.add_argument( "--guilds", type=int, default=50, help="simulated guilds (one audio thread each)" )
+    parser.add_argument( "--seconds", type=float, default=5, help="how much audio each guild plays" )
+    parser.add_argument( "--eq", choices=sorted( pcm_effects.EQ_PRESETS ), default=None, help="EQ preset to apply" )
+    parser.add_argument( "--volume", type=float, default=1.5, help="gain applied by the chain" )
+    parser.add_argument( "--unpaced", action="store_true", help="process frames as fast as possible" )
+    run( parser.parse_args() )
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,159 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# bench_player.py
+#
+# Offline benchmark for the player: drives the bot's command handlers for N simulated guilds against fake voice
+# clients, a stub YoutubeDL and a local HTTP server (so ffmpeg still does its real work), then reports queue
+# command throughput, track transition latency and CPU per stream.
+#
+# Usage: python3 benchmarks/bench_player.py --guilds 50 --rounds 20
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import argparse
+import asyncio
+import collections
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, REPO_DIR )
+
+import fakes
+
+#-[ FUNCTION DEFS ]----------------------------------------------------------------------------------------------------#
+
+# Imports the bot without connecting it, with the stub extractor in place of youtube_dl
+def load_bot( work_dir ):
+    os.chdir( REPO_DIR )
+    os.environ.setdefault( 'DISCORD_BOT_TOKEN', 'benchmark' )
+
+    import config_utils
+    config_utils.patch_youtube_dl().YoutubeDL = fakes.FakeYoutubeDL
+
+    import discord_yt_audio_bot as bot_module
+    # Keep the benchmark's queues (and plays) out of the real databases
+    bot_module.store.path = os.path.join( work_dir, "player_state.db" )
+    bot_module.history.path = os.path.join( work_dir, "play_history.db" )
+    if bot_module.analyzer != None:
+        bot_module.analyzer.store.path = os.path.join( work_dir, "loudness.db" )
+    return bot_module
+
+# Runs one command handler, timing it (errors are counted, not raised)
+async def run_command( timings, errors, name, command, *args ):
+    started = time.perf_counter()
+    try:
+        await command( *args )
+    except Exception:
+        errors[ name ] += 1
+    timings[ name ].append( time.perf_counter() - started )
+
+# Drives one guild: every round queues a few songs, lists them, toggles the loop modes, skips, and clears
+async def drive_guild( bot_module, ctx, args, timings, errors ):
+    for round_number in range( args.rounds ):
+        for n in range( args.songs_per_round ):
+            url = f"bench:{( ctx.guild.id * 7 + round_number * args.songs_per_round + n ) % args.catalog}"
+            await run_command( timings, errors, 'queue', bot_module.queue, ctx, url )
+        if args.playlist and round_number == 0:
+            await run_command( timings, errors, 'queue_playlist', bot_module.queue, ctx, f"benchlist:{args.playlist}" )
+
+        await run_command( timings, errors, 'list', bot_module.list_queue, ctx )
+        await run_command( timings, errors, 'loop', bot_module.loop_q, ctx )
+        await run_command( timings, errors, 'loop', bot_module.loop_q, ctx )
+
+        # Let some audio play, so there are transitions to measure
+        await asyncio.sleep( args.play_seconds )
+        await run_command( timings, errors, 'next', bot_module.next, ctx )
+        await asyncio.sleep( args.play_seconds )
+
+        if round_number % 2 == 1:
+            await run_command( timings, errors, 'clear', bot_module.clear, ctx )
+
+# Formats a list of seconds as mean / p50 / p95 / max in milliseconds
+def summarize( values ):
+    if not values:
+        return "n/a"
+    ordered = sorted( values )
+    p95 = ordered[ min( len( ordered ) - 1, int( len( ordered ) * 0.95 ) ) ]
+    return ( f"mean {statistics.mean( ordered ) * 1000:7.2f}ms  p50 {ordered[ len( ordered ) // 2 ] * 1000:7.2f}ms  "
+             f"p95 {p95 * 1000:7.2f}ms  max {ordered[-1] * 1000:7.2f}ms" )
+
+async def run( args ):
+    work_dir = tempfile.mkdtemp( prefix="musicbot-bench-" )
+    fakes.make_sample_audio( os.path.join( work_dir, fakes.SAMPLE_FILE ), args.track_seconds )
+    server, base_url = fakes.start_http_server( work_dir )
+
+    fakes.FakeYoutubeDL.stream_url = base_url + fakes.SAMPLE_FILE
+    fakes.FakeYoutubeDL.duration = args.track_seconds
+    fakes.FakeYoutubeDL.extract_delay = args.extract_delay / 1000
+
+    bot_module = load_bot( work_dir )
+    # Simulated guilds queue far faster than people do, so the rate limits would turn most commands away
+    bot_module.gate.enabled = args.admission
+
+    contexts = []
+    for guild_id in range( 1, args.guilds + 1 ):
+        channel = fakes.FakeChannel( guild_id * 1000 )
+        voice_client = fakes.FakeVoiceClient( channel, paced=not args.unpaced )
+        guild = fakes.FakeGuild( guild_id, voice_client )
+        contexts.append( fakes.FakeContext( guild, fakes.FakeMember( guild_id * 1000 + 1, channel ) ) )
+
+    timings = collections.defaultdict( list )
+    errors = collections.Counter()
+    cpu_started = os.times()
+    wall_started = time.perf_counter()
+
+    await asyncio.gather( *[ drive_guild( bot_module, ctx, args, timings, errors ) for ctx in contexts ] )
+
+    wall = time.perf_counter() - wall_started
+    cpu_finished = os.times()
+
+    # Stop everything, so the ffmpeg children get reaped (and show up in the children's CPU time)
+    for ctx in contexts:
+        bot_module.players.remove( ctx.guild.id )
+    await asyncio.sleep( 0.5 )
+    children_cpu = ( os.times().children_user + os.times().children_system ) - \
+                   ( cpu_started.children_user + cpu_started.children_system )
+    bot_cpu = ( cpu_finished.user + cpu_finished.system ) - ( cpu_started.user + cpu_started.system )
+    server.shutdown()
+
+    total_ops = sum( len( values ) for values in timings.values() )
+    gaps = [ gap for ctx in contexts for gap in ctx.guild.voice_client.gaps ]
+    frames = sum( ctx.guild.voice_client.frames for ctx in contexts )
+
+    print( f"guilds={args.guilds} rounds={args.rounds} wall={wall:.2f}s ops={total_ops} "
+           f"throughput={total_ops / wall:.1f} ops/s frames={frames}" )
+    print( "Command latency:" )
+    for name, values in sorted( timings.items() ):
+        print( f"  {name:<15} n={len( values ):<6} errors={errors[ name ]:<4} {summarize( values )}" )
+    print( f"Track transition gap:  n={len( gaps ):<6} {summarize( gaps )}" )
+    print( f"Bot CPU:     {bot_cpu:.2f}s ({bot_cpu / wall * 100:.1f}% of a core)" )
+    print( f"ffmpeg CPU:  {children_cpu:.2f}s "
+           f"({children_cpu / wall / max( 1, args.guilds ) * 100:.2f}% of a core per stream)" )
+    print( f"Metadata cache: {bot_module.meta_cache.stats()}" )
+    print( f"Extraction pool: {bot_module.extractor.stats()}" )
+
+#-[ MAIN ]-------------------------------------------------------------------------------------------------------------#
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description="Offline player benchmark" )
+    parser.add_argument( "--guilds", type=int, default=10, help="simulated guilds" )
+    parser.add_argument( "--rounds", type=int, default=10, help="command rounds per guild" )
+    parser.add_argument( "--songs-per-round", type=int, default=3, help="songs queued per round" )
+    parser.add_argument( "--catalog", type=int, default=50, help="distinct videos the guilds pick from" )
+    parser.add_argument( "--playlist", type=int, default=0, help="also queue a playlist of this many videos" )
+    parser.add_argument( "--track-seconds", type=float, default=2, help="length of the served test track" )
+    parser.add_argument( "--play-seconds", type=float, default=0.5, help="how long to let audio play per round" )
+    parser.add_argument( "--extract-delay", type=float, default=50, help="stub extraction time (ms)" )
+    parser.add_argument( "--unpaced", action="store_true", help="read frames as fast as possible" )
+    parser.add_argument( "--admission", action="store_true", help="keep admission control (rate limits) on" )
+    asyncio.run( run( parser.parse_args() ) )
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
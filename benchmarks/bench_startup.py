@@ -0,0 +1,90 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# bench_startup.py
+#
+# Startup benchmark: times importing the bot (in fresh interpreters, without connecting), breaks the import time down
+# by package with python's -X importtime, and times what got moved off the import path (bringing up an extraction
+# worker, which is where youtube_dl gets imported now).
+#
+# Usage: python3 benchmarks/bench_startup.py --runs 5 --top 15
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import argparse
+import collections
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+IMPORT_BOT = "import discord_yt_audio_bot"
+
+# Brings up one extraction worker the way the pool does, printing how long it took (in seconds)
+WARM_UP_WORKER = """
+import time
+import config_utils, extraction_pool
+started = time.perf_counter()
+extraction_pool._init_worker( config_utils.get_yt_dl_config() )
+extraction_pool._warm_up()
+print( time.perf_counter() - started )
+"""
+
+#-[ FUNCTION DEFS ]----------------------------------------------------------------------------------------------------#
+
+# Runs python code in a fresh interpreter (from the repo directory), returns ( wall seconds, stdout, stderr )
+def run_python( code, *flags ):
+    env = dict( os.environ, DISCORD_BOT_TOKEN=os.environ.get( 'DISCORD_BOT_TOKEN', 'benchmark' ) )
+    started = time.perf_counter()
+    result = subprocess.run( [ sys.executable, *flags, "-c", code ], cwd=REPO_DIR, env=env,
+                             capture_output=True, text=True, check=True )
+    return time.perf_counter() - started, result.stdout, result.stderr
+
+# Adds up the self time (in seconds) of every module in -X importtime output, by top level package
+def parse_import_times( stderr ):
+    by_package = collections.Counter()
+    for line in stderr.splitlines():
+        if not line.startswith( "import time:" ) or "self [us]" in line:
+            continue
+        self_us, _, name = [ part.strip() for part in line[ len( "import time:" ): ].split( "|" ) ]
+        by_package[ name.split( "." )[0] ] += int( self_us ) / 1e6
+    return by_package
+
+# Formats a list of seconds as mean / min / max in milliseconds
+def summarize( values ):
+    return ( f"mean {statistics.mean( values ) * 1000:7.1f}ms  min {min( values ) * 1000:7.1f}ms  "
+             f"max {max( values ) * 1000:7.1f}ms" )
+
+def run( args ):
+    interpreter = [ run_python( "pass" )[0] for _ in range( args.runs ) ]
+    imports = [ run_python( IMPORT_BOT )[0] for _ in range( args.runs ) ]
+    warm_ups = [ float( run_python( WARM_UP_WORKER )[1] ) for _ in range( args.runs ) ]
+
+    _, _, stderr = run_python( IMPORT_BOT, "-X", "importtime" )
+    by_package = parse_import_times( stderr )
+
+    print( f"runs={args.runs}" )
+    print( f"Bare interpreter:      {summarize( interpreter )}" )
+    print( f"Interpreter + bot:     {summarize( imports )}" )
+    print( f"Extraction worker up:  {summarize( warm_ups )}  (after connecting, off the event loop)" )
+    print( f"Import time by package (self time, {sum( by_package.values() ) * 1000:.1f}ms total):" )
+    for package, seconds in by_package.most_common( args.top ):
+        print( f"  {package:<30} {seconds * 1000:8.1f}ms" )
+
+#-[ MAIN ]-------------------------------------------------------------------------------------------------------------#
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description="Startup and import time benchmark" )
+    parser.add_argument( "--runs", type=int, default=5, help="fresh interpreters per measurement" )
+    parser.add_argument( "--top", type=int, default=15, help="packages to list in the import time breakdown" )
+    run( parser.parse_args() )
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
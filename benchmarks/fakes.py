@@ -0,0 +1,259 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# fakes.py
+#
+# This file contains the stand-ins used by the offline benchmarks: a fake discord voice client (which reads frames
+# on its own thread, like discord.py's AudioPlayer), fake command contexts, a stub YoutubeDL returning canned
+# extract_info() payloads, and a local HTTP server which serves the audio files.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import functools
+import http.server
+import itertools
+import subprocess
+import threading
+import time
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+FRAME_SECONDS = 0.02
+
+# Canned stream URLs never expire during a benchmark
+STREAM_EXPIRY = 4102444800
+
+SAMPLE_FILE = "sample.webm"
+
+#-[ FUNCTION DEFS ]----------------------------------------------------------------------------------------------------#
+
+# Generates a short Opus/webm test tone to serve, like YouTube's format 251
+def make_sample_audio( path, seconds ):
+    subprocess.run(
+        [ "ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+          "-ac", "2", "-ar", "48000", "-c:a", "libopus", "-b:a", "128k", path ],
+        check=True
+    )
+
+# Serves a directory over HTTP on a random local port (on a daemon thread), returns (server, base URL)
+def start_http_server( directory ):
+    handler = functools.partial( _QuietHandler, directory=directory )
+    server = http.server.ThreadingHTTPServer( ( "127.0.0.1", 0 ), handler )
+    threading.Thread( target=server.serve_forever, daemon=True ).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+# Makes an 11 character, YouTube-looking id for the nth catalog entry
+def fake_video_id( n ):
+    return f"bench{n:06d}"
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+class _QuietHandler( http.server.SimpleHTTPRequestHandler ):
+
+    def log_message( self, format, *args ):
+        pass
+
+
+"""
+Stand-in for youtube_dl.YoutubeDL which answers extract_info() with canned payloads pointing at the local HTTP
+server, after sleeping for a configurable extraction delay.
+
+URLs look like bench:<n> for a single video and benchlist:<count> for a playlist of that many videos.
+"""
+class FakeYoutubeDL:
+
+    # Set by the benchmark before any worker builds an instance
+    stream_url = None
+    duration = 1
+    extract_delay = 0.0
+
+    ## Constructor
+    def __init__( self, params=None ):
+        self.params = params or {}
+
+    def _video( self, n ):
+        video_id = fake_video_id( n )
+        return {
+            'id': video_id,
+            'title': f"Benchmark track {n}",
+            'url': f"{FakeYoutubeDL.stream_url}?id={video_id}&expire={STREAM_EXPIRY}",
+            'webpage_url': f"bench:{n}",
+            'duration': FakeYoutubeDL.duration,
+            'acodec': 'opus',
+            'description': "x" * 2000
+        }
+
+    def extract_info( self, url, download=False ):
+        time.sleep( FakeYoutubeDL.extract_delay )
+        kind, _, value = url.partition( ':' )
+
+        if kind == 'benchlist':
+            if self.params.get( 'extract_flat' ):
+                entries = [ { '_type': 'url', 'id': fake_video_id( n ), 'url': f"bench:{n}",
+                              'title': f"Benchmark track {n}" } for n in range( int( value ) ) ]
+            else:
+                entries = [ self._video( n ) for n in range( int( value ) ) ]
+            return { '_type': 'playlist', 'id': url, 'title': "Benchmark playlist", 'entries': entries }
+
+        return self._video( int( value ) )
+
+    def prepare_filename( self, info ):
+        return info['id'] + ".webm"
+
+
+"""
+Stand-in for discord.VoiceClient. Playback runs on its own thread, which reads a frame from the source every 20ms
+(or as fast as it can, when not paced) and calls 'after' once the source runs dry, just like discord.py does.
+It also records the gap between one track ending and the next one's first frame.
+"""
+class FakeVoiceClient:
+
+    ## Constructor
+    def __init__( self, channel, paced=True ):
+        self.channel = channel
+        self.paced = paced
+        self.source = None
+        self.frames = 0
+        self.gaps = []
+
+        # Set once the current track is over (before 'after' gets called), like discord.py's AudioPlayer._end
+        self._end = None
+        self._resumed = threading.Event()
+        self._ended_at = None
+        self._connected = True
+
+    def is_connected( self ):
+        return self._connected
+
+    def is_playing( self ):
+        return self._end != None and not self._end.is_set() and self._resumed.is_set()
+
+    def is_paused( self ):
+        return self._end != None and not self._end.is_set() and not self._resumed.is_set()
+
+    def play( self, source, *, after=None ):
+        if not self._connected:
+            raise RuntimeError( "Not connected to voice." )
+        if self.is_playing():
+            raise RuntimeError( "Already playing audio." )
+        self.source = source
+        self._end = threading.Event()
+        self._resumed.set()
+        threading.Thread( target=self._run, args=( self._end, after ), daemon=True ).start()
+
+    def _run( self, end, after ):
+        error = None
+        first_frame = True
+        next_frame = time.perf_counter()
+        try:
+            while not end.is_set():
+                if not self._resumed.is_set():
+                    self._resumed.wait( 0.1 )
+                    next_frame = time.perf_counter()
+                    continue
+
+                data = self.source.read()
+                if not data:
+                    break
+                if first_frame:
+                    first_frame = False
+                    if self._ended_at != None:
+                        self.gaps.append( time.perf_counter() - self._ended_at )
+                self.frames += 1
+
+                if self.paced:
+                    next_frame += FRAME_SECONDS
+                    time.sleep( max( 0.0, next_frame - time.perf_counter() ) )
+        except Exception as e:
+            error = e
+        finally:
+            end.set()
+            self.source.cleanup()
+            self._ended_at = time.perf_counter()
+            if after != None:
+                after( error )
+
+    def stop( self ):
+        if self._end != None:
+            self._end.set()
+        self._resumed.set()
+
+    def pause( self ):
+        self._resumed.clear()
+
+    def resume( self ):
+        self._resumed.set()
+
+    async def disconnect( self ):
+        self._connected = False
+        self.stop()
+
+
+class FakeChannel:
+
+    def __init__( self, channel_id ):
+        self.id = channel_id
+
+
+class FakeMember:
+
+    def __init__( self, member_id, channel ):
+        self.id = member_id
+        self.name = f"user{member_id}"
+        self.display_name = self.name
+        self.avatar_url = ""
+        self.bot = False
+        self.voice = type( "FakeVoiceState", (), { 'channel': channel } )()
+
+
+class FakeGuild:
+
+    def __init__( self, guild_id, voice_client ):
+        self.id = guild_id
+        self.voice_client = voice_client
+
+
+class FakeMessage:
+
+    _next_id = itertools.count( 1 )
+
+    def __init__( self, content=None, embed=None, author=None, guild=None, channel=None ):
+        self.id = next( FakeMessage._next_id )
+        self.content = content
+        self.embed = embed
+        self.author = author
+        self.guild = guild
+        self.channel = channel
+        self.reactions = []
+        self.edits = 0
+
+    async def edit( self, content=None, embed=None ):
+        self.content = content if content != None else self.content
+        self.embed = embed if embed != None else self.embed
+        self.edits += 1
+
+    async def add_reaction( self, emoji ):
+        self.reactions.append( emoji )
+
+
+"""
+Stand-in for a commands.Context; everything the bot sends just gets collected
+"""
+class FakeContext:
+
+    def __init__( self, guild, author ):
+        self.guild = guild
+        self.voice_client = guild.voice_client
+        self.channel = FakeChannel( guild.id * 1000 + 2 )
+        self.message = FakeMessage( author=author, guild=guild, channel=self.channel )
+        self.sent = []
+
+    async def send( self, content=None, embed=None ):
+        message = FakeMessage( content=content, embed=embed, channel=self.channel )
+        self.sent.append( message )
+        return message
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -26,7 +26,7 @@ load_dotenv()
 bot_token = dict( os.environ )[ 'DISCORD_BOT_TOKEN' ]
 
 # Get config information
-ytdl = config_utils.get_yt_dl_from_config()
+ytdl = config_utils.patch_youtube_dl().YoutubeDL( config_utils.get_yt_dl_config() )
 ffmpeg_options = config_utils.get_ffmpeg_options_from_config()
 
 # Set up discord bot intents and client
@@ -0,0 +1,297 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# broadcast.py
+#
+# This file contains the broadcast ("radio station") mode for the discord music bot. A station decodes (and, if it
+# has to, encodes) its stream once, and every voice channel tuned in gets handed the very same Opus frames.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+import discord
+
+import guild_player
+import metrics
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+# discord.py reads (and we publish) one 20ms frame at a time
+FRAME_SECONDS = 0.02
+
+# How many frames a station keeps around for listeners whose audio thread runs a little behind (one second's worth)
+BUFFER_FRAMES = 50
+
+# How long (in seconds) a listener waits for the next frame before it sends silence instead (e.g. between songs)
+LISTENER_WAIT = 2 * FRAME_SECONDS
+
+# An Opus frame of silence, so listeners keep their connection warm while the station has nothing to play
+SILENCE_FRAME = b'\xf8\xff\xfe'
+
+# How many songs a station's queue holds (like a guild's), and how many stations can be on air at once
+MAX_QUEUE_SIZE = 20
+MAX_STATIONS = 10
+
+log = logging.getLogger( __name__ )
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+Raised when putting another station on air would go over the registry's max_stations
+"""
+class TooManyStations( Exception ):
+    pass
+
+
+"""
+The audio source a tuned in voice client plays: it just hands out the frames its station publishes.
+Frames are shared bytes objects, so a station with a hundred listeners still only holds one copy of each frame.
+"""
+class BroadcastListener( discord.AudioSource ):
+
+    ## Constructor (seq is the last frame this listener got; new listeners start at whatever is on air right now)
+    def __init__( self, station, guild_id, seq ):
+        self.station = station
+        self.guild_id = guild_id
+        self.seq = seq
+
+    ## Reads the next frame (runs on discord.py's audio thread)
+    def read( self ):
+        return self.station.frame_after( self )
+
+    def is_opus( self ):
+        return True
+
+    ## Called by discord.py once the voice client stops playing us (a stop, a disconnect, tuning elsewhere)
+    def cleanup( self ):
+        self.station.unsubscribe( self )
+
+
+"""
+A station: its own queue of songs, played by one ffmpeg process (and one Opus encoder, if the stream isn't Opus
+already) no matter how many voice channels listen in.
+
+A pump thread reads the station's source at real time speed and publishes every frame into a small ring buffer.
+Each listener's audio thread picks up the frame after the last one it got; listeners which fall more than the
+buffer behind skip ahead to the oldest frame still around. Between songs, listeners get silence, so tuned in voice
+clients keep playing until the station goes off air.
+"""
+class BroadcastStation:
+
+    ## Constructor (source_factory and resolver work like the guild players': a song in, an Opus source / a fresh
+    ## stream URL out)
+    def __init__( self, name, source_factory, resolver=None, buffer_frames=BUFFER_FRAMES,
+                  max_queue_size=MAX_QUEUE_SIZE ):
+        self.name = name
+        self.source_factory = source_factory
+        self.resolver = resolver
+        self.max_queue_size = max_queue_size
+        self.songs = collections.deque()
+        self.now_playing = None
+        self.source = None
+
+        # guild id -> listener, guarded by the condition (listeners leave from the audio threads)
+        self.listeners = {}
+        self.frames_published = 0
+
+        self.loop = None
+        self.task = None
+        self._wakeup = asyncio.Event()
+        self._stopped = False
+        self._frames = collections.deque( maxlen=buffer_frames )
+        self._seq = 0
+        self._condition = threading.Condition()
+        self._executor = concurrent.futures.ThreadPoolExecutor( max_workers=1, thread_name_prefix="broadcast" )
+
+    ## Adds a song to the station's queue, and wakes it up (raises guild_player.QueueFull if there's no room)
+    def put( self, song ):
+        if self.is_full():
+            raise guild_player.QueueFull()
+        self.songs.append( song )
+        self._wakeup.set()
+
+    ## Checks if the station's queue has no room left
+    def is_full( self ):
+        return len( self.songs ) >= self.max_queue_size
+
+    ## Tunes a guild in, returning the source its voice client should play; it starts on the current frame
+    def subscribe( self, guild_id ):
+        with self._condition:
+            listener = BroadcastListener( self, guild_id, self._seq )
+            self.listeners[ guild_id ] = listener
+        log.info( "Tuned in station=%s guild=%s listeners=%d", self.name, guild_id, len( self.listeners ) )
+        return listener
+
+    ## Tunes a listener out (if it's still the one listening for its guild)
+    def unsubscribe( self, listener ):
+        with self._condition:
+            if self.listeners.get( listener.guild_id ) is listener:
+                del self.listeners[ listener.guild_id ]
+        log.info( "Tuned out station=%s guild=%s listeners=%d", self.name, listener.guild_id, len( self.listeners ) )
+
+    ## Hands a listener the frame after the last one it got: silence if there's nothing new yet, b'' once the
+    ## station is off air (which makes discord.py stop playing it)
+    def frame_after( self, listener ):
+        with self._condition:
+            self._condition.wait_for( lambda: self._seq > listener.seq or self._stopped, timeout=LISTENER_WAIT )
+            if self._stopped:
+                return b''
+            if self._seq <= listener.seq:
+                return SILENCE_FRAME
+
+            oldest = self._seq - len( self._frames ) + 1
+            listener.seq = max( listener.seq + 1, oldest )
+            return self._frames[ listener.seq - oldest ]
+
+    ## Puts a frame on air
+    def _publish( self, frame ):
+        with self._condition:
+            self._frames.append( frame )
+            self._seq += 1
+            self._condition.notify_all()
+
+    ## Reads a source at real time speed until it runs out (runs on the station's pump thread)
+    def _pump( self, source ):
+        started = time.perf_counter()
+        frames = 0
+        while not self._stopped:
+            frame = source.read()
+            if not frame:
+                break
+            self._publish( frame )
+            frames += 1
+            delay = started + frames * FRAME_SECONDS - time.perf_counter()
+            if delay > 0:
+                time.sleep( delay )
+        self.frames_published += frames
+        metrics.broadcast_frames.inc( self.name, amount=frames )
+
+    ## Starts the station's coroutine (if it isn't already running)
+    def start( self, loop=None ):
+        if self.task == None or self.task.done():
+            self.loop = loop or asyncio.get_event_loop()
+            self.task = self.loop.create_task( self._run() )
+
+    ## Takes the station off air: every listener stops, and so does whatever is playing
+    def stop( self ):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self.songs.clear()
+        if self.task != None:
+            self.task.cancel()
+            self.task = None
+        self._executor.shutdown( wait=False )
+
+    ## Plays the station's songs one after the other, for as long as the station is on air
+    async def _run( self ):
+        while not self._stopped:
+            if not self.songs:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            song = self.songs.popleft()
+            self.now_playing = song
+            log.info( "Broadcasting stream station=%s id=%s title=%r", self.name, song.id, song.title )
+            try:
+                if self.resolver != None and song.needs_resolve():
+                    await self.resolver( song, None, False )
+                self.source = self.source_factory( song )
+                await self.loop.run_in_executor( self._executor, self._pump, self.source )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception( "Error while broadcasting station=%s id=%s", self.name, song.id )
+            finally:
+                if self.source != None:
+                    self.source.cleanup()
+                    self.source = None
+                self.now_playing = None
+
+    ## Returns the station's ffmpeg process (if it's running), so it doesn't get mistaken for a stray one
+    def ffmpeg_process( self ):
+        process = getattr( self.source, '_process', None )
+        if process == None or process.poll() != None:
+            return None
+        return process
+
+    ## Returns the station counters
+    def stats( self ):
+        return {
+            'name': self.name,
+            'listeners': len( self.listeners ),
+            'queued': len( self.songs ),
+            'frames': self.frames_published,
+            'now_playing': self.now_playing.title if self.now_playing != None else None
+        }
+
+
+"""
+Holds the stations which are on air, by name
+"""
+class StationRegistry:
+
+    ## Constructor
+    def __init__( self, source_factory, resolver=None, max_queue_size=MAX_QUEUE_SIZE, max_stations=MAX_STATIONS ):
+        self.source_factory = source_factory
+        self.resolver = resolver
+        self.max_queue_size = max_queue_size
+        self.max_stations = max_stations
+        self.stations = {}
+
+    ## Returns the station with the given name, putting it on air if it isn't yet (raises TooManyStations if
+    ## max_stations are on air already)
+    def get( self, name ):
+        station = self.stations.get( name )
+        if station == None:
+            if len( self.stations ) >= self.max_stations:
+                raise TooManyStations()
+            station = BroadcastStation( name, self.source_factory, resolver=self.resolver,
+                                        max_queue_size=self.max_queue_size )
+            self.stations[ name ] = station
+            log.info( "Station on air station=%s", name )
+        station.start()
+        return station
+
+    ## Returns the station with the given name, without putting it on air
+    def peek( self, name ):
+        return self.stations.get( name )
+
+    ## Returns the station a guild is tuned in to, or None
+    def station_of( self, guild_id ):
+        for station in self.stations.values():
+            if guild_id in station.listeners:
+                return station
+        return None
+
+    ## Takes a station off air; returns False if there was no such station
+    def remove( self, name ):
+        station = self.stations.pop( name, None )
+        if station == None:
+            return False
+        station.stop()
+        log.info( "Station off air station=%s", name )
+        return True
+
+    ## Returns the pids of every station's ffmpeg process
+    def ffmpeg_pids( self ):
+        processes = [ station.ffmpeg_process() for station in self.stations.values() ]
+        return { process.pid for process in processes if process != None }
+
+    ## Returns how many voice channels listen to each station
+    def listener_counts( self ):
+        return { ( name, ): len( station.listeners ) for name, station in self.stations.items() }
+
+    def __len__( self ):
+        return len( self.stations )
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -11,25 +11,59 @@
 
 #-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
 
+import functools
 import json
-import youtube_dl
+import os
 
 #-[ CONSTANT DEFS ]----------------------------------------------------------------------------------------------------#
 
 CONFIG_DIR          = "configs/"
 YT_DL_CONFIG_FILE   = CONFIG_DIR + "youtube_dl_format.json"
 FFMPEG_CONFIG_FILE  = CONFIG_DIR + "ffmpeg_options.json"
+EXTRACTION_CONFIG_FILE = CONFIG_DIR + "extraction_options.json"
+AUDIO_CACHE_CONFIG_FILE = CONFIG_DIR + "audio_cache_options.json"
+SHARD_CONFIG_FILE   = CONFIG_DIR + "shard_options.json"
+QUEUE_CONFIG_FILE   = CONFIG_DIR + "queue_options.json"
+IDLE_CONFIG_FILE    = CONFIG_DIR + "idle_options.json"
+LOUDNESS_CONFIG_FILE = CONFIG_DIR + "loudness_options.json"
+ADMISSION_CONFIG_FILE = CONFIG_DIR + "admission_options.json"
 
-# Suppress bug report messages
-youtube_dl.utils.bug_report_message = lambda: "..."
+# What every config section needs to have (key -> allowed types), checked once when the configs get loaded
+REQUIRED_OPTIONS = {
+    'youtube_dl': { 'format': str },
+    'ffmpeg': { 'options': str },
+    'extraction': { 'backend': str, 'workers': int, 'max_concurrent': int, 'max_per_guild': int },
+    'audio_cache': { 'enabled': bool },
+    'shard': {},
+    'queue': { 'max_size': int, 'fair': bool, 'guild_max_sizes': dict },
+    'idle': { 'idle_timeout': ( int, float ), 'alone_timeout': ( int, float ), 'ffmpeg_grace': ( int, float ),
+              'check_interval': ( int, float ) },
+    'loudness': { 'enabled': bool },
+    'admission': { 'enabled': bool, 'max_pending': int, 'max_pending_per_guild': int },
+}
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+Raised when a config file is missing a setting, or has one of the wrong type
+"""
+class ConfigError( ValueError ):
+    pass
 
 #-[ FUNCTION DEFS ]----------------------------------------------------------------------------------------------------#
 
-# Grabs the JSON configs and creates an appropriate youtube_dl object
-def get_yt_dl_from_config( path=YT_DL_CONFIG_FILE ):
+# Imports youtube_dl (the first time, that's a few hundred extractors) with its bug report messages suppressed.
+# Only the extraction workers need it, so importing the bot doesn't pay for it.
+def patch_youtube_dl():
+    import youtube_dl
+    youtube_dl.utils.bug_report_message = lambda: "..."
+    return youtube_dl
+
+# Grabs the youtube_dl config dict from JSON
+def get_yt_dl_config( path=YT_DL_CONFIG_FILE ):
     with open( path ) as json_file:
         yt_dl_config = json.load( json_file )
-    return youtube_dl.YoutubeDL( yt_dl_config )
+    return yt_dl_config
 
 # Grabs the FFMPEG config dict from JSON
 def get_ffmpeg_options_from_config( path=FFMPEG_CONFIG_FILE ):
@@ -37,4 +71,102 @@ def get_ffmpeg_options_from_config( path=FFMPEG_CONFIG_FILE ):
         ffmpeg_options = json.load( json_file )
     return ffmpeg_options
 
+# Grabs the extraction pool settings (backend, workers and concurrency caps) from JSON
+def get_extraction_options_from_config( path=EXTRACTION_CONFIG_FILE ):
+    with open( path ) as json_file:
+        extraction_options = json.load( json_file )
+    return extraction_options
+
+# Grabs the on-disk audio cache settings from JSON
+def get_audio_cache_options_from_config( path=AUDIO_CACHE_CONFIG_FILE ):
+    with open( path ) as json_file:
+        audio_cache_options = json.load( json_file )
+    return audio_cache_options
+
+# Grabs the queue settings from JSON: the default queue size, per-guild sizes (keyed by guild id), and whether
+# queues take turns between requesters by default
+def get_queue_options_from_config( path=QUEUE_CONFIG_FILE ):
+    with open( path ) as json_file:
+        queue_options = json.load( json_file )
+    # JSON keys are always strings, guild ids aren't
+    queue_options['guild_max_sizes'] = {
+        int( guild_id ): size for guild_id, size in queue_options.get( 'guild_max_sizes', {} ).items()
+    }
+    return queue_options
+
+# Grabs the idle manager settings from JSON (timeouts and check interval, in seconds)
+def get_idle_options_from_config( path=IDLE_CONFIG_FILE ):
+    with open( path ) as json_file:
+        idle_options = json.load( json_file )
+    return idle_options
+
+# Grabs the loudness normalization settings from JSON
+def get_loudness_options_from_config( path=LOUDNESS_CONFIG_FILE ):
+    with open( path ) as json_file:
+        loudness_options = json.load( json_file )
+    return loudness_options
+
+# Grabs the admission control settings (rate limits and pending caps for extraction-heavy commands) from JSON
+def get_admission_options_from_config( path=ADMISSION_CONFIG_FILE ):
+    with open( path ) as json_file:
+        admission_options = json.load( json_file )
+    return admission_options
+
+# Turns a shard range like "0-3" or "4,5,6" into a list of shard ids (lists are passed through)
+def parse_shard_ids( shard_ids ):
+    if shard_ids == None or isinstance( shard_ids, list ):
+        return shard_ids
+    ids = []
+    for part in str( shard_ids ).split( ',' ):
+        first, _, last = part.strip().partition( '-' )
+        ids.extend( range( int( first ), int( last or first ) + 1 ) )
+    return ids
+
+# Grabs the sharding settings from JSON. SHARD_COUNT and SHARD_IDS in the environment win over the file, so every
+# process of a multi-process deployment can share one config and just get its own shard range.
+def get_shard_options_from_config( path=SHARD_CONFIG_FILE ):
+    with open( path ) as json_file:
+        shard_options = json.load( json_file )
+
+    if os.environ.get( 'SHARD_COUNT' ):
+        shard_options['shard_count'] = int( os.environ['SHARD_COUNT'] )
+    if os.environ.get( 'SHARD_IDS' ):
+        shard_options['shard_ids'] = os.environ['SHARD_IDS']
+    shard_options['shard_ids'] = parse_shard_ids( shard_options.get( 'shard_ids' ) )
+
+    if shard_options['shard_ids'] != None and shard_options.get( 'shard_count' ) == None:
+        raise ValueError( "shard_count has to be set when shard_ids are" )
+    return shard_options
+
+# Checks that a config section has every required setting, with the right type
+def validate_options( section, options ):
+    if not isinstance( options, dict ):
+        raise ConfigError( f"{section} config has to be a JSON object" )
+    for key, types in REQUIRED_OPTIONS[ section ].items():
+        if key not in options:
+            raise ConfigError( f"{section} config is missing '{key}'" )
+        # bools are ints too, but a number setting set to true is a mistake
+        if not isinstance( options[ key ], types ) or ( isinstance( options[ key ], bool ) and types is not bool ):
+            raise ConfigError( f"{section} config has the wrong type for '{key}': {options[ key ]!r}" )
+    return options
+
+# Loads (and validates) every config file, once; later calls get the same sections back, so callers copy a section
+# before changing it
+@functools.lru_cache( maxsize=None )
+def load_config():
+    config = {
+        'youtube_dl': get_yt_dl_config(),
+        'ffmpeg': get_ffmpeg_options_from_config(),
+        'extraction': get_extraction_options_from_config(),
+        'audio_cache': get_audio_cache_options_from_config(),
+        'shard': get_shard_options_from_config(),
+        'queue': get_queue_options_from_config(),
+        'idle': get_idle_options_from_config(),
+        'loudness': get_loudness_options_from_config(),
+        'admission': get_admission_options_from_config(),
+    }
+    for section, options in config.items():
+        validate_options( section, options )
+    return config
+
 #-[ END ]--------------------------------------------------------------------------------------------------------------#
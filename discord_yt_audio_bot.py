@@ -12,138 +12,357 @@
 #-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
 
 import os
-import queue
+import asyncio
+import collections
+import logging
+import math
+import re
+import time
 import config_utils
+import admission
 import ytdl_utils
+import guild_player
+import metadata_cache
+import extraction_pool
+import audio_cache
+import broadcast
+import queue_store
+import play_history
+import queue_view
+import idle_manager
+import loudness
+import metrics
 import discord
-import datetime
 
 from dotenv import load_dotenv
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 #-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
 
-MAX_QUEUE_SIZE = 20
+# How often (in seconds) we look for idle guild players to evict
+EVICT_INTERVAL = 60
 
-# one second less than a full day, keeps formatting issues easy later (technically this is a limitation of the bot).
-MAX_TIMESTAMP = 86399
+# How often (in seconds) we save the playback position of every playing guild
+CHECKPOINT_INTERVAL = 15
+
+# How many playlist entries we queue between progress updates
+PLAYLIST_PROGRESS_INTERVAL = 10
+
+# How many results m!search shows, how long (in seconds) we wait for a pick, and how long we remember a search
+SEARCH_RESULTS = 5
+SEARCH_PICK_TIMEOUT = 30
+SEARCH_CACHE_TTL = 600
+
+# How loud m!volume goes (in percent); the volume transformer clips past this
+MAX_VOLUME_PERCENT = 200
+
+# The longest crossfade (in seconds) m!crossfade allows
+MAX_CROSSFADE_SECONDS = 12
+
+# How many saved guilds reconnect to voice at once when a shard comes up
+RESTORE_CONCURRENCY = 8
+
+# What a new broadcast station can be called
+STATION_NAME_REGEX = re.compile( r'[A-Za-z0-9_-]{1,32}' )
 
 #-[ INIT DEFS ]--------------------------------------------------------------------------------------------------------#
 
-# Load bot token from environment file
+# Load the environment file (the token only gets read by main(), but SHARD_COUNT and friends can live in there too)
 load_dotenv()
-bot_token = dict( os.environ )[ 'DISCORD_BOT_TOKEN' ]
+log = logging.getLogger( "musicbot" )
+
+# Get config information (read and validated once). Importing this module doesn't connect or extract anything:
+# the extraction workers, and youtube_dl with them, only come up once the bot is ready (see main())
+config = config_utils.load_config()
+extractor = extraction_pool.ExtractionPool( config['youtube_dl'], **config['extraction'] )
+ffmpeg_options = config['ffmpeg']
+
+# Cache extracted metadata, so popular videos don't get extracted over and over
+meta_cache = metadata_cache.MetadataCache()
+ytdl_utils.YTStreamData.metadata_cache = meta_cache
+
+# Search listings get their own cache, so they don't push video metadata out of the main one
+search_cache = metadata_cache.MetadataCache( max_entries=128, default_ttl=SEARCH_CACHE_TTL )
+
+# Save queues to disk, so restarts don't wipe them
+store = queue_store.QueueStore()
+
+# Queue sizes (per guild, if configured) and the default queueing mode
+queue_options = config['queue']
+started = False
+restored_shards = set()
+
+# Optionally keep popular tracks on disk as Opus, so replays skip YouTube (and the transcode)
+audio_cache_options = dict( config['audio_cache'] )
+disk_cache = None
+if audio_cache_options.pop( 'enabled', False ):
+    disk_cache = audio_cache.AudioCache( extractor, **audio_cache_options )
+
+# Optionally measure every track's loudness once, so later plays come out at the same level with a static gain
+loudness_options = dict( config['loudness'] )
+analyzer = None
+if loudness_options.pop( 'enabled', False ):
+    analyzer = loudness.LoudnessAnalyzer( **loudness_options )
 
-# Get config information
-ytdl = config_utils.get_yt_dl_from_config()
-ffmpeg_options = config_utils.get_ffmpeg_options_from_config()
+# Rate limits (per user and per guild) and a cap on how many extraction-heavy commands run at once, so one busy
+# guild can't slow down extraction for everybody else; playlists cost more tokens than single videos
+gate = admission.AdmissionController( **config['admission'] )
 
-# Set up discord bot intents and client
-intents = discord.Intents().all()
-client = discord.Client( intents=intents )
+# Only ask the gateway for what the music features need: guilds, voice states, (command) messages and reactions
+# (for paging through the queue)
+intents = discord.Intents.none()
+intents.guilds = True
+intents.voice_states = True
+intents.messages = True
+intents.reactions = True
 
-# Set up queue for multiple YT vids
-yt_queue = queue.Queue( maxsize=MAX_QUEUE_SIZE )
-loop_queue = False
-loop_current = False
-now_playing = None
+# Shard settings (everything left as null means discord decides how many shards, all in this process)
+shard_options = config['shard']
 
 #-[ BOT DEFS ]---------------------------------------------------------------------------------------------------------#
 
-# Create the bot
-bot = commands.Bot( command_prefix="m!", intents=intents,
-                   description='Mansley Music LTD' )
+# Create the bot (automatically sharded, optionally only for a range of shards)
+bot = commands.AutoShardedBot( command_prefix="m!", intents=intents,
+                               description='Mansley Music LTD', **shard_options )
 
 """
-This function is a prep for playing the next song.
-We want to check if we're looping a song or the whole queue, and adjust
-how to play the next song accordingly.
+Builds the audio source for a song; the guild players call this whenever they start a new track.
+Opus audio (disk cached tracks, and most YouTube streams) gets passed straight through by ffmpeg, so neither
+ffmpeg nor discord.py has to transcode it. Everything else falls back to PCM, which discord.py encodes itself.
 """
-def play_next( ctx ):
+def create_source( current_song, guild_id, start=0 ):
+    # '-ss' before the input makes ffmpeg seek on the input side (quick), and plain seconds work for any length
+    seek_options = '-ss ' + str( start )
 
-    global now_playing
-    global loop_queue
-    global loop_current
+    # Streams get ffmpeg's reconnect flags on top, so a dropped connection doesn't end the song
+    source = current_song.url
+    before_options = seek_options + ' ' + ffmpeg_options.get( 'stream_before_options', '' )
+    is_opus = current_song.is_opus()
 
-    # Check if the voice channel is still active
-    server = ctx.message.guild
-    voice_channel = server.voice_client
+    if disk_cache != None:
+        cached_path = disk_cache.lookup( current_song.id )
+        if cached_path != None:
+            log.debug( "Playing from the audio cache guild=%s id=%s", guild_id, current_song.id )
+            source, before_options, is_opus = cached_path, seek_options, True
+        else:
+            disk_cache.record_play( current_song, guild_id )
 
-    # If we're not in a voice channel, leave
-    if voice_channel == None:
-        print( "We're not in a voice channel, stopping..." )
-        return
+    # Anything but the track's own level (or any effect) needs decoding: the effect chain applies it as a static gain
+    level = get_playback_level( current_song, guild_id )
+    player = players.peek( guild_id )
+    if not loudness.is_unity( level ) or ( player != None and player.needs_pcm() ):
+        return ytdl_utils.YTDLSource(
+            discord.FFmpegPCMAudio( source=source, options=ffmpeg_options['options'], before_options=before_options ),
+            data=current_song.to_dict(), volume=level, eq=player.eq if player != None else None
+        )
 
-    # If we're already playing something, wait for the lambda function to trigger the next song
-    if ctx.voice_client.is_playing():
-        print( "Currently playing, waiting for turn..." )
-        return
+    if is_opus:
+        # discord.py turns codec='opus' into '-c:a copy'
+        return discord.FFmpegOpusAudio(
+            source=source,
+            codec='opus',
+            options=ffmpeg_options['options'],
+            before_options=before_options
+        )
 
-    # If we enable loop_current, then get the current song
-    if loop_current:
-        print( "Looping current song" )
-        if now_playing == None:
-            now_playing = None if yt_queue.empty() else yt_queue.get()
+    return discord.FFmpegPCMAudio(
+        source=source,
+        options=ffmpeg_options['options'],
+        before_options=before_options
+    )
 
-    # If we enable loop_queue, then we put the song back on the queue
-    elif loop_queue:
-        print( "Looping queue" )
-        now_playing = None if yt_queue.empty() else yt_queue.get()
-        yt_queue.put( now_playing )
+"""
+Works out the level a song should play at in a guild: the guild's volume, times the song's loudness normalization
+gain (if normalization is on, and the song has been measured). Songs get measured when they're resolved ahead of
+time (see resolve_song), not here: that would open a second stream of the track that's about to play.
+"""
+def get_playback_level( song, guild_id ):
+    player = players.peek( guild_id )
+    volume = player.volume if player != None else 1.0
+    if analyzer == None:
+        return volume
+    analyzer.lookup( song )
+    return loudness.playback_level( song, volume )
 
-    # Otherwise, we just get the next song
-    else:
-        print( "Grabbing next item in queue..." )
-        now_playing = None if yt_queue.empty() else yt_queue.get()
+"""
+Builds the audio source a broadcast station plays. Stations hand the same Opus frames to every channel listening,
+so Opus streams get passed through, and everything else gets encoded (once) by ffmpeg; the loudness gain goes in as
+an ffmpeg filter, since there's no per-guild volume transformer to apply it.
+"""
+def create_broadcast_source( song ):
+    source = song.url
+    before_options = ffmpeg_options.get( 'stream_before_options', '' )
+    codec = 'opus' if song.is_opus() else None
 
-    # Now play the song
-    play_song( ctx, voice_channel, now_playing )
+    if disk_cache != None:
+        cached_path = disk_cache.lookup( song.id )
+        if cached_path != None:
+            source, before_options, codec = cached_path, '', 'opus'
+
+    options = ffmpeg_options['options']
+    if analyzer != None:
+        analyzer.lookup( song )
+        if song.gain != None and not loudness.is_unity( song.gain ):
+            options += ' -filter:a volume={:.3f}'.format( song.gain )
+            codec = None
+
+    return discord.FFmpegOpusAudio( source=source, codec=codec, options=options, before_options=before_options )
 
 """
-Plays the song passed as an argument to this function
+Refreshes the stream URL of a queued song; the guild players prefetch the next few songs with this,
+and force a fresh extraction when a stream gets cut off.
 """
-def play_song( ctx, voice_channel, current_song ):
+async def resolve_song( song, guild_id, force=False ):
+    await ytdl_utils.YTDLSource.resolve_stream(
+        song, extractor, cache=meta_cache, guild_id=guild_id, force=force
+    )
 
-    # Check if the song is not empty
-    if current_song == None:
-        print( "All finished!" )
-        return
+    # Some extractors don't tell us the codec, so ask ffprobe (off the hot path, while the previous song plays)
+    if song.acodec in ( None, 'none' ) and song.url:
+        song.acodec, _ = await discord.FFmpegOpusAudio.probe( song.url )
 
-    # Obtain the appropriate voice channel, then stream the video
-    try:
+    # Upcoming songs get measured while the current one plays, so they start out at the right level
+    if analyzer != None:
+        cached_path = disk_cache.lookup( song.id ) if disk_cache != None else None
+        analyzer.schedule( song, cached_path or song.url )
+    return song
 
-        min_seconds = ( min( current_song.start_time or 0, MAX_TIMESTAMP ) )
-        timestamp = str( datetime.timedelta( seconds=min_seconds ) )
+# The m!list views, which follow the queues as they change
+queue_views = queue_view.QueueViews()
 
-        print( "Playing stream..." )
-        voice_channel.play(
-            discord.FFmpegPCMAudio(
-                source=current_song.url,
-                **ffmpeg_options,
-                before_options='-ss ' + timestamp
-            ), after=lambda x: play_next( ctx )
-        )
-    except Exception as e:
-        print( "Error passing context to play_next()" )
-        print( e )
+# What every guild played (and skipped), which autoplay picks from
+history = play_history.PlayHistory()
+
+# Player changes get saved, and shown in the guild's queue view
+def on_player_change( player ):
+    store.mark_dirty( player )
+    queue_views.mark_changed( player.guild_id )
+
+def on_player_remove( guild_id ):
+    store.mark_deleted( guild_id )
+    queue_views.remove( guild_id )
+    history.forget( guild_id )
+
+# Every song played goes into the guild's history (which gets loaded the first time the guild plays something)
+def on_player_play( player, song ):
+    history.load( player.guild_id )
+    history.record_play( player.guild_id, song )
 
 """
-Obtains appropriate file object to play video from a given URL
+Picks the next song for a guild with autoplay on, from its play history (no extraction involved); None if the
+history has nothing to offer
 """
-async def get_yt_obj_from_url( ctx, url: str ):
-    try:
-        # Left this line here, could be useful but I haven't seen immediate changes without it
-        # async with ctx.typing():
-        print( "Youtube video requested by " + ctx.message.author.display_name )
-        print( "URL: " + url )
-        print( "Retrieving stream..." )
-        yt_objects = await ytdl_utils.YTDLSource.stream_from_url( url, ytdl )
-        return yt_objects
-    except:
-        await ctx.send( "The bot is not currently connected to a voice channel" )
+def recommend_song( player ):
+    song_dict = history.recommend(
+        player.guild_id, player.now_playing.id, exclude={ song.id for song in player.queue }
+    )
+    return ytdl_utils.YTStreamData.from_dict( song_dict ) if song_dict != None else None
+
+# Set up the per-guild players (each one holds its own queue and loop state)
+players = guild_player.PlayerRegistry(
+    create_source, resolver=resolve_song, max_queue_size=queue_options['max_size'],
+    queue_sizes=queue_options['guild_max_sizes'], fair=queue_options['fair'],
+    on_change=on_player_change, on_remove=on_player_remove, on_play=on_player_play, recommender=recommend_song,
+    shard_of=lambda guild_id: guild_player.shard_for_guild( guild_id, bot.shard_count ), settings_of=store.settings_of
+)
+
+# Broadcast stations, which any number of guilds can tune in to
+stations = broadcast.StationRegistry( create_broadcast_source, resolver=resolve_song,
+                                     max_queue_size=queue_options['max_size'] )
+
+# Leaves voice channels nobody listens in anymore, and cleans up after ffmpeg
+idle_options = dict( config['idle'] )
+idle_check_interval = idle_options.pop( 'check_interval' )
+idler = idle_manager.IdleManager( players, **idle_options )
+
+"""
+Reads the ffmpeg processes behind every playing guild: how many there are, and how much CPU each one used so far
+"""
+def get_ffmpeg_stats():
+    processes = { guild_id: player.ffmpeg_process() for guild_id, player in players.players.items() }
+    processes = { guild_id: process for guild_id, process in processes.items() if process != None }
+    cpu = { ( guild_id, ): metrics.get_process_cpu_seconds( process.pid ) for guild_id, process in processes.items() }
+    return len( processes ), { key: value for key, value in cpu.items() if value != None }
+
+# Metrics which get read off the bot's state whenever they're scraped
+metrics.registry.gauge(
+    "musicbot_metadata_cache_lookups", "Metadata cache lookups by result", labels=( "result", ),
+    callback=lambda: { ( "hit", ): meta_cache.hits, ( "miss", ): meta_cache.misses }
+)
+metrics.registry.gauge(
+    "musicbot_metadata_cache_hit_ratio", "Share of metadata cache lookups which were hits",
+    callback=lambda: { (): meta_cache.stats()['hit_rate'] }
+)
+metrics.registry.gauge(
+    "musicbot_extractions_coalesced", "Extraction requests which joined one already in flight",
+    callback=lambda: { (): extractor.coalesced }
+)
+metrics.registry.gauge(
+    "musicbot_admission_pending", "Extraction-heavy commands currently admitted and running",
+    callback=lambda: { (): gate.pending }
+)
+metrics.registry.gauge(
+    "musicbot_active_players", "Guild players currently in memory, per shard", labels=( "shard", ),
+    callback=lambda: collections.Counter( ( player.shard_id, ) for player in players.players.values() )
+)
+metrics.registry.gauge(
+    "musicbot_queue_depth", "Songs waiting in each guild's queue", labels=( "guild", ),
+    callback=lambda: { ( guild_id, ): len( player.queue ) for guild_id, player in players.players.items() }
+)
+metrics.registry.gauge(
+    "musicbot_broadcast_listeners", "Voice channels tuned in to each broadcast station", labels=( "station", ),
+    callback=stations.listener_counts
+)
+metrics.registry.gauge(
+    "musicbot_ffmpeg_processes", "Running ffmpeg processes",
+    callback=lambda: { (): get_ffmpeg_stats()[0] }
+)
+metrics.registry.gauge(
+    "musicbot_ffmpeg_cpu_seconds", "CPU time used by each guild's current ffmpeg process", labels=( "guild", ),
+    callback=lambda: get_ffmpeg_stats()[1]
+)
+
+"""
+Obtains the appropriate file objects to play videos from a given URL, one at a time (playlists come in lazily)
+"""
+async def iter_yt_objs_from_url( ctx, url: str ):
+    # Left this line here, could be useful but I haven't seen immediate changes without it
+    # async with ctx.typing():
+    log.info( "Youtube video requested guild=%s user=%r url=%s", ctx.guild.id, ctx.message.author.display_name, url )
+    async for yt_obj in ytdl_utils.YTDLSource.iter_stream_from_url(
+        url, extractor, cache=meta_cache, guild_id=ctx.guild.id, requester=ctx.message.author.id
+    ):
+        yield yt_obj
+
+"""
+Sends (or updates) the progress message while a playlist is being queued
+"""
+async def report_queue_progress( ctx, message, queued, truncated, done ):
+    text = f"Queued {queued} song(s)"
+    if truncated:
+        text += f", {truncated} didn't fit since the queue is full"
+    text += "." if done else "..."
+
+    if message == None:
+        return await ctx.send( text )
+    await message.edit( content=text )
+    return message
+
+"""
+Turns a rejection from admission control into something to tell the user
+"""
+def rejection_message( rejected ):
+    if rejected.reason == admission.REASON_USER_RATE:
+        return "You're queueing too fast, try again in {:.0f}s.".format( max( 1, rejected.retry_after ) )
+    if rejected.reason == admission.REASON_GUILD_RATE:
+        return "This server is queueing too fast, try again in {:.0f}s.".format( max( 1, rejected.retry_after ) )
+    if rejected.reason == admission.REASON_GUILD_BUSY:
+        return "Still working on this server's last requests, try again in a moment."
+    return "The bot is busy right now, try again in a moment."
 
 """
 Adds a song the queue, and plays the first song.
+Playlists get queued entry by entry, so playback starts as soon as the first entry is in.
 """
 @bot.command( name='queue', aliases=['q'], help='Queues a YT URL for playing' )
 async def queue( ctx, url ):
@@ -153,58 +372,213 @@ async def queue( ctx, url ):
     if url == None or url == "":
         await ctx.send( "Please provide a valid Youtube URL" )
         return
-    try:
-        yt_objects = await get_yt_obj_from_url( ctx, url )
-        print( "Queueing video(s)..." )
-        for yt_obj in yt_objects:
-            yt_queue.put( yt_obj )
-
-        # Start the player if we're not currently playing anything
-        if not (ctx.voice_client.is_playing() or ctx.voice_client.is_paused()):
-            play_next( ctx )
-    except queue.Full:
+    if stations.station_of( ctx.guild.id ) != None:
+        await ctx.send( "Tuned in to a broadcast, use m!untune before queueing songs." )
+        return
+    # No room means nothing to extract (and nothing to charge the rate limits for)
+    player = players.get( ctx.guild.id )
+    if player.is_full():
         await ctx.send( "Queue is full!" )
-    except Exception as e:
+        return
+    try:
+        player.voice_client = ctx.voice_client
+        player.start()
+
+        # The player's scheduler wakes up on the first song and starts playing by itself
+        queued = 0
+        truncated = 0
+        progress = None
+        async with gate.admit( ctx.guild.id, ctx.message.author.id, gate.cost_of( url ) ):
+            async for yt_obj in iter_yt_objs_from_url( ctx, url ):
+                if truncated == 0:
+                    try:
+                        player.put( yt_obj )
+                        queued += 1
+                    except guild_player.QueueFull:
+                        truncated += 1
+                else:
+                    truncated += 1
+
+                if queued > 1 and truncated == 0 and queued % PLAYLIST_PROGRESS_INTERVAL == 0:
+                    progress = await report_queue_progress( ctx, progress, queued, truncated, False )
+
+        if queued == 0 and truncated:
+            await ctx.send( "Queue is full!" )
+        elif queued + truncated > 1:
+            await report_queue_progress( ctx, progress, queued, truncated, True )
+    except admission.Rejected as rejected:
+        await ctx.send( rejection_message( rejected ) )
+    except Exception:
         await ctx.send( "Error found while queueing music..." )
-        print( e )
+        log.exception( "Error found while queueing music guild=%s url=%s", ctx.guild.id, url )
+
+"""
+Formats a duration in seconds like 3:05 (or 1:02:03)
+"""
+def format_duration( seconds ):
+    if seconds == None:
+        return "?"
+    minutes, seconds = divmod( int( seconds ), 60 )
+    hours, minutes = divmod( minutes, 60 )
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+"""
+Searches YouTube, lists the results, and queues whichever one the user picks by replying with its number.
+Only the picked result gets fully extracted (by the player, when it comes up).
+"""
+@bot.command( name='search', aliases=['s'], help='Searches YouTube and lets you pick a result to queue' )
+async def search( ctx, *, query ):
+    log.info( "Youtube search requested guild=%s user=%r query=%r", ctx.guild.id, ctx.message.author.display_name,
+              query )
+    if stations.station_of( ctx.guild.id ) != None:
+        await ctx.send( "Tuned in to a broadcast, use m!untune before queueing songs." )
+        return
+    player = players.peek( ctx.guild.id )
+    if player != None and player.is_full():
+        await ctx.send( "Queue is full!" )
+        return
+    # Only the search itself holds an admission slot, not waiting for the user to pick
+    try:
+        async with gate.admit( ctx.guild.id, ctx.message.author.id ):
+            results = await ytdl_utils.YTDLSource.search(
+                query, extractor, cache=search_cache, guild_id=ctx.guild.id, count=SEARCH_RESULTS,
+                requester=ctx.message.author.id
+            )
+    except admission.Rejected as rejected:
+        await ctx.send( rejection_message( rejected ) )
+        return
+    except Exception:
+        await ctx.send( "Error found while searching..." )
+        log.exception( "Error found while searching guild=%s query=%r", ctx.guild.id, query )
+        return
+
+    if not results:
+        await ctx.send( "No results found!" )
+        return
+
+    results_str = '\n'.join( f"{i+1}:\t {song.title} ({format_duration( song.duration )})"
+                             for i, song in enumerate( results ) )
+    search_embed = discord.Embed( title="Search Results", description=results_str, colour=0xEC6541 )
+    search_embed.set_footer( text=f"Reply with a number (1-{len( results )}) to queue it" )
+    await ctx.send( embed=search_embed )
+
+    def is_pick( message ):
+        return message.author == ctx.message.author and message.channel == ctx.channel and \
+               message.content.strip().isdigit() and 1 <= int( message.content ) <= len( results )
+
+    try:
+        reply = await bot.wait_for( 'message', check=is_pick, timeout=SEARCH_PICK_TIMEOUT )
+    except asyncio.TimeoutError:
+        await ctx.send( "No result picked, search cancelled." )
+        return
+
+    song = results[ int( reply.content ) - 1 ]
+    player = players.get( ctx.guild.id )
+    player.voice_client = ctx.voice_client
+    player.start()
+    try:
+        player.put( song )
+    except guild_player.QueueFull:
+        await ctx.send( "Queue is full!" )
+        return
+    await ctx.send( f"Queued: {song.title}" )
 
 """
-Takes all songs in the music queue, and prints them out in order
-TODO: it may be a good idea to list who queued the song as well...
+Shows the queue, a page at a time. Every guild gets one queue view which keeps itself up to date; asking again in the
+same channel refreshes that view instead of sending a new message.
 """
 @bot.command( name='list', aliases=['l'], help='List videos in the queue' )
 async def list_queue( ctx ):
+    await queue_views.show( ctx, players.get( ctx.guild.id ) )
 
-    global now_playing
-    global loop_queue
-    global loop_current
+"""
+Turns a timestamp like 90, 1:30, 1:02:03 or 1:00:00:00 (days work too) into seconds
+"""
+def parse_timestamp( timestamp: str ):
+    if timestamp.count( ':' ) > 3:
+        raise ValueError( "Invalid timestamp: " + timestamp )
+    seconds = 0.0
+    for part, scale in zip( reversed( timestamp.split( ':' ) ), ( 1, 60, 3600, 86400 ) ):
+        value = float( part )
+        # ffmpeg would take nan, inf or a negative part (like 1:-30) as is
+        if not math.isfinite( value ) or value < 0:
+            raise ValueError( "Invalid timestamp: " + timestamp )
+        seconds += value * scale
+    return seconds
 
-    # Extra information: include if we're looping
-    now_playing_title = "Now Playing (on repeat): " if loop_current else "Now Playing:"
-    queue_title = "Music Queue (on loop)" if loop_queue else "Music Queue"
+"""
+Jumps to a timestamp in the current song
+"""
+@bot.command( name='seek', help='Jumps to a timestamp (e.g. 1:30) in the current song' )
+async def seek( ctx, timestamp ):
+    try:
+        seconds = parse_timestamp( timestamp )
+    except ValueError:
+        await ctx.send( "Please provide a timestamp like 90, 1:30 or 1:02:03" )
+        return
 
-    # Get the current song (if applicable)
-    if now_playing == None:
-        now_playing_str = "Nothing"
-    else:
-        now_playing_str = now_playing.title
+    player = players.peek( ctx.guild.id )
+    if player == None or player.now_playing == None:
+        await ctx.send( "The bot is not playing anything at the moment." )
+        return
 
-    # Get the list of songs on the queue (if not empty)
-    if yt_queue.empty():
-        queue_val = "There are no songs in the queue!"
-    else:
-        yt_queue_list = list( yt_queue.queue )
-        yt_titles_list = [ yt.title for yt in yt_queue_list ]
-        queue_list = [ f"{i+1}:\t {song}" for i, song in enumerate( yt_titles_list ) ]
-        queue_str = '\n'.join( queue_list )
+    time_to_audio = await player.seek( seconds )
+    if time_to_audio != None:
+        log.info( "Seeked guild=%s position=%s time_to_audio_ms=%.0f", ctx.guild.id, seconds, time_to_audio * 1000 )
+    await ctx.send( "Jumped to {}".format( format_duration( seconds ) ) )
 
-    # Create the embed for the queue, and send it
-    list_embed = discord.Embed( title=queue_title, colour=0xEC6541 )
-    list_embed.set_author( name=ctx.message.author.display_name, icon_url=ctx.message.author.avatar_url )
-    list_embed.add_field( name="Up Next:", value=queue_str, inline=False )
-    list_embed.add_field( name=now_playing_title, value=now_playing_str, inline=False )
+"""
+Sets the playback volume (in percent) for the guild, or shows it if no volume is given
+"""
+@bot.command( name='volume', aliases=['vol'], help='Sets the volume in percent (0-200), or shows it' )
+async def volume( ctx, percent: int = None ):
+    player = players.get( ctx.guild.id )
+    if percent == None:
+        await ctx.send( "Volume is at {:.0%}".format( player.volume ) )
+        return
+    if percent < 0 or percent > MAX_VOLUME_PERCENT:
+        await ctx.send( "Please provide a volume between 0 and {}".format( MAX_VOLUME_PERCENT ) )
+        return
+
+    await player.set_volume( percent / 100 )
+    log.info( "Set volume guild=%s volume=%d", ctx.guild.id, percent )
+    await ctx.send( "Volume set to {}%".format( percent ) )
+
+"""
+Sets the EQ preset for the guild ('off' turns it off), or lists the presets if none is given
+"""
+@bot.command( name='eq', help='Sets the EQ preset (bass, treble, vocal, loudness or off)' )
+async def eq( ctx, preset=None ):
+    # NumPy comes with the effects, so they only get imported once somebody asks for them
+    import pcm_effects
+    presets = sorted( pcm_effects.EQ_PRESETS )
+    if preset == None:
+        await ctx.send( "EQ presets: {}, off".format( ", ".join( presets ) ) )
+        return
+    preset = preset.lower()
+    if preset != 'off' and preset not in pcm_effects.EQ_PRESETS:
+        await ctx.send( "Please pick one of: {}, off".format( ", ".join( presets ) ) )
+        return
 
-    await ctx.send( embed=list_embed )
+    await players.get( ctx.guild.id ).set_eq( None if preset == 'off' else preset )
+    log.info( "Set EQ guild=%s preset=%s", ctx.guild.id, preset )
+    await ctx.send( "EQ set to {}".format( preset ) )
+
+"""
+Sets how many seconds songs get crossfaded over (0 turns it off)
+"""
+@bot.command( name='crossfade', aliases=['xf'], help='Crossfades songs over a number of seconds (0 turns it off)' )
+async def crossfade( ctx, seconds: float ):
+    if seconds < 0 or seconds > MAX_CROSSFADE_SECONDS:
+        await ctx.send( "Please provide a crossfade between 0 and {} seconds".format( MAX_CROSSFADE_SECONDS ) )
+        return
+
+    players.get( ctx.guild.id ).set_crossfade( seconds )
+    log.info( "Set crossfade guild=%s seconds=%s", ctx.guild.id, seconds )
+    if seconds > 0:
+        await ctx.send( "Crossfading songs over {:g} seconds".format( seconds ) )
+    else:
+        await ctx.send( "Crossfade disabled" )
 
 """
 Makes the bot stop the current song, and queues the next song
@@ -213,8 +587,11 @@ Makes the bot stop the current song, and queues the next song
 async def next( ctx ):
     voice_client = ctx.message.guild.voice_client
     if voice_client.is_playing() or voice_client.is_paused():
-        print( "Skipping current song..." )
-        voice_client.stop()
+        log.info( "Skipping current song guild=%s", ctx.guild.id )
+        player = players.get( ctx.guild.id )
+        if player.now_playing != None:
+            history.record_skip( ctx.guild.id, player.now_playing )
+        player.skip()
     else:
         await ctx.send( "The bot is not playing anything at the moment." )
 
@@ -224,9 +601,10 @@ NOTE: if we have loop_current enabled, then the bot will prioritize that first!
 """
 @bot.command( name='loop', help='Toggles loop queue' )
 async def loop_q( ctx ):
-    global loop_queue
-    loop_queue = not loop_queue
-    if loop_queue:
+    player = players.get( ctx.guild.id )
+    player.loop_queue = not player.loop_queue
+    player.mark_changed()
+    if player.loop_queue:
         await ctx.send( "Loop queue enabled" )
     else:
         await ctx.send( "Loop queue disabled" )
@@ -237,13 +615,31 @@ When we loop the current song, we ignore the queue loop variable.
 """
 @bot.command( name='loopfirst', aliases=['lfirst'], help='Loops the current song being played' )
 async def loop_s( ctx ):
-    global loop_current
-    loop_current = not loop_current
-    if loop_current:
+    player = players.get( ctx.guild.id )
+    player.loop_current = not player.loop_current
+    player.mark_changed()
+    if player.loop_current:
         await ctx.send( "Looping current song" )
     else:
         await ctx.send( "No longer looping current song" )
 
+"""
+Toggles autoplay: when the queue runs out, songs this guild played before keep coming (the ones that usually follow
+the current song first)
+"""
+@bot.command( name='autoplay', aliases=['radio'], help='Toggles autoplay from the server\'s play history' )
+async def autoplay( ctx ):
+    player = players.get( ctx.guild.id )
+    if not player.autoplay:
+        await history.load( ctx.guild.id )
+    player.set_autoplay( not player.autoplay )
+    if player.autoplay and not history.has_history( ctx.guild.id ):
+        await ctx.send( "Autoplay enabled, but this server hasn't played anything yet for it to pick from" )
+    elif player.autoplay:
+        await ctx.send( "Autoplay enabled" )
+    else:
+        await ctx.send( "Autoplay disabled" )
+
 """
 Pauses the bot voice client.
 """
@@ -251,7 +647,7 @@ Pauses the bot voice client.
 async def pause( ctx ):
     voice_client = ctx.message.guild.voice_client
     if voice_client.is_playing():
-        print( "Pausing..." )
+        log.info( "Pausing guild=%s", ctx.guild.id )
         voice_client.pause()
     else:
         await ctx.send( "The bot is not playing anything at the moment." )
@@ -263,7 +659,7 @@ Resumes the bot voice client (if applicable).
 async def resume( ctx ):
     voice_client = ctx.message.guild.voice_client
     if voice_client.is_paused():
-        print( "Resuming..." )
+        log.info( "Resuming guild=%s", ctx.guild.id )
         voice_client.resume()
     else:
         await ctx.send( "The bot was not playing anything before this. Use 'q' command" )
@@ -275,13 +671,171 @@ Makes the bot stop the current song, and clears the queue
 async def clear( ctx ):
     voice_client = ctx.message.guild.voice_client
     if voice_client.is_playing():
-        print( "Stopping..." )
-        with yt_queue.mutex:
-            yt_queue.queue.clear()
-        voice_client.stop()
+        log.info( "Stopping guild=%s", ctx.guild.id )
+        player = players.get( ctx.guild.id )
+        player.clear()
+        player.skip()
     else:
         await ctx.send( "The bot is not playing anything at the moment." )
 
+"""
+Takes a song (by its number in m!list) off the queue
+"""
+@bot.command( name='remove', aliases=['rm'], help='Removes a song (by its number in the list) from the queue' )
+async def remove( ctx, position: int ):
+    song = players.get( ctx.guild.id ).remove( position - 1 )
+    if song == None:
+        await ctx.send( "There is no song at that position in the queue." )
+    else:
+        await ctx.send( f"Removed: {song.title}" )
+
+"""
+Moves a song (by its number in m!list) to another spot in the queue
+"""
+@bot.command( name='move', aliases=['mv'], help='Moves a song from one position in the queue to another' )
+async def move( ctx, from_position: int, to_position: int ):
+    song = players.get( ctx.guild.id ).move( from_position - 1, to_position - 1 )
+    if song == None:
+        await ctx.send( "There is no song at that position in the queue." )
+    else:
+        await ctx.send( f"Moved: {song.title}" )
+
+"""
+Shuffles the songs waiting on the queue
+"""
+@bot.command( name='shuffle', help='Shuffles the queue' )
+async def shuffle( ctx ):
+    players.get( ctx.guild.id ).shuffle()
+    await ctx.send( "Queue shuffled" )
+
+"""
+Toggles fair mode: songs get played taking turns between whoever queued them, instead of in order
+"""
+@bot.command( name='fair', help='Toggles taking turns between the people queueing songs' )
+async def fair( ctx ):
+    player = players.get( ctx.guild.id )
+    player.set_fair( not player.queue.fair )
+
+    if player.queue.fair:
+        await ctx.send( "Fair queue enabled" )
+    else:
+        await ctx.send( "Fair queue disabled" )
+
+"""
+Tunes the guild's voice client in to a station; anything the guild was playing itself gets stopped
+"""
+def tune_in( ctx, station ):
+    player = players.peek( ctx.guild.id )
+    if player != None:
+        player.stop()
+    if ctx.voice_client.is_playing() or ctx.voice_client.is_paused():
+        ctx.voice_client.stop()
+    ctx.voice_client.play( station.subscribe( ctx.guild.id ) )
+
+"""
+Queues a YT URL on a broadcast station (putting it on air if it isn't yet), and tunes this guild in.
+Every guild tuned in to a station hears the same stream, decoded (and encoded) only once.
+"""
+@bot.command( name='broadcast', aliases=['bc'], help='Queues a YT URL on a broadcast station, and tunes in to it' )
+async def broadcast_url( ctx, name, url ):
+    station = stations.peek( name )
+    if station == None and not STATION_NAME_REGEX.fullmatch( name ):
+        await ctx.send( "Station names are up to 32 letters, digits, - or _" )
+        return
+    if station == None and len( stations ) >= stations.max_stations:
+        await ctx.send( "There are {} stations on air already.".format( len( stations ) ) )
+        return
+    if station != None and station.is_full():
+        await ctx.send( "Queue is full!" )
+        return
+
+    # Nothing goes on air until the songs are in hand, so a rejected (or failed) command doesn't leave an empty
+    # station running
+    songs = []
+    try:
+        async with gate.admit( ctx.guild.id, ctx.message.author.id, gate.cost_of( url ) ):
+            async for yt_obj in iter_yt_objs_from_url( ctx, url ):
+                songs.append( yt_obj )
+                if len( songs ) >= stations.max_queue_size:
+                    break
+    except admission.Rejected as rejected:
+        await ctx.send( rejection_message( rejected ) )
+        return
+    except Exception:
+        await ctx.send( "Error found while queueing music..." )
+        log.exception( "Error found while broadcasting music guild=%s station=%s url=%s", ctx.guild.id, name, url )
+        return
+    if not songs:
+        await ctx.send( "No songs found!" )
+        return
+
+    try:
+        station = stations.get( name )
+    except broadcast.TooManyStations:
+        await ctx.send( "There are {} stations on air already.".format( len( stations ) ) )
+        return
+    queued = 0
+    for song in songs:
+        try:
+            station.put( song )
+            queued += 1
+        except guild_player.QueueFull:
+            break
+
+    if stations.station_of( ctx.guild.id ) is not station:
+        tune_in( ctx, station )
+    if queued < len( songs ):
+        await ctx.send( "Queued {} song(s) on station {}, the rest didn't fit since its queue is full".format(
+            queued, name ) )
+    else:
+        await ctx.send( "Queued on station {}".format( name ) )
+
+"""
+Tunes in to a station which is already on air, picking it up wherever it is right now
+"""
+@bot.command( name='tune', help='Tunes in to a broadcast station' )
+async def tune( ctx, name ):
+    station = stations.peek( name )
+    if station == None:
+        await ctx.send( "There is no station called {}".format( name ) )
+        return
+    tune_in( ctx, station )
+    await ctx.send( "Tuned in to {}".format( name ) )
+
+"""
+Stops listening to whatever station the guild is tuned in to
+"""
+@bot.command( name='untune', help='Stops listening to a broadcast station' )
+async def untune( ctx ):
+    if stations.station_of( ctx.guild.id ) == None:
+        await ctx.send( "Not tuned in to a broadcast station." )
+        return
+    # Stopping the voice client cleans up its listener, which tunes it out
+    ctx.voice_client.stop()
+
+"""
+Takes a station off air, for every guild tuned in to it
+"""
+@bot.command( name='offair', help='Takes a broadcast station off air' )
+async def offair( ctx, name ):
+    if not stations.remove( name ):
+        await ctx.send( "There is no station called {}".format( name ) )
+        return
+    await ctx.send( "Station {} is off air".format( name ) )
+
+"""
+Lists the stations on air
+"""
+@bot.command( name='stations', help='Lists the broadcast stations on air' )
+async def list_stations( ctx ):
+    if not stations.stations:
+        await ctx.send( "No stations on air." )
+        return
+    await ctx.send( "\n".join(
+        "{name}: {listeners} listening, {queued} queued, playing {now_playing}".format( **station.stats() )
+        for station in stations.stations.values()
+    ) )
+
 """
 Manual command for making the bot join the channel the invoking user is in.
 """
@@ -293,6 +847,7 @@ async def join( ctx ):
     else:
         channel = ctx.message.author.voice.channel
     await channel.connect()
+    idler.note_connected( ctx.guild.id )
 
 """
 Manual command for making the bot leave the channel.
@@ -301,36 +856,192 @@ Manual command for making the bot leave the channel.
 async def leave( ctx ):
     voice_client = ctx.message.guild.voice_client
     if voice_client.is_connected():
-        with yt_queue.mutex:
-            yt_queue.queue.clear()
+        players.remove( ctx.guild.id )
         voice_client.stop()
         await voice_client.disconnect()
     else:
         await ctx.send( "The bot is not connected to a voice channel." )
 
+"""
+Reports how well the metadata cache is doing.
+"""
+@bot.command( name='stats', help='Shows metadata cache and extraction statistics' )
+async def stats( ctx ):
+    cache_stats = meta_cache.stats()
+    pool_stats = extractor.stats()
+    await ctx.send(
+        "Metadata cache: {entries} entries, {hits} hits, {misses} misses, {evictions} evictions "
+        "({hit_rate:.0%} hit rate)\n".format( **cache_stats ) +
+        "Extraction pool ({backend}): {extractions} extractions, {coalesced} coalesced, "
+        "{in_flight} in flight".format( **pool_stats ) +
+        "\nAdmission: {admitted} admitted, {deferred} deferred, {rejected} rejected, {pending} pending".format(
+            **gate.stats() ) +
+        ( "\nAudio cache: {files} files, {megabytes:.1f} MB, {downloading} downloading".format(
+            **disk_cache.stats() ) if disk_cache != None else "" ) +
+        "\nPlay history: {guilds} guilds, {tracks} tracks, {pending} pending writes".format( **history.stats() ) +
+        ( "\nLoudness: {tracks} tracks measured, {failures} failures, {analyzing} analyzing".format(
+            **analyzer.stats() ) if analyzer != None else "" )
+    )
+
 """
 Ensures that, if a user is in a voice channel, the bot
 will first ensure that it joins the corresponding channel before playing.
 """
 @queue.before_invoke
+@search.before_invoke
+@broadcast_url.before_invoke
+@tune.before_invoke
 @list_queue.before_invoke
 async def ensure_voice( ctx ):
-    print( "Ensuring bot is in voice channel" )
+    log.debug( "Ensuring bot is in voice channel guild=%s", ctx.guild.id )
     if ctx.voice_client is None:
         if ctx.message.author.voice:
             await ctx.message.author.voice.channel.connect()
+            idler.note_connected( ctx.guild.id )
         else:
             await ctx.send( "You are not connected to a voice channel." )
             raise commands.CommandError( "Author not connected to a voice channel." )
 
+"""
+Periodically drops guild players which have been idle for a while.
+"""
+@tasks.loop( seconds=EVICT_INTERVAL )
+async def evict_idle_players():
+    evicted = players.evict_idle()
+    if evicted:
+        log.info( "Evicted idle guild players evicted=%d active=%d", evicted, len( players ) )
+
+"""
+Periodically leaves the voice channels which went quiet (or empty), takes stations nobody listens to off air, and
+kills ffmpeg processes nobody owns.
+"""
+@tasks.loop( seconds=idle_check_interval )
+async def reap_idle_voice():
+    dropped = await idler.reap( bot.voice_clients )
+    if dropped:
+        log.info( "Left idle voice channels dropped=%d connected=%d", dropped, len( bot.voice_clients ) )
+    if idler.reap_stations( stations ):
+        log.info( "Took unheard stations off air on_air=%d", len( stations ) )
+
+    owned_pids = stations.ffmpeg_pids()
+    for player in players.players.values():
+        owned_pids |= player.ffmpeg_pids()
+    idler.kill_stray_ffmpeg( owned_pids )
+
+"""
+Periodically saves where every playing guild is in its current song.
+"""
+@tasks.loop( seconds=CHECKPOINT_INTERVAL )
+async def checkpoint_players():
+    for player in players.players.values():
+        if player.now_playing != None:
+            store.mark_dirty( player )
+
+"""
+Brings back a guild's player as the last run saved it (slots limits how many guilds do this at once). Saved stream
+URLs which haven't expired yet get played as they are, so we don't re-extract anything we don't have to.
+"""
+async def restore_player( guild_id, slots ):
+    async with slots:
+        state = await store.load( guild_id )
+        guild = bot.get_guild( guild_id )
+        channel = guild.get_channel( state.get( 'channel_id' ) ) if guild != None and state != None else None
+        # Nothing to play means nothing to rejoin the channel for (the guild's settings are kept either way)
+        if channel == None or ( state.get( 'now_playing' ) == None and not state.get( 'queue' ) ):
+            store.mark_deleted( guild_id )
+            return
+
+        try:
+            player = players.get( guild_id )
+            player.restore( state, ytdl_utils.YTStreamData.from_dict )
+            voice_client = guild.voice_client
+            if voice_client == None:
+                voice_client = await channel.connect()
+                idler.note_connected( guild_id )
+            player.voice_client = voice_client
+            player.start()
+            log.info( "Restored player guild=%s songs=%d", guild_id, len( player.queue ) )
+        except Exception:
+            log.exception( "Error while restoring player guild=%s", guild_id )
+
+"""
+Brings back the saved players of one shard's guilds, as soon as that shard is ready (instead of waiting for every
+shard); a few guilds reconnect to voice at a time.
+"""
+async def restore_players( shard_id ):
+    started = time.perf_counter()
+    slots = asyncio.Semaphore( RESTORE_CONCURRENCY )
+    # Other shards (and other processes) restore their own guilds
+    guild_ids = [ guild_id for guild_id in await store.saved_guild_ids()
+                  if guild_player.shard_for_guild( guild_id, bot.shard_count ) == shard_id ]
+    await asyncio.gather( *[ restore_player( guild_id, slots ) for guild_id in guild_ids ] )
+    log.info( "Restored shard shard=%s guilds=%d restore_ms=%.0f", shard_id, len( guild_ids ),
+              ( time.perf_counter() - started ) * 1000 )
+
+"""
+When a shard is ready, bring back its guilds' players (once; shards get ready again after reconnects)
+"""
+@bot.event
+async def on_shard_ready( shard_id ):
+    if shard_id in restored_shards:
+        return
+    # The first shard up also brings the extraction workers up (restored players may need them soon), and loads the
+    # guilds' player settings and the loudness gains measured by previous runs
+    if not restored_shards:
+        bot.loop.create_task( extractor.warm_up() )
+        bot.loop.create_task( store.load_settings() )
+        if analyzer != None:
+            bot.loop.create_task( analyzer.load() )
+    restored_shards.add( shard_id )
+    bot.loop.create_task( restore_players( shard_id ) )
+
 """
 When the bot is ready, log basic info.
 """
 @bot.event
 async def on_ready():
-    print( f'Logged in as {bot.user} (ID: {bot.user.id})' )
-    print( '------' )
+    global started
+
+    log.info( "Logged in as %s (ID: %s)", bot.user, bot.user.id )
+    if not evict_idle_players.is_running():
+        evict_idle_players.start()
+    if not checkpoint_players.is_running():
+        checkpoint_players.start()
+    if not reap_idle_voice.is_running():
+        reap_idle_voice.start()
+
+    # on_ready fires again after reconnects, only start the metrics endpoint once
+    if not started:
+        started = True
+        # Every process of a multi-process deployment gets its own port: the base port plus its first shard id
+        await metrics.start_server( port=metrics.METRICS_PORT + ( bot.shard_ids[0] if bot.shard_ids else 0 ) )
+
+"""
+Reactions on a queue view flip its pages
+"""
+@bot.event
+async def on_reaction_add( reaction, user ):
+    queue_views.handle_reaction( reaction.message.id, reaction.emoji, user )
+
+@bot.event
+async def on_reaction_remove( reaction, user ):
+    queue_views.handle_reaction( reaction.message.id, reaction.emoji, user )
+
+"""
+Entry point: reads the token, sets up logging and connects. Nothing above this connects or reads the
+token, so the module can be imported (e.g. by the benchmarks) without starting the bot.
+"""
+def main():
+    bot_token = os.environ[ 'DISCORD_BOT_TOKEN' ]
+
+    # Log as key=value lines, the level can be turned up (or down) with LOG_LEVEL in the environment file
+    logging.basicConfig(
+        level=os.environ.get( 'LOG_LEVEL', 'INFO' ).upper(),
+        format="%(asctime)s level=%(levelname)s logger=%(name)s %(message)s"
+    )
+    bot.run( bot_token )
 
-bot.run( bot_token )
+if __name__ == '__main__':
+    main()
 
 #-[ END ]--------------------------------------------------------------------------------------------------------------#
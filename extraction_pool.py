@@ -0,0 +1,219 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# extraction_pool.py
+#
+# This file contains the extraction pool for the discord music bot. All youtube_dl work runs here, on a bounded
+# set of workers (threads or processes) which each own their own YoutubeDL instance.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+
+# config_utils imports youtube_dl for the workers (with its bug report message patched), so the bot itself never does
+import config_utils
+import metadata_cache
+import metrics
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+BACKEND_THREAD = "thread"
+BACKEND_PROCESS = "process"
+
+WORKERS = 4
+MAX_CONCURRENT = 4
+MAX_PER_GUILD = 2
+
+# Audio cache downloads run on their own (smaller) set of workers, so they never hold up interactive extractions
+MAX_DOWNLOADS = 1
+
+log = logging.getLogger( __name__ )
+
+#-[ WORKER DEFS ]------------------------------------------------------------------------------------------------------#
+
+# These run inside the workers. YoutubeDL isn't thread safe, so every worker thread (or process) builds its own.
+_worker_config = None
+_worker_state = threading.local()
+
+# Sets up a worker: just remembers the config, youtube_dl gets imported (and the YoutubeDL instance built) on first use
+def _init_worker( yt_dl_config ):
+    global _worker_config
+    _worker_config = yt_dl_config
+
+# Grabs this worker's YoutubeDL instance (the flat one only lists playlist entries, without resolving them)
+def _get_worker_ytdl( flat=False ):
+    attr = 'flat_ytdl' if flat else 'ytdl'
+    ytdl = getattr( _worker_state, attr, None )
+    if ytdl == None:
+        config = dict( _worker_config, extract_flat='in_playlist' ) if flat else _worker_config
+        ytdl = config_utils.patch_youtube_dl().YoutubeDL( config )
+        setattr( _worker_state, attr, ytdl )
+    return ytdl
+
+# Runs an extraction on this worker. Returns (data, filename), the filename is only set for downloads.
+# Extra options (e.g. a different output template) get a throwaway YoutubeDL, those are rare enough.
+def _extract( url, download, flat=False, options=None ):
+    if options:
+        ytdl = config_utils.patch_youtube_dl().YoutubeDL( dict( _worker_config, **options ) )
+    else:
+        ytdl = _get_worker_ytdl( flat )
+    data = ytdl.extract_info( url, download=download )
+
+    # Flat playlists can hand back a generator, which doesn't survive the trip back from a process worker
+    if 'entries' in data:
+        data['entries'] = list( data['entries'] )
+
+    filename = None
+    if download:
+        entry = data['entries'][0] if 'entries' in data else data
+        filename = ytdl.prepare_filename( entry )
+    return data, filename
+
+# Gets a worker ready for its first extraction ahead of time: youtube_dl imported, both YoutubeDL instances built
+def _warm_up():
+    _get_worker_ytdl()
+    _get_worker_ytdl( flat=True )
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+Runs youtube_dl extractions on a dedicated, bounded pool of workers.
+
+On top of the workers there's a global cap and a per-guild cap on running extractions, so one busy guild can't
+hog every worker. Requests for a URL which is already being extracted are coalesced: ten users queueing the same
+link only trigger one extraction. Downloads (for the audio cache) take minutes rather than seconds, so they get
+their own max_downloads workers and don't count against either cap.
+
+Nothing gets started until it's needed: the workers (and youtube_dl, which is slow to import) come up on the first
+extraction, or on warm_up(), which the bot calls once it's connected.
+"""
+class ExtractionPool:
+
+    ## Constructor
+    def __init__( self, yt_dl_config, backend=BACKEND_THREAD, workers=WORKERS, max_concurrent=MAX_CONCURRENT,
+                  max_per_guild=MAX_PER_GUILD, max_downloads=MAX_DOWNLOADS ):
+        if backend not in ( BACKEND_THREAD, BACKEND_PROCESS ):
+            raise ValueError( "Unknown extraction backend: " + str( backend ) )
+
+        self.yt_dl_config = yt_dl_config
+        self.backend = backend
+        self.workers = workers
+        self.max_concurrent = max_concurrent
+        self.max_per_guild = max_per_guild
+        self.max_downloads = max_downloads
+        self.extractions = 0
+        self.coalesced = 0
+
+        self._executor = None
+        self._download_executor = None
+        self._global_semaphore = None
+        self._guild_semaphores = {}
+        self._in_flight = {}
+
+    ## Builds a set of workers for the configured backend
+    def _make_executor( self, workers, name ):
+        if self.backend == BACKEND_THREAD:
+            return concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix=name, initializer=_init_worker, initargs=( self.yt_dl_config, )
+            )
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=( self.yt_dl_config, )
+        )
+
+    ## The worker pool, started on first use
+    @property
+    def executor( self ):
+        if self._executor == None:
+            self._executor = self._make_executor( self.workers, "extraction" )
+        return self._executor
+
+    ## The download workers, started on the first download
+    @property
+    def download_executor( self ):
+        if self._download_executor == None:
+            self._download_executor = self._make_executor( self.max_downloads, "download" )
+        return self._download_executor
+
+    ## Brings every worker up (in the background), so the first extraction doesn't pay for importing youtube_dl
+    async def warm_up( self ):
+        started = time.perf_counter()
+        loop = asyncio.get_event_loop()
+        await asyncio.gather( *[ loop.run_in_executor( self.executor, _warm_up ) for _ in range( self.workers ) ] )
+        log.info( "Extraction workers ready workers=%d warm_up_ms=%.0f", self.workers,
+                  ( time.perf_counter() - started ) * 1000 )
+
+    ## Grabs the metadata for a URL (flat only lists playlist entries, so big playlists come back quickly)
+    async def extract_info( self, url, guild_id=None, flat=False ):
+        data, _ = await self._submit( url, False, guild_id, flat )
+        return data
+
+    ## Downloads a URL (with optional extra youtube_dl options), returns (data, filename)
+    async def download( self, url, guild_id=None, options=None ):
+        return await self._submit( url, True, guild_id, options=options )
+
+    ## Joins an in-flight extraction for the same URL, or starts a new one
+    async def _submit( self, url, download, guild_id, flat=False, options=None ):
+        key = ( metadata_cache.normalize_key( url ), download, flat, repr( options ) )
+        task = self._in_flight.get( key )
+        if task == None:
+            task = asyncio.get_event_loop().create_task( self._run( url, download, guild_id, flat, options ) )
+            task.add_done_callback( lambda _: self._in_flight.pop( key, None ) )
+            self._in_flight[ key ] = task
+        else:
+            self.coalesced += 1
+
+        # Shielded, so one impatient caller getting cancelled doesn't cancel the work for everybody else
+        return await asyncio.shield( task )
+
+    ## Runs the extraction once both the guild and the global caps allow it (downloads just wait for a download worker)
+    async def _run( self, url, download, guild_id, flat, options ):
+        loop = asyncio.get_event_loop()
+        if download:
+            self.extractions += 1
+            with metrics.extraction_seconds.time( "download" ):
+                return await loop.run_in_executor( self.download_executor, _extract, url, True, False, options )
+
+        if self._global_semaphore == None:
+            self._global_semaphore = asyncio.Semaphore( self.max_concurrent )
+
+        guild_slot = self._guild_semaphores.get( guild_id )
+        if guild_slot == None:
+            guild_slot = [ asyncio.Semaphore( self.max_per_guild ), 0 ]
+            self._guild_semaphores[ guild_id ] = guild_slot
+        guild_slot[1] += 1
+
+        try:
+            async with guild_slot[0]:
+                async with self._global_semaphore:
+                    self.extractions += 1
+                    with metrics.extraction_seconds.time( "flat" if flat else "info" ):
+                        return await loop.run_in_executor( self.executor, _extract, url, False, flat, options )
+        finally:
+            # Don't keep a semaphore around for every guild that ever queued something
+            guild_slot[1] -= 1
+            if guild_slot[1] == 0:
+                self._guild_semaphores.pop( guild_id, None )
+
+    ## Returns the pool counters
+    def stats( self ):
+        return {
+            'backend': self.backend,
+            'extractions': self.extractions,
+            'coalesced': self.coalesced,
+            'in_flight': len( self._in_flight )
+        }
+
+    ## Stops the workers (if they ever started)
+    def shutdown( self ):
+        for executor in ( self._executor, self._download_executor ):
+            if executor != None:
+                executor.shutdown( wait=False )
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,678 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# guild_player.py
+#
+# This file contains the per-guild player state for the discord music bot. Each guild gets its own queue, loop
+# modes, now playing track and voice client, so servers never share (or fight over) the same queue.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import asyncio
+import logging
+import time
+
+import audio_sources
+import idle_manager
+import loudness
+import metrics
+import song_queue
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+MAX_QUEUE_SIZE = 20
+
+# How long (in seconds) a player can sit around doing nothing before it gets evicted
+IDLE_TIMEOUT = 600
+
+# How many upcoming songs get their stream URLs resolved in the background while the current one plays
+PREFETCH_COUNT = 2
+
+# How long (in seconds) a seek should take until audio comes out again; slower seeks get logged
+SEEK_TARGET = 0.5
+
+# How long (in seconds) we wait for the first frame after a seek before we stop measuring
+SEEK_MEASURE_TIMEOUT = 5
+
+# How long (in seconds) a swapped out source lives on, in case the audio thread was still reading from it
+SWAP_CLEANUP_DELAY = 0.5
+
+# A stream which ends more than this many seconds before the song's duration was cut off
+EARLY_EOF_TOLERANCE = 5
+
+# How often we try to resume a cut off stream, and the (exponential) backoff between attempts
+MAX_RESUME_ATTEMPTS = 5
+RESUME_BACKOFF_BASE = 0.5
+RESUME_BACKOFF_MAX = 8
+
+# How often in a row songs can fail to start before the scheduler gives up (until it gets woken up again), and the
+# (exponential) backoff between them
+MAX_START_FAILURES = 3
+START_BACKOFF_BASE = 0.5
+START_BACKOFF_MAX = 4
+
+log = logging.getLogger( __name__ )
+
+#-[ FUNCTION DEFS ]----------------------------------------------------------------------------------------------------#
+
+# Works out which shard a guild lives on (the same formula discord uses)
+def shard_for_guild( guild_id, shard_count ):
+    return ( guild_id >> 22 ) % max( 1, shard_count or 1 )
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+Raised when a guild's queue has no more room for songs
+"""
+class QueueFull( Exception ):
+    pass
+
+"""
+Class containing all the player state for a single guild.
+
+Playback is driven by a scheduler coroutine which lives on the event loop. discord.py calls our 'after' callback
+from its audio thread, so all that callback does is hand the "track finished" signal back to the loop; the queue
+and voice client are only ever touched from the loop itself, which means no locks are needed.
+
+While a track plays, the next few songs on the queue get their stream URLs re-resolved in the background (the
+resolver is a coroutine function taking a song, a guild id and a force flag, which refreshes the song in place),
+so track changes don't wait on extraction.
+
+If a stream errors out or ends well before the song should, the player re-resolves the URL and resumes from the
+last position, backing off exponentially between attempts.
+
+With autoplay on, a queue about to run dry gets topped up by the recommender as soon as its last song starts.
+"""
+class GuildPlayer:
+
+    ## Constructor
+    def __init__( self, guild_id, source_factory, resolver=None, max_queue_size=MAX_QUEUE_SIZE,
+                  prefetch_count=PREFETCH_COUNT, fair=False ):
+        self.guild_id = guild_id
+        self.source_factory = source_factory
+        self.resolver = resolver
+        self.max_queue_size = max_queue_size
+        self.prefetch_count = prefetch_count
+        self.queue = song_queue.SongQueue( fair=fair )
+        self.loop_queue = False
+        self.loop_current = False
+        self.now_playing = None
+        self.voice_client = None
+        self.source = None
+        self.shard_id = 0
+        self.volume = 1.0
+        self.eq = None
+        self.crossfade = 0
+        self.autoplay = False
+        self.last_active = time.monotonic()
+
+        # Called (with the player) whenever the queue, loop modes or current song change
+        self.on_change = None
+
+        # Called (with the player and the song) whenever a song starts playing
+        self.on_play = None
+
+        # Picks a song to play (given the player) when the queue runs dry with autoplay on, None if it can't
+        self.recommender = None
+
+        self.loop = None
+        self.task = None
+        self._wakeup = asyncio.Event()
+        self._track_done = asyncio.Event()
+        self._track_error = None
+        self._stopped = False
+
+        # When (perf_counter) the last track ended, for measuring the gap until the next one starts
+        self._ended_at = None
+
+        # In-flight resolves, keyed by the id() of the song being resolved
+        self._resolving = {}
+
+        # The song a crossfade already started, which the scheduler picks up instead of the next one on the queue
+        self._handoff = None
+
+        # The restored song and where it left off; only its first play starts there, loops start at its start_time
+        self._resume = None
+
+    ## Marks the player as recently used, so it doesn't get evicted
+    def touch( self ):
+        self.last_active = time.monotonic()
+
+    ## Lets whoever is listening (the queue store) know that the player state changed
+    def mark_changed( self ):
+        if self.on_change != None:
+            self.on_change( self )
+
+    ## Returns the settings which outlive the queue (they're kept even once the player gets evicted) as a plain dict
+    def settings( self ):
+        return {
+            'volume': self.volume,
+            'eq': self.eq,
+            'crossfade': self.crossfade,
+            'autoplay': self.autoplay,
+            'fair': self.queue.fair
+        }
+
+    ## Loads settings() output back in
+    def apply_settings( self, settings ):
+        self.volume = settings.get( 'volume', 1.0 )
+        self.eq = settings.get( 'eq' )
+        self.crossfade = settings.get( 'crossfade', 0 )
+        self.autoplay = settings.get( 'autoplay', False )
+        self.queue.fair = settings.get( 'fair', self.queue.fair )
+
+    ## Returns the player state as a plain dict: settings, loop modes, voice channel, queue and where we are in the
+    ## current song
+    def snapshot( self ):
+        return {
+            **self.settings(),
+            'loop_queue': self.loop_queue,
+            'loop_current': self.loop_current,
+            'channel_id': self.voice_client.channel.id if self.voice_client != None else None,
+            'now_playing': self.now_playing.to_dict() if self.now_playing != None else None,
+            'position': self.position(),
+            'queue': [ song.to_dict() for song in self.queue ]
+        }
+
+    ## Loads a snapshot back in; the current song goes back on the front of the queue, starting where it left off
+    def restore( self, state, song_from_dict ):
+        self.loop_queue = state.get( 'loop_queue', False )
+        self.loop_current = state.get( 'loop_current', False )
+        self.queue.clear()
+        self.apply_settings( state )
+        songs = [ song_from_dict( song_dict ) for song_dict in state.get( 'queue', [] )[ :self.max_queue_size ] ]
+
+        if state.get( 'now_playing' ) != None:
+            song = song_from_dict( state['now_playing'] )
+            if state.get( 'position' ):
+                self._resume = ( song, state['position'] )
+            # With loop_queue on, the current song is already at the back of the queue
+            if self.loop_queue and songs and songs[-1].id == song.id:
+                songs.pop()
+            songs.insert( 0, song )
+
+        # The queue was saved in play order, so appending it in that order gives the same turns back in fair mode
+        for song in songs:
+            self.queue.append( song, song.requester )
+
+        if self.queue:
+            self._wakeup.set()
+
+    ## Adds a song to the end of the queue, and wakes up the scheduler; returns the song's queue handle
+    def put( self, song ):
+        self.touch()
+        if self.is_full():
+            raise QueueFull()
+        entry = self.queue.append( song, song.requester )
+        self._wakeup.set()
+        self.mark_changed()
+        return entry
+
+    ## Takes a song off the queue, by handle or position (in play order); returns the song, or None if it wasn't there
+    def remove( self, entry_or_index ):
+        self.touch()
+        entry = entry_or_index
+        if isinstance( entry_or_index, int ):
+            entry = self.queue.entry_at( entry_or_index )
+        if entry == None or not self.queue.remove( entry ):
+            return None
+        self._queue_reordered()
+        return entry.song
+
+    ## Moves a song from one position on the queue to another; returns the song, or None if there's nothing there
+    def move( self, from_index, to_index ):
+        self.touch()
+        entry = self.queue.entry_at( from_index )
+        if entry == None:
+            return None
+        self.queue.move( entry, to_index )
+        self._queue_reordered()
+        return entry.song
+
+    def shuffle( self ):
+        self.touch()
+        self.queue.shuffle()
+        self._queue_reordered()
+
+    ## Switches between playing songs in order and taking turns between requesters
+    def set_fair( self, fair ):
+        self.touch()
+        self.queue.fair = fair
+        self._queue_reordered()
+
+    ## Whatever is up next may have changed, so get it resolved ahead of time again
+    def _queue_reordered( self ):
+        self.mark_changed()
+        if self.loop != None and self.now_playing != None:
+            self._prefetch()
+
+    ## Empties the queue and forgets the current song (so loop_current doesn't bring it back)
+    def clear( self ):
+        self.touch()
+        self.queue.clear()
+        self.now_playing = None
+        self.mark_changed()
+
+    ## Picks the next song to play, taking the loop modes into account
+    def next_song( self ):
+        self.touch()
+
+        # If we enable loop_current, then get the current song
+        if self.loop_current:
+            log.debug( "Looping current song guild=%s", self.guild_id )
+            if self.now_playing == None:
+                self.now_playing = self.queue.pop()
+
+        # If we enable loop_queue, then we put the song back on the queue
+        elif self.loop_queue:
+            log.debug( "Looping queue guild=%s", self.guild_id )
+            self.now_playing = self.queue.pop()
+            if self.now_playing != None:
+                self.queue.append( self.now_playing, self.now_playing.requester )
+
+        # Otherwise, we just get the next song
+        else:
+            log.debug( "Grabbing next item in queue guild=%s", self.guild_id )
+            self.now_playing = self.queue.pop()
+
+        self.mark_changed()
+        return self.now_playing
+
+    ## Starts the scheduler coroutine (if it isn't already running)
+    def start( self, loop=None ):
+        if self.task == None or self.task.done():
+            self.loop = loop or asyncio.get_event_loop()
+            self.task = self.loop.create_task( self._scheduler() )
+
+    ## Stops the scheduler coroutine and whatever is playing
+    def stop( self ):
+        self.clear()
+        if self.task != None:
+            self.task.cancel()
+            self.task = None
+        for task in self._resolving.values():
+            task.cancel()
+        self._resolving.clear()
+        if self.voice_client != None and ( self.voice_client.is_playing() or self.voice_client.is_paused() ):
+            self.voice_client.stop()
+
+    ## Skips the current song; the scheduler picks up the next one once the voice client reports back
+    def skip( self ):
+        self.touch()
+        self._stopped = True
+        if self.voice_client != None:
+            self.voice_client.stop()
+
+    ## Builds a (position tracking) source for a song, starting at the given offset in seconds
+    def _create_source( self, song, start, reason="play", previous_end=None ):
+        return audio_sources.TrackedSource(
+            self.source_factory( song, self.guild_id, start ), start=start, reason=reason, previous_end=previous_end
+        )
+
+    ## Returns the position (in seconds) in the current song, or None if nothing is playing
+    def position( self ):
+        if self.source == None or self.now_playing == None:
+            return None
+        return self.source.position
+
+    ## Jumps to a position (in seconds) in the current song and returns how long it took until audio came back.
+    ## A fresh source (ffmpeg seeking on the input side) gets swapped into the running voice client, so the
+    ## scheduler and the 'after' callback never notice.
+    async def seek( self, seconds ):
+        self.touch()
+        song = self.now_playing
+        if song == None or self.voice_client == None or self.voice_client.source == None:
+            return None
+
+        if self.resolver != None and song.needs_resolve():
+            await self._resolve( song )
+
+        old_source = self.voice_client.source
+        new_source = self._create_source( song, seconds, reason="seek" )
+        self.voice_client.source = new_source
+        self.source = new_source
+        self.loop.call_later( SWAP_CLEANUP_DELAY, old_source.cleanup )
+        self.mark_changed()
+
+        # Wait for the first frame, so we know how long the seek took
+        deadline = time.monotonic() + SEEK_MEASURE_TIMEOUT
+        while new_source.time_to_audio == None and self.source is new_source and time.monotonic() < deadline:
+            await asyncio.sleep( 0.01 )
+
+        if new_source.time_to_audio != None and new_source.time_to_audio > SEEK_TARGET:
+            log.warning( "Slow seek guild=%s time_to_audio_ms=%.0f", self.guild_id, new_source.time_to_audio * 1000 )
+        return new_source.time_to_audio
+
+    ## Sets the playback volume (1.0 plays as is). A source with a volume control just gets turned up or down; one
+    ## which plays the stream untouched (Opus passthrough) gets swapped for one which can, at the same position.
+    async def set_volume( self, volume ):
+        self.touch()
+        self.volume = volume
+        self.mark_changed()
+        if self.source == None or self.now_playing == None:
+            return
+
+        if hasattr( self.source.source, 'volume' ):
+            self.source.source.volume = loudness.playback_level( self.now_playing, volume )
+        elif not loudness.is_unity( loudness.playback_level( self.now_playing, volume ) ):
+            await self.seek( self.position() )
+
+    ## Switches the EQ preset (None turns it off). A source with an effect chain switches right away; one without gets
+    ## swapped for one with, at the same position.
+    async def set_eq( self, eq ):
+        self.touch()
+        self.eq = eq
+        self.mark_changed()
+        if self.source == None or self.now_playing == None:
+            return
+
+        if hasattr( self.source.source, 'effects' ):
+            self.source.source.effects.set_eq( eq )
+        elif eq != None:
+            await self.seek( self.position() )
+
+    ## Sets how many seconds consecutive songs get crossfaded over (0 turns it off); takes effect from the next song
+    def set_crossfade( self, seconds ):
+        self.touch()
+        self.crossfade = seconds
+        self.mark_changed()
+
+    ## Turns autoplay on or off; turning it on with nothing left on the queue picks the next song right away
+    def set_autoplay( self, enabled ):
+        self.touch()
+        self.autoplay = enabled
+        self.mark_changed()
+        if self.loop != None and self.now_playing != None:
+            self._prefetch()
+
+    ## Checks if songs have to be decoded to PCM for this player (Opus passthrough can't do effects)
+    def needs_pcm( self ):
+        return self.eq != None or self.crossfade > 0
+
+    ## Called by discord.py on its audio thread when a track ends: hand the signal back to the event loop
+    def _after( self, error ):
+        self._ended_at = time.perf_counter()
+        self.loop.call_soon_threadsafe( self._track_ended, error )
+
+    ## Records how the track ended (back on the event loop) and wakes the scheduler
+    def _track_ended( self, error ):
+        if error != None:
+            log.error( "Player error guild=%s error=%s", self.guild_id, error )
+        self._track_error = error
+        self._track_done.set()
+
+    ## Checks if the track that just ended was cut off (an error, or EOF well before the end of the song)
+    def _ended_early( self, song ):
+        if self._stopped or song is not self.now_playing or self.source == None:
+            return False
+        if self._track_error != None:
+            return True
+        duration = getattr( song, 'duration', None )
+        return duration != None and self.source.position < duration - EARLY_EOF_TOLERANCE
+
+    ## Starts a song (at the given offset) on the voice client
+    def _start( self, song, start, reason="play" ):
+        self._track_done.clear()
+        self._track_error = None
+        self._stopped = False
+        self.source = self._create_source( song, start, reason=reason, previous_end=self._ended_at )
+        self.voice_client.play( self.source, after=self._after )
+
+    ## Waits for the current track to end; with crossfade on, the next song gets faded in over the end of this one
+    ## instead (if it's ready to play), in which case this returns True
+    async def _wait_for_track( self, song ):
+        while self.crossfade > 0 and song.duration != None and not self._track_done.is_set():
+            remaining = song.duration - self.source.position
+            if remaining <= self.crossfade:
+                if self._crossfade_into_next( song ):
+                    return True
+                break
+            try:
+                await asyncio.wait_for( self._track_done.wait(), timeout=remaining - self.crossfade )
+            except asyncio.TimeoutError:
+                pass
+        await self._track_done.wait()
+        return False
+
+    ## Starts the next song under the end of the current one, swapping a crossfading source into the voice client
+    ## (like a seek, so the 'after' callback only fires once the next song ends); returns False if it can't
+    def _crossfade_into_next( self, song ):
+        if self._stopped or song is not self.now_playing or self.voice_client == None:
+            return False
+        old_source = self.voice_client.source
+        upcoming = [ self.now_playing ] if self.loop_current else self.queue.peek( 1 )
+        if old_source == None or old_source.is_opus() or not upcoming or upcoming[0].needs_resolve():
+            return False
+
+        new_source = self._create_source( upcoming[0], 0, reason="crossfade" )
+        if new_source.is_opus():
+            new_source.cleanup()
+            return False
+
+        self._handoff = self.next_song()
+        self._track_error = None
+        self.voice_client.source = audio_sources.CrossfadeSource( old_source, new_source, self.crossfade )
+        self.source = new_source
+        return True
+
+    ## Plays a song until it ends, resuming it (from a freshly resolved URL) if the stream gets cut off.
+    ## A song a crossfade already started (started is set) just gets waited on.
+    async def _play( self, song, started=False ):
+        log.info( "Playing stream guild=%s id=%s title=%r", self.guild_id, song.id, song.title )
+        if not started:
+            resume, self._resume = self._resume, None
+            self._start( song, resume[1] if resume != None and resume[0] is song else song.start_time or 0 )
+        if self.on_play != None:
+            self.on_play( self, song )
+        self._prefetch()
+        if await self._wait_for_track( song ):
+            return
+
+        attempts = 0
+        while self._ended_early( song ) and attempts < MAX_RESUME_ATTEMPTS:
+            if self.voice_client == None or not self.voice_client.is_connected():
+                return
+
+            position = self.source.position
+            delay = min( RESUME_BACKOFF_BASE * 2 ** attempts, RESUME_BACKOFF_MAX )
+            attempts += 1
+            log.warning( "Stream cut off guild=%s id=%s position=%.1f retry_in=%s attempt=%d",
+                         self.guild_id, song.id, position, delay, attempts )
+            await asyncio.sleep( delay )
+
+            # Somebody might have skipped or cleared while we were waiting
+            if self._stopped or song is not self.now_playing:
+                return
+
+            try:
+                if self.resolver != None:
+                    await self.resolver( song, self.guild_id, True )
+                self._start( song, position, reason="resume" )
+                metrics.stream_resumes.inc()
+            except Exception:
+                log.exception( "Error while resuming the stream guild=%s id=%s", self.guild_id, song.id )
+                continue
+            if await self._wait_for_track( song ):
+                return
+
+    ## Resolves a song's stream URL, sharing the work if a prefetch for it is already running
+    def _resolve( self, song ):
+        key = id( song )
+        task = self._resolving.get( key )
+        if task == None:
+            task = self.loop.create_task( self.resolver( song, self.guild_id, False ) )
+            task.add_done_callback( lambda done: self._resolve_done( key, done ) )
+            self._resolving[ key ] = task
+        return task
+
+    ## Forgets a finished resolve (and logs it if it blew up, since prefetches aren't awaited by anyone)
+    def _resolve_done( self, key, task ):
+        self._resolving.pop( key, None )
+        if not task.cancelled() and task.exception() != None:
+            log.error( "Error while prefetching the stream guild=%s error=%s", self.guild_id, task.exception() )
+
+    ## Kicks off background resolves for the next few songs which need them. With autoplay on and nothing left on the
+    ## queue, the next song gets picked (and resolved) now, while the current one plays, so radio mode has no gap.
+    def _prefetch( self ):
+        if self.autoplay and self.recommender != None and not self.queue and not self.loop_current \
+                and self.now_playing != None:
+            song = self.recommender( self )
+            if song != None:
+                log.debug( "Autoplay picked guild=%s id=%s", self.guild_id, song.id )
+                self.queue.append( song, song.requester )
+                self.mark_changed()
+
+        if self.resolver == None:
+            return
+        upcoming = [ self.now_playing ] if self.loop_current else self.queue.peek( self.prefetch_count )
+        for song in upcoming:
+            if song != None and song.needs_resolve():
+                self._resolve( song )
+
+    ## Takes a song which failed to play out of the rotation, so neither loop mode brings it straight back
+    def _drop( self, song ):
+        for entry in self.queue.entries():
+            if entry.song is song:
+                self.queue.remove( entry )
+        self.now_playing = None
+        self.mark_changed()
+
+    ## Waits for songs, then plays them one after another until the queue runs dry (or too many in a row fail)
+    async def _scheduler( self ):
+        while True:
+            await self._wakeup.wait()
+            failures = 0
+
+            while self.voice_client != None and self.voice_client.is_connected():
+                self._wakeup.clear()
+                handoff, self._handoff = self._handoff, None
+                song = handoff if handoff != None else self.next_song()
+                if song == None:
+                    log.info( "All finished! guild=%s", self.guild_id )
+                    break
+
+                # Normally the prefetch already did this, but the first song (or a stale one) gets resolved here
+                if handoff == None and self.resolver != None and song.needs_resolve():
+                    try:
+                        await self._resolve( song )
+                    except Exception:
+                        log.exception( "Error while resolving the stream guild=%s id=%s", self.guild_id, song.id )
+
+                try:
+                    await self._play( song, started=handoff != None )
+                    failures = 0
+                except Exception:
+                    log.exception( "Error while starting the stream guild=%s id=%s", self.guild_id, song.id )
+                    self._drop( song )
+                    failures += 1
+                    if failures >= MAX_START_FAILURES:
+                        log.error( "Giving up after %d failed songs guild=%s", failures, self.guild_id )
+                        break
+                    await asyncio.sleep( min( START_BACKOFF_BASE * 2 ** ( failures - 1 ), START_BACKOFF_MAX ) )
+
+            # Whatever plays next isn't a transition from the last track anymore
+            self._ended_at = None
+            self._wakeup.clear()
+
+    ## Returns the ffmpeg process behind the current source (if there is one)
+    def ffmpeg_process( self ):
+        processes = idle_manager.find_ffmpeg_processes( self.source )
+        return processes[0] if processes else None
+
+    ## Returns the pids of every ffmpeg process the player is using (a crossfade has two)
+    def ffmpeg_pids( self ):
+        return { process.pid for process in idle_manager.find_ffmpeg_processes( self.source ) }
+
+    ## Checks if the queue has no room left (so there's no point extracting anything for it)
+    def is_full( self ):
+        return len( self.queue ) >= self.max_queue_size
+
+    ## Checks if we're playing (or holding) anything
+    def is_active( self ):
+        if self.voice_client != None and ( self.voice_client.is_playing() or self.voice_client.is_paused() ):
+            return True
+        return len( self.queue ) > 0
+
+    ## Checks if the player has been untouched for longer than the timeout
+    def is_idle( self, timeout=IDLE_TIMEOUT ):
+        return not self.is_active() and time.monotonic() - self.last_active > timeout
+
+
+"""
+Looks up guild players by guild id, creating them lazily and evicting them when idle.
+Memory grows with the number of active guilds, not the number of guilds the bot is in.
+
+New players get max_queue_size songs of room (unless queue_sizes has a size for their guild), and take turns between
+requesters from the start if fair is set. A guild which had a player before starts out with the settings settings_of
+(if given) remembers for it.
+
+Players are shard local: each one remembers the shard its guild lives on (shard_of maps a guild id to a shard),
+and a process only ever holds players for the guilds of its own shards.
+"""
+class PlayerRegistry:
+
+    ## Constructor
+    def __init__( self, source_factory, resolver=None, max_queue_size=MAX_QUEUE_SIZE, idle_timeout=IDLE_TIMEOUT,
+                  on_change=None, on_remove=None, shard_of=None, queue_sizes=None, fair=False, on_play=None,
+                  recommender=None, settings_of=None ):
+        self.source_factory = source_factory
+        self.shard_of = shard_of
+        self.settings_of = settings_of
+        self.resolver = resolver
+        self.on_change = on_change
+        self.on_remove = on_remove
+        self.on_play = on_play
+        self.recommender = recommender
+        self.max_queue_size = max_queue_size
+        self.queue_sizes = queue_sizes or {}
+        self.fair = fair
+        self.idle_timeout = idle_timeout
+        self.players = {}
+
+    ## Grabs the player for a guild, creating one if it doesn't exist yet
+    def get( self, guild_id ):
+        player = self.players.get( guild_id )
+        if player == None:
+            player = GuildPlayer( guild_id, self.source_factory, resolver=self.resolver,
+                                  max_queue_size=self.queue_sizes.get( guild_id, self.max_queue_size ),
+                                  fair=self.fair )
+            player.on_change = self.on_change
+            player.on_play = self.on_play
+            player.recommender = self.recommender
+            player.shard_id = self.shard_of( guild_id ) if self.shard_of != None else 0
+            # A guild coming back (after its player got evicted) gets its volume, EQ and so on back
+            settings = self.settings_of( guild_id ) if self.settings_of != None else None
+            if settings != None:
+                player.apply_settings( settings )
+            self.players[ guild_id ] = player
+        player.touch()
+        return player
+
+    ## Grabs the player for a guild only if it already exists
+    def peek( self, guild_id ):
+        return self.players.get( guild_id )
+
+    ## Stops and drops the player for a guild
+    def remove( self, guild_id ):
+        player = self.players.pop( guild_id, None )
+        if player != None:
+            player.on_change = None
+            player.stop()
+            if self.on_remove != None:
+                self.on_remove( guild_id )
+        return player
+
+    ## Drops every player which has been idle for too long, returns the number evicted
+    def evict_idle( self ):
+        idle_ids = [ guild_id for guild_id, player in self.players.items() if player.is_idle( self.idle_timeout ) ]
+        for guild_id in idle_ids:
+            self.remove( guild_id )
+        return len( idle_ids )
+
+    def __len__( self ):
+        return len( self.players )
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,236 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# idle_manager.py
+#
+# This file contains the idle manager for the discord music bot: it leaves voice channels nobody is listening in (or
+# nothing has played in for a while), takes broadcast stations nobody tunes in to off air, and kills ffmpeg processes
+# which outlived the source that started them.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import logging
+import os
+import signal
+import time
+
+import metrics
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+# How long (in seconds) the bot stays connected with nothing playing
+IDLE_TIMEOUT = 300
+
+# How long (in seconds) the bot stays connected with no (human) listeners left in the channel, and a broadcast station
+# stays on air with no voice channels tuned in
+ALONE_TIMEOUT = 60
+
+# How old (in seconds) an ffmpeg process nobody owns has to be before it gets killed, so sources which are being
+# created or swapped out right now don't get caught
+FFMPEG_GRACE = 30
+
+log = logging.getLogger( __name__ )
+
+#-[ FUNCTION DEFS ]----------------------------------------------------------------------------------------------------#
+
+# Lists the (pid, age in seconds, command line) of the direct child processes of a process, from /proc
+# (an empty list if we can't read it, e.g. not on Linux)
+def list_child_processes( ppid=None ):
+    ppid = ppid if ppid != None else os.getpid()
+    children = []
+    try:
+        with open( "/proc/uptime" ) as uptime_file:
+            uptime = float( uptime_file.read().split()[0] )
+        pids = [ int( name ) for name in os.listdir( "/proc" ) if name.isdigit() ]
+    except OSError:
+        return children
+
+    ticks = os.sysconf( 'SC_CLK_TCK' )
+    for pid in pids:
+        try:
+            with open( f"/proc/{pid}/stat" ) as stat_file:
+                # The command name can contain spaces, so only split after its closing parenthesis
+                fields = stat_file.read().rsplit( ')', 1 )[1].split()
+            if int( fields[1] ) != ppid:
+                continue
+            with open( f"/proc/{pid}/cmdline", "rb" ) as cmdline_file:
+                cmdline = cmdline_file.read().decode( errors="replace" ).split( "\0" )
+            children.append( ( pid, uptime - int( fields[19] ) / ticks, cmdline ) )
+        except ( OSError, IndexError, ValueError ):
+            # The process went away while we were looking at it
+            continue
+    return children
+
+# Checks if a command line is one of discord.py's ffmpeg sources (they all write the audio to stdout)
+def is_ffmpeg_source( cmdline ):
+    return bool( cmdline ) and os.path.basename( cmdline[0] ) == "ffmpeg" and "pipe:1" in cmdline
+
+# Lists the (still running) ffmpeg processes behind an audio source, looking through whatever wraps it (tracking,
+# volume and effects, crossfades); the process of the track that's playing comes first
+def find_ffmpeg_processes( source ):
+    processes = []
+    pending = [ source ]
+    while pending:
+        source = pending.pop( 0 )
+        if source == None:
+            continue
+        process = getattr( source, '_process', None )
+        if process != None:
+            if process.poll() == None:
+                processes.append( process )
+            continue
+        # TrackedSource wraps .source, volume transformers .original, and crossfades .incoming (and .outgoing)
+        pending.extend( getattr( source, name, None ) for name in ( 'source', 'original', 'incoming', 'outgoing' ) )
+    return processes
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+Drops the voice connections (and players) of guilds which stopped listening, and kills stray ffmpeg processes.
+
+A connection gets dropped once nothing has played for idle_timeout seconds, or once there has been nobody but bots in
+the channel for alone_timeout seconds. Every voice connection holds a UDP socket and (while playing) an ffmpeg
+process with its pipes, so this is what keeps file descriptors and processes bounded in long running deployments.
+Broadcast stations get the same alone_timeout: one nobody is tuned in to still runs its pump thread and ffmpeg.
+"""
+class IdleManager:
+
+    ## Constructor
+    def __init__( self, players, idle_timeout=IDLE_TIMEOUT, alone_timeout=ALONE_TIMEOUT, ffmpeg_grace=FFMPEG_GRACE ):
+        self.players = players
+        self.idle_timeout = idle_timeout
+        self.alone_timeout = alone_timeout
+        self.ffmpeg_grace = ffmpeg_grace
+
+        # When (monotonic) each guild's channel was first seen without listeners
+        self._alone_since = {}
+
+        # When (monotonic) each guild's voice connection connected, or was first seen with nothing going on
+        self._idle_since = {}
+
+        # When (monotonic) each broadcast station was first seen without anybody tuned in
+        self._unheard_since = {}
+
+        # Killed processes which still have to be reaped
+        self._killed = set()
+
+    ## Checks if there's anybody but bots in a voice channel
+    @staticmethod
+    def has_listeners( channel ):
+        return any( not member.bot for member in channel.members )
+
+    ## Notes a fresh voice connection, so its idle time counts from now (and not from whenever we first look at it)
+    def note_connected( self, guild_id, now=None ):
+        self._idle_since[ guild_id ] = now if now != None else time.monotonic()
+
+    ## Works out why a voice connection should be dropped, None if it should stay
+    def disconnect_reason( self, voice_client, now=None ):
+        now = now if now != None else time.monotonic()
+        guild_id = voice_client.guild.id
+
+        if voice_client.channel != None and self.has_listeners( voice_client.channel ):
+            self._alone_since.pop( guild_id, None )
+        elif now - self._alone_since.setdefault( guild_id, now ) >= self.alone_timeout:
+            return "alone"
+
+        player = self.players.peek( guild_id )
+        if voice_client.is_playing() or voice_client.is_paused() or ( player != None and player.is_active() ):
+            self._idle_since.pop( guild_id, None )
+            return None
+
+        # A connection without a player (just joined, or its restore failed) gets the same idle_timeout
+        idle_since = self._idle_since.setdefault( guild_id, now )
+        if player != None:
+            idle_since = max( idle_since, player.last_active )
+        if now - idle_since >= self.idle_timeout:
+            return "idle"
+        return None
+
+    ## Drops a guild's voice connection along with its player
+    async def disconnect( self, voice_client, reason ):
+        guild_id = voice_client.guild.id
+        log.info( "Leaving voice channel guild=%s reason=%s", guild_id, reason )
+        self._alone_since.pop( guild_id, None )
+        self._idle_since.pop( guild_id, None )
+        self.players.remove( guild_id )
+        voice_client.stop()
+        await voice_client.disconnect( force=True )
+        metrics.idle_disconnects.inc( reason )
+
+    ## Goes over every voice connection, dropping the ones nobody needs anymore; returns how many got dropped
+    async def reap( self, voice_clients ):
+        dropped = 0
+        now = time.monotonic()
+        for voice_client in list( voice_clients ):
+            reason = self.disconnect_reason( voice_client, now )
+            if reason == None:
+                continue
+            try:
+                await self.disconnect( voice_client, reason )
+                dropped += 1
+            except Exception:
+                log.exception( "Error while leaving voice channel guild=%s", voice_client.guild.id )
+
+        # Forget channels we're not in anymore
+        connected = { voice_client.guild.id for voice_client in voice_clients }
+        for since in ( self._alone_since, self._idle_since ):
+            for guild_id in list( since ):
+                if guild_id not in connected:
+                    del since[ guild_id ]
+        return dropped
+
+    ## Takes the broadcast stations nobody has been tuned in to for alone_timeout seconds off air, returns how many
+    def reap_stations( self, stations, now=None ):
+        now = now if now != None else time.monotonic()
+        removed = 0
+        for name, station in list( stations.stations.items() ):
+            if station.listeners:
+                self._unheard_since.pop( station, None )
+            elif now - self._unheard_since.setdefault( station, now ) >= self.alone_timeout:
+                log.info( "Taking station off air station=%s reason=alone", name )
+                stations.remove( name )
+                removed += 1
+
+        # Forget stations which went off air (a new one by the same name starts over)
+        on_air = set( stations.stations.values() )
+        for station in list( self._unheard_since ):
+            if station not in on_air:
+                del self._unheard_since[ station ]
+        return removed
+
+    ## Kills ffmpeg sources which no player owns anymore (e.g. left behind by an error), returns how many got killed.
+    ## owned_pids are the pids of every ffmpeg process still in use.
+    def kill_stray_ffmpeg( self, owned_pids ):
+        self._reap_killed()
+
+        killed = 0
+        for pid, age, cmdline in list_child_processes():
+            if pid in owned_pids or pid in self._killed or age < self.ffmpeg_grace or not is_ffmpeg_source( cmdline ):
+                continue
+            log.warning( "Killing stray ffmpeg process pid=%d age=%.0f", pid, age )
+            try:
+                os.kill( pid, signal.SIGKILL )
+            except ProcessLookupError:
+                continue
+            self._killed.add( pid )
+            killed += 1
+
+        if killed:
+            metrics.ffmpeg_killed.inc( amount=killed )
+        return killed
+
+    ## Collects the exit status of processes we killed, so they don't stick around as zombies
+    def _reap_killed( self ):
+        for pid in list( self._killed ):
+            try:
+                reaped, _ = os.waitpid( pid, os.WNOHANG )
+            except ChildProcessError:
+                # Its Popen object got there first
+                reaped = pid
+            if reaped == pid:
+                self._killed.discard( pid )
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,229 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# loudness.py
+#
+# This file contains the loudness analysis for the discord music bot. Every track gets measured once (EBU R128
+# integrated loudness, with ffmpeg), and later plays just apply the matching static gain, instead of running
+# ffmpeg's loudnorm filter on every play. Measured gains get saved, so a restart doesn't measure everything again.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import asyncio
+import collections
+import logging
+import math
+import re
+import time
+
+import metrics
+import sqlite_store
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+# What every track gets normalized to (YouTube's own playback loudness)
+TARGET_LUFS = -14.0
+
+# Quiet tracks only get boosted so far (the volume transformer clips), loud ones can come down a lot
+MAX_GAIN_DB = 6.0
+MIN_GAIN_DB = -20.0
+
+# Gains this close to 0dB aren't worth giving up Opus passthrough for
+UNITY_TOLERANCE_DB = 0.5
+
+# How much of a track (in seconds) gets measured; the start of a track is a good enough estimate of the rest
+ANALYSIS_SECONDS = 180
+
+# How many analyses run at once (each one is an ffmpeg process decoding a stream)
+MAX_CONCURRENT = 2
+
+# How many track gains we remember (in memory; the newest ones get loaded back from disk on startup)
+MAX_ENTRIES = 4096
+
+GAINS_PATH = "loudness.db"
+
+# How long (in seconds) we gather measured gains before writing them out in one go
+DEBOUNCE_SECONDS = 10.0
+
+INTEGRATED_REGEX = re.compile( r'I:\s+(-?\d+(?:\.\d+)?) LUFS' )
+
+log = logging.getLogger( __name__ )
+
+#-[ FUNCTION DEFS ]----------------------------------------------------------------------------------------------------#
+
+# Turns a measured integrated loudness into the (linear) gain which brings it to the target
+def gain_from_loudness( lufs, target_lufs=TARGET_LUFS ):
+    gain_db = min( MAX_GAIN_DB, max( MIN_GAIN_DB, target_lufs - lufs ) )
+    return 10 ** ( gain_db / 20 )
+
+# Pulls the integrated loudness out of ffmpeg's ebur128 summary, None if it isn't there
+def parse_integrated_loudness( ffmpeg_output ):
+    matches = INTEGRATED_REGEX.findall( ffmpeg_output )
+    return float( matches[-1] ) if matches else None
+
+# Works out the level (linear) a song plays at: the guild's volume times the song's normalization gain
+def playback_level( song, volume=1.0 ):
+    return volume * ( song.gain if song.gain != None else 1.0 )
+
+# Checks if a level is close enough to 1 to play the stream untouched
+def is_unity( level ):
+    return level > 0 and abs( 20 * math.log10( level ) ) < UNITY_TOLERANCE_DB
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+Saves measured track gains (by video id) to SQLite
+"""
+class GainStore( sqlite_store.DebouncedStore ):
+
+    SCHEMA = ( "CREATE TABLE IF NOT EXISTS gains ( video_id TEXT PRIMARY KEY, gain REAL, measured_at REAL )", )
+
+    THREAD_NAME = "loudness-store"
+
+    ## Constructor
+    def __init__( self, path=GAINS_PATH, debounce=DEBOUNCE_SECONDS ):
+        super().__init__( path, debounce )
+        self._pending = {}
+
+    ## Saves a track's gain with the next batch
+    def put( self, video_id, gain ):
+        self._pending[ video_id ] = ( gain, time.time() )
+        self._schedule_flush()
+
+    def _take_batch( self ):
+        if not self._pending:
+            return None
+        rows = [ ( video_id, gain, measured_at ) for video_id, ( gain, measured_at ) in self._pending.items() ]
+        self._pending = {}
+        return ( rows, )
+
+    def _write( self, rows ):
+        connection = self._connect()
+        with connection:
+            connection.executemany( "INSERT OR REPLACE INTO gains VALUES ( ?, ?, ? )", rows )
+
+    ## Returns the ( video id, gain ) of the (up to limit) most recently measured tracks, newest first
+    async def load( self, limit ):
+        return await self._run( self._read, limit )
+
+    def _read( self, limit ):
+        return self._connect().execute(
+            "SELECT video_id, gain FROM gains ORDER BY measured_at DESC LIMIT ?", ( limit, )
+        ).fetchall()
+
+
+"""
+Measures tracks in the background and remembers their gains (by video id, LRU bounded, and saved to disk).
+
+Songs get their gain set as soon as it's known; a track which hasn't been measured yet just plays at its own
+loudness the first time around, so analysis never holds up playback. Only upcoming tracks get measured (while the
+current one plays), never the one that's playing, which would mean opening its stream a second time.
+"""
+class LoudnessAnalyzer:
+
+    ## Constructor
+    def __init__( self, target_lufs=TARGET_LUFS, analysis_seconds=ANALYSIS_SECONDS, max_concurrent=MAX_CONCURRENT,
+                  max_entries=MAX_ENTRIES, path=GAINS_PATH ):
+        self.target_lufs = target_lufs
+        self.analysis_seconds = analysis_seconds
+        self.max_entries = max_entries
+        self.gains = collections.OrderedDict()
+        self.analyses = 0
+        self.failures = 0
+        self.store = GainStore( path )
+
+        self._semaphore = asyncio.Semaphore( max_concurrent )
+        self._analyzing = {}
+
+    ## Sets a song's gain if we know it already, returns it (None if we don't)
+    def lookup( self, song ):
+        gain = self.gains.get( song.id )
+        if gain != None:
+            self.gains.move_to_end( song.id )
+            song.gain = gain
+        return song.gain
+
+    ## Loads the gains measured by previous runs (anything measured since then wins)
+    async def load( self ):
+        try:
+            rows = await self.store.load( self.max_entries )
+        except Exception:
+            log.exception( "Error while loading loudness gains path=%s", self.store.path )
+            return
+
+        # They go in front of anything measured this run, newest first (so the oldest get evicted first)
+        for video_id, gain in rows:
+            if video_id not in self.gains:
+                self.gains[ video_id ] = gain
+                self.gains.move_to_end( video_id, last=False )
+        while len( self.gains ) > self.max_entries:
+            self.gains.popitem( last=False )
+        log.info( "Loaded loudness gains tracks=%d", len( rows ) )
+
+    ## Makes sure a song gets its gain: right away if we know it, once it's measured (in the background) if we don't.
+    ## source is what ffmpeg reads (a stream URL or a cached file).
+    def schedule( self, song, source ):
+        if self.lookup( song ) != None or source == None:
+            return None
+        task = self._analyzing.get( song.id )
+        if task == None:
+            task = asyncio.get_event_loop().create_task( self._analyze_track( song.id, source ) )
+            self._analyzing[ song.id ] = task
+        task.add_done_callback( lambda done: self._analysis_done( song, done ) )
+        return task
+
+    def _analysis_done( self, song, task ):
+        self._analyzing.pop( song.id, None )
+        if not task.cancelled() and task.exception() == None and task.result() != None:
+            song.gain = task.result()
+
+    ## Measures a track and remembers its gain, returns it (None if the measurement failed)
+    async def _analyze_track( self, video_id, source ):
+        async with self._semaphore:
+            try:
+                with metrics.loudness_analysis_seconds.time():
+                    lufs = await self.measure( source )
+            except Exception as e:
+                lufs = None
+                log.warning( "Error while measuring loudness id=%s error=%s", video_id, e )
+
+        if lufs == None:
+            self.failures += 1
+            return None
+
+        gain = gain_from_loudness( lufs, self.target_lufs )
+        self.analyses += 1
+        self.gains[ video_id ] = gain
+        self.store.put( video_id, gain )
+        while len( self.gains ) > self.max_entries:
+            self.gains.popitem( last=False )
+        log.debug( "Measured loudness id=%s lufs=%.1f gain=%.2f", video_id, lufs, gain )
+        return gain
+
+    ## Runs ffmpeg's ebur128 filter over (the start of) a track, returns its integrated loudness in LUFS
+    async def measure( self, source ):
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-nostats", "-hide_banner", "-t", str( self.analysis_seconds ), "-i", source,
+            "-vn", "-af", "ebur128=framelog=quiet", "-f", "null", "-",
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            _, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            process.kill()
+            raise
+        return parse_integrated_loudness( stderr.decode( errors="replace" ) )
+
+    ## Returns the analyzer counters
+    def stats( self ):
+        return {
+            'tracks': len( self.gains ),
+            'analyses': self.analyses,
+            'failures': self.failures,
+            'analyzing': len( self._analyzing )
+        }
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,138 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# metadata_cache.py
+#
+# This file contains a small TTL + LRU cache for youtube_dl metadata, so popular videos don't get extracted again
+# every time somebody queues them.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import collections
+import re
+import time
+
+from urllib.parse import urlparse, parse_qs
+
+import ytdl_utils
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+MAX_ENTRIES = 512
+
+# Used when the extracted data doesn't tell us when its stream URLs expire
+DEFAULT_TTL = 1800
+
+YT_ID_REGEX = re.compile( r'^[A-Za-z0-9_-]{11}$' )
+
+#-[ FUNCTION DEFS ]----------------------------------------------------------------------------------------------------#
+
+# Turns a URL (or bare video id) into a cache key, so different spellings of the same video share one entry
+def normalize_key( url ):
+    url = url.strip()
+    if YT_ID_REGEX.match( url ):
+        return 'yt:' + url
+
+    parsed = urlparse( url if '://' in url else 'https://' + url )
+    host = parsed.netloc.lower()
+    if host.startswith( 'www.' ) or host.startswith( 'm.' ):
+        host = host.split( '.', 1 )[1]
+    query = parse_qs( parsed.query )
+
+    video_id = None
+    if host == 'youtu.be':
+        video_id = parsed.path.lstrip( '/' ).split( '/' )[0]
+    elif host in ( 'youtube.com', 'music.youtube.com' ):
+        if 'v' in query:
+            video_id = query['v'][0]
+        elif parsed.path.startswith( '/shorts/' ) or parsed.path.startswith( '/embed/' ):
+            video_id = parsed.path.split( '/' )[2]
+        elif 'list' in query:
+            return 'ytlist:' + query['list'][0]
+
+    if video_id and YT_ID_REGEX.match( video_id ):
+        # The start time changes what we play, so it has to be part of the key
+        start = query.get( 't', query.get( 'start', [ None ] ) )[0]
+        return 'yt:' + video_id + ( '@' + start if start else '' )
+
+    return url
+
+# Works out how long extracted data stays valid: until the first of its stream URLs expires
+def get_data_expiry( data, margin=ytdl_utils.EXPIRY_MARGIN, default_ttl=DEFAULT_TTL ):
+    entries = data.get( 'entries' ) or [ data ]
+    expiries = [ ytdl_utils.get_url_expiry( entry.get( 'url' ) ) for entry in entries if entry ]
+    expiries = [ expiry for expiry in expiries if expiry != None ]
+    if not expiries:
+        return time.time() + default_ttl
+    return min( expiries ) - margin
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+LRU-bounded cache of raw extract_info() results. Entries expire along with the signed stream URLs they contain,
+and the cache keeps hit/miss counters so we can tell if it's earning its keep.
+"""
+class MetadataCache:
+
+    ## Constructor
+    def __init__( self, max_entries=MAX_ENTRIES, default_ttl=DEFAULT_TTL ):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    ## Grabs the data for a URL, or None if we don't have (fresh) data for it
+    def get( self, url ):
+        key = normalize_key( url )
+        entry = self.entries.get( key )
+        if entry == None:
+            self.misses += 1
+            return None
+
+        expires_at, data = entry
+        if time.time() >= expires_at:
+            del self.entries[ key ]
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end( key )
+        self.hits += 1
+        return data
+
+    ## Stores the data for a URL, dropping the least recently used entries if we're over the limit
+    def put( self, url, data ):
+        expires_at = get_data_expiry( data, default_ttl=self.default_ttl )
+        if expires_at <= time.time():
+            return
+
+        key = normalize_key( url )
+        self.entries[ key ] = ( expires_at, data )
+        self.entries.move_to_end( key )
+        while len( self.entries ) > self.max_entries:
+            self.entries.popitem( last=False )
+            self.evictions += 1
+
+    ## Drops the data for a URL (e.g. when its stream turned out to be dead)
+    def invalidate( self, url ):
+        self.entries.pop( normalize_key( url ), None )
+
+    ## Returns the cache counters
+    def stats( self ):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len( self.entries ),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+    def __len__( self ):
+        return len( self.entries )
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
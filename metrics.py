@@ -0,0 +1,267 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# metrics.py
+#
+# This file contains a small Prometheus-style metrics registry for the discord music bot, plus the local HTTP
+# endpoint which serves it in the Prometheus text format.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import asyncio
+import bisect
+import logging
+import os
+import threading
+import time
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9100
+
+# Latency buckets (in seconds), from a single frame up to a slow extraction
+DEFAULT_BUCKETS = ( 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30 )
+
+# How often (in seconds) we check how late the event loop wakes us up
+LOOP_LAG_INTERVAL = 0.5
+
+log = logging.getLogger( __name__ )
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+Base class for a metric with optional labels. Metrics get updated from the audio threads as well as the event
+loop, so every update goes through a lock.
+"""
+class Metric:
+
+    TYPE = None
+
+    ## Constructor
+    def __init__( self, name, help_text, labels=() ):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple( labels )
+        self.values = {}
+        self.lock = threading.Lock()
+
+    ## Builds the {label="value"} part of a sample line
+    def _format_labels( self, label_values, extra=() ):
+        pairs = list( zip( self.labels, label_values ) ) + list( extra )
+        if not pairs:
+            return ""
+        return "{" + ",".join( f'{key}="{value}"' for key, value in pairs ) + "}"
+
+    ## Returns the sample lines of this metric
+    def samples( self ):
+        with self.lock:
+            return [ f"{self.name}{self._format_labels( key )} {value}" for key, value in self.values.items() ]
+
+    ## Returns the metric in the Prometheus text format
+    def render( self ):
+        lines = [ f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.TYPE}" ]
+        return "\n".join( lines + self.samples() )
+
+
+"""
+A value which only goes up
+"""
+class Counter( Metric ):
+
+    TYPE = "counter"
+
+    def inc( self, *label_values, amount=1 ):
+        with self.lock:
+            self.values[ label_values ] = self.values.get( label_values, 0 ) + amount
+
+
+"""
+A value which goes up and down; either set directly, or read from a callback when scraped
+"""
+class Gauge( Metric ):
+
+    TYPE = "gauge"
+
+    ## Constructor (the callback returns a dict of label values tuple -> value)
+    def __init__( self, name, help_text, labels=(), callback=None ):
+        super().__init__( name, help_text, labels )
+        self.callback = callback
+
+    def set( self, value, *label_values ):
+        with self.lock:
+            self.values[ label_values ] = value
+
+    def samples( self ):
+        if self.callback != None:
+            values = self.callback()
+            with self.lock:
+                self.values = values
+        return super().samples()
+
+
+"""
+Counts observations into cumulative buckets, along with their sum and count
+"""
+class Histogram( Metric ):
+
+    TYPE = "histogram"
+
+    ## Constructor
+    def __init__( self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS ):
+        super().__init__( name, help_text, labels )
+        self.buckets = tuple( sorted( buckets ) )
+
+    def observe( self, value, *label_values ):
+        with self.lock:
+            entry = self.values.get( label_values )
+            if entry == None:
+                entry = [ [ 0 ] * ( len( self.buckets ) + 1 ), 0.0, 0 ]
+                self.values[ label_values ] = entry
+            entry[0][ bisect.bisect_left( self.buckets, value ) ] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples( self ):
+        lines = []
+        with self.lock:
+            for key, ( counts, total, count ) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip( self.buckets + ( "+Inf", ), counts ):
+                    cumulative += bucket_count
+                    labels = self._format_labels( key, [ ( 'le', bound ) ] )
+                    lines.append( f"{self.name}_bucket{labels} {cumulative}" )
+                lines.append( f"{self.name}_sum{self._format_labels( key )} {total}" )
+                lines.append( f"{self.name}_count{self._format_labels( key )} {count}" )
+        return lines
+
+    ## Times a block of code: with histogram.time( 'label' ): ...
+    def time( self, *label_values ):
+        return _Timer( self, label_values )
+
+
+class _Timer:
+
+    def __init__( self, histogram, label_values ):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__( self ):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__( self, *exc_info ):
+        self.histogram.observe( time.perf_counter() - self.started, *self.label_values )
+
+
+"""
+Holds every metric, and renders all of them for a scrape
+"""
+class Registry:
+
+    ## Constructor
+    def __init__( self ):
+        self.metrics = []
+
+    def register( self, metric ):
+        self.metrics.append( metric )
+        return metric
+
+    def counter( self, *args, **kwargs ):
+        return self.register( Counter( *args, **kwargs ) )
+
+    def gauge( self, *args, **kwargs ):
+        return self.register( Gauge( *args, **kwargs ) )
+
+    def histogram( self, *args, **kwargs ):
+        return self.register( Histogram( *args, **kwargs ) )
+
+    def render( self ):
+        rendered = []
+        for metric in self.metrics:
+            try:
+                rendered.append( metric.render() )
+            except Exception:
+                log.exception( "Error while rendering metric %s", metric.name )
+        return "\n".join( rendered ) + "\n"
+
+#-[ METRIC DEFS ]------------------------------------------------------------------------------------------------------#
+
+registry = Registry()
+
+extraction_seconds = registry.histogram(
+    "musicbot_extraction_seconds", "Time spent extracting metadata (or downloading)", labels=( "kind", )
+)
+transition_gap_seconds = registry.histogram(
+    "musicbot_transition_gap_seconds", "Silence between the end of a track and the first frame of the next one"
+)
+time_to_audio_seconds = registry.histogram(
+    "musicbot_time_to_audio_seconds", "Time from creating a source until its first frame", labels=( "reason", )
+)
+frame_underruns = registry.counter(
+    "musicbot_frame_underruns_total", "Audio frames which took longer than a frame (20ms) to read"
+)
+stream_resumes = registry.counter(
+    "musicbot_stream_resumes_total", "Cut off streams which got resumed"
+)
+loudness_analysis_seconds = registry.histogram(
+    "musicbot_loudness_analysis_seconds", "Time spent measuring the loudness of a track"
+)
+broadcast_frames = registry.counter(
+    "musicbot_broadcast_frames_total", "Frames put on air by broadcast stations, however many channels listen",
+    labels=( "station", )
+)
+admission_rejections = registry.counter(
+    "musicbot_admission_rejections_total", "Commands turned away by admission control", labels=( "reason", )
+)
+idle_disconnects = registry.counter(
+    "musicbot_idle_disconnects_total", "Voice connections dropped by the idle manager", labels=( "reason", )
+)
+ffmpeg_killed = registry.counter(
+    "musicbot_ffmpeg_killed_total", "Stray ffmpeg processes killed by the idle manager"
+)
+loop_lag_seconds = registry.gauge(
+    "musicbot_event_loop_lag_seconds", "How late the event loop last woke up a sleeping task"
+)
+
+#-[ FUNCTION DEFS ]----------------------------------------------------------------------------------------------------#
+
+# Reads the CPU time (in seconds) a process has used so far from /proc, None if we can't (e.g. not on Linux)
+def get_process_cpu_seconds( pid ):
+    try:
+        with open( f"/proc/{pid}/stat" ) as stat_file:
+            # The command name can contain spaces, so only split after its closing parenthesis
+            fields = stat_file.read().rsplit( ')', 1 )[1].split()
+        return ( int( fields[11] ) + int( fields[12] ) ) / os.sysconf( 'SC_CLK_TCK' )
+    except ( OSError, IndexError, ValueError ):
+        return None
+
+# Keeps measuring how late the event loop wakes us up, which is how long something blocked it
+async def watch_loop_lag( interval=LOOP_LAG_INTERVAL ):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep( interval )
+        loop_lag_seconds.set( max( 0.0, time.perf_counter() - started - interval ) )
+
+# Handles a scrape of the metrics endpoint
+async def _handle_metrics( request ):
+    from aiohttp import web
+    return web.Response( text=registry.render(), content_type="text/plain", charset="utf-8" )
+
+# Starts the metrics endpoint (and the loop lag watcher), returns the aiohttp runner so it can be cleaned up
+# (aiohttp's web server only gets imported here, it isn't needed until the bot is connected)
+async def start_server( host=METRICS_HOST, port=METRICS_PORT ):
+    from aiohttp import web
+    app = web.Application()
+    app.router.add_get( "/metrics", _handle_metrics )
+    runner = web.AppRunner( app )
+    await runner.setup()
+    await web.TCPSite( runner, host, port ).start()
+    asyncio.get_event_loop().create_task( watch_loop_lag() )
+    log.info( "Serving metrics on http://%s:%d/metrics", host, port )
+    return runner
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,249 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# pcm_effects.py
+#
+# This file contains the PCM effect chain for the discord music bot: gain, a biquad equalizer and a limiter, which
+# work on NumPy views of the 20ms frames discord.py reads, so effects don't need an ffmpeg filter process per stream.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import functools
+import math
+import numpy as np
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+# What discord.py reads: 20ms of 48kHz, 16-bit stereo (3840 bytes)
+SAMPLE_RATE = 48000
+CHANNELS = 2
+FRAME_SAMPLES = 960
+SAMPLE_WIDTH = 2 * CHANNELS
+
+# int16 <-> float conversion
+SCALE = 1 / 32768
+
+# How many taps of a biquad's impulse response the equalizer applies (21ms; the shelves we use are down well past
+# -60dB by then), and the FFT size which fits a frame plus those taps
+EQ_TAPS = 1024
+EQ_FFT_SIZE = 2048
+EQ_TAIL = EQ_FFT_SIZE - FRAME_SAMPLES
+
+# Peaks get held under this (of full scale); the limiter drops its gain right away, and recovers over this many frames
+LIMITER_THRESHOLD = 0.98
+LIMITER_RELEASE_FRAMES = 25
+
+# Equalizer presets: ( filter type, frequency in Hz, gain in dB, Q ) for each band
+EQ_PRESETS = {
+    'bass': [ ( 'lowshelf', 110, 6.0, 0.707 ) ],
+    'treble': [ ( 'highshelf', 6000, 5.0, 0.707 ) ],
+    'vocal': [ ( 'lowshelf', 150, -3.0, 0.707 ), ( 'peaking', 2500, 3.0, 1.0 ) ],
+    'loudness': [ ( 'lowshelf', 100, 4.0, 0.707 ), ( 'highshelf', 8000, 3.0, 0.707 ) ],
+}
+
+# Sample positions within a frame, for building per-sample gain ramps
+_SAMPLE_INDEX = np.arange( FRAME_SAMPLES, dtype=np.float32 )
+
+#-[ FUNCTION DEFS ]----------------------------------------------------------------------------------------------------#
+
+# Works out the (normalized) coefficients of a biquad filter, following the RBJ audio EQ cookbook
+def biquad_coefficients( kind, frequency, gain_db, q ):
+    a = 10 ** ( gain_db / 40 )
+    w0 = 2 * math.pi * frequency / SAMPLE_RATE
+    cos_w0 = math.cos( w0 )
+    alpha = math.sin( w0 ) / ( 2 * q )
+    sqrt_a = math.sqrt( a )
+
+    if kind == 'peaking':
+        b = ( 1 + alpha * a, -2 * cos_w0, 1 - alpha * a )
+        a_ = ( 1 + alpha / a, -2 * cos_w0, 1 - alpha / a )
+    elif kind == 'lowshelf':
+        b = ( a * ( ( a + 1 ) - ( a - 1 ) * cos_w0 + 2 * sqrt_a * alpha ),
+              2 * a * ( ( a - 1 ) - ( a + 1 ) * cos_w0 ),
+              a * ( ( a + 1 ) - ( a - 1 ) * cos_w0 - 2 * sqrt_a * alpha ) )
+        a_ = ( ( a + 1 ) + ( a - 1 ) * cos_w0 + 2 * sqrt_a * alpha,
+               -2 * ( ( a - 1 ) + ( a + 1 ) * cos_w0 ),
+               ( a + 1 ) + ( a - 1 ) * cos_w0 - 2 * sqrt_a * alpha )
+    elif kind == 'highshelf':
+        b = ( a * ( ( a + 1 ) + ( a - 1 ) * cos_w0 + 2 * sqrt_a * alpha ),
+              -2 * a * ( ( a - 1 ) + ( a + 1 ) * cos_w0 ),
+              a * ( ( a + 1 ) + ( a - 1 ) * cos_w0 - 2 * sqrt_a * alpha ) )
+        a_ = ( ( a + 1 ) - ( a - 1 ) * cos_w0 + 2 * sqrt_a * alpha,
+               2 * ( ( a - 1 ) - ( a + 1 ) * cos_w0 ),
+               ( a + 1 ) - ( a - 1 ) * cos_w0 - 2 * sqrt_a * alpha )
+    else:
+        raise ValueError( "Unknown filter type: " + kind )
+
+    return tuple( value / a_[0] for value in b ), ( 1.0, a_[1] / a_[0], a_[2] / a_[0] )
+
+# Runs a unit impulse through a biquad, returning the first taps of its response
+def biquad_impulse_response( b, a, taps=EQ_TAPS ):
+    response = np.zeros( taps )
+    x1 = x2 = y1 = y2 = 0.0
+    for n in range( taps ):
+        x0 = 1.0 if n == 0 else 0.0
+        y0 = b[0] * x0 + b[1] * x1 + b[2] * x2 - a[1] * y1 - a[2] * y2
+        response[ n ] = y0
+        x1, x2, y1, y2 = x0, x1, y0, y1
+    return response
+
+# Builds the frequency response of a preset's bands (cascaded), ready to multiply an FFT'd frame with.
+# Presets are shared by every guild using them, so each one only gets built once.
+@functools.lru_cache( maxsize=None )
+def get_preset_response( preset ):
+    response = np.zeros( EQ_TAPS )
+    response[0] = 1.0
+    for band in EQ_PRESETS[ preset ]:
+        response = np.convolve( response, biquad_impulse_response( *biquad_coefficients( *band ) ) )[ :EQ_TAPS ]
+    return np.fft.rfft( response, n=EQ_FFT_SIZE )[ :, np.newaxis ]
+
+# Takes a frame's bytes as an (n, 2) int16 array, without copying them
+def frame_view( data ):
+    samples = len( data ) // SAMPLE_WIDTH
+    return np.frombuffer( data, dtype=np.int16, count=samples * CHANNELS ).reshape( samples, CHANNELS )
+
+# Mixes a frame of the outgoing track into a frame of the incoming one, with equal power fades; index is which frame
+# of the crossfade this is, out of total
+def crossfade_frames( outgoing, incoming, index, total ):
+    new = frame_view( incoming )
+    old = frame_view( outgoing )
+    n = len( new )
+    t = ( _SAMPLE_INDEX[ :n ] + index * FRAME_SAMPLES ) * ( 0.5 * math.pi / ( total * FRAME_SAMPLES ) )
+
+    mixed = new * np.sin( t )[ :, np.newaxis ]
+    overlap = min( n, len( old ) )
+    mixed[ :overlap ] += old[ :overlap ] * np.cos( t[ :overlap ] )[ :, np.newaxis ]
+    np.clip( mixed, -32768, 32767, out=mixed )
+    return mixed.astype( np.int16 ).tobytes()
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+A static gain; changes get ramped over a frame, so turning the volume doesn't click
+"""
+class Gain:
+
+    ## Constructor
+    def __init__( self, level=1.0 ):
+        self.level = level
+        self._applied = level
+        self._ramp = np.empty( FRAME_SAMPLES, dtype=np.float32 )
+
+    def process( self, samples ):
+        if self.level == self._applied:
+            if self.level != 1.0:
+                samples *= self.level
+            return
+
+        n = len( samples )
+        ramp = self._ramp[ :n ]
+        np.multiply( _SAMPLE_INDEX[ :n ], ( self.level - self._applied ) / n, out=ramp )
+        ramp += self._applied
+        samples *= ramp[ :, np.newaxis ]
+        self._applied = self.level
+
+
+"""
+An equalizer made of cascaded biquads (see EQ_PRESETS).
+
+A biquad is recursive, which doesn't vectorize; its impulse response (truncated to EQ_TAPS) does, so frames get
+filtered by FFT convolution with overlap-add: two FFTs per frame, whatever the number of bands.
+"""
+class Equalizer:
+
+    ## Constructor
+    def __init__( self, preset ):
+        self.preset = preset
+        self._response = get_preset_response( preset )
+        self._tail = np.zeros( ( EQ_TAIL, CHANNELS ) )
+
+    def process( self, samples ):
+        n = len( samples )
+        filtered = np.fft.irfft( np.fft.rfft( samples, n=EQ_FFT_SIZE, axis=0 ) * self._response, n=EQ_FFT_SIZE, axis=0 )
+
+        # This frame's output, plus whatever the previous frames rang into it
+        samples[:] = filtered[ :n ] + self._tail[ :n ]
+        tail = filtered[ n:n + EQ_TAIL ]
+        tail[ :EQ_TAIL - n ] += self._tail[ n: ]
+        self._tail = tail
+
+
+"""
+A peak limiter: frames which would clip get turned down (right away), and the gain comes back up slowly afterwards
+"""
+class Limiter:
+
+    ## Constructor
+    def __init__( self, threshold=LIMITER_THRESHOLD, release_frames=LIMITER_RELEASE_FRAMES ):
+        self.threshold = threshold
+        self.release_frames = release_frames
+        self.gain = 1.0
+        self._ramp = np.empty( FRAME_SAMPLES, dtype=np.float32 )
+
+    def process( self, samples ):
+        peak = max( float( samples.max() ), -float( samples.min() ) )
+        target = min( 1.0, self.threshold / peak ) if peak > 0 else 1.0
+
+        if target < self.gain:
+            self.gain = target
+            samples *= target
+            return
+        if self.gain == 1.0:
+            return
+
+        # Recover gradually, ramping from the last gain to the new one over the frame
+        n = len( samples )
+        gain = min( target, self.gain + ( 1.0 - self.gain ) / self.release_frames )
+        ramp = self._ramp[ :n ]
+        np.multiply( _SAMPLE_INDEX[ :n ], ( gain - self.gain ) / n, out=ramp )
+        ramp += self.gain
+        samples *= ramp[ :, np.newaxis ]
+        self.gain = gain
+
+
+"""
+Runs a frame through gain, (optionally) an equalizer, and a limiter.
+
+The frame is read through a view of its bytes and converted into one float buffer, which every effect works on in
+place; the only other copy is the finished frame going back out as bytes.
+"""
+class EffectChain:
+
+    ## Constructor (eq is the name of an EQ preset, or None)
+    def __init__( self, volume=1.0, eq=None ):
+        self.gain = Gain( volume )
+        self.equalizer = None
+        self.limiter = Limiter()
+        self.set_eq( eq )
+
+        self._buffer = np.empty( ( FRAME_SAMPLES, CHANNELS ), dtype=np.float32 )
+        self._output = np.empty( ( FRAME_SAMPLES, CHANNELS ), dtype=np.int16 )
+
+    ## Switches the EQ preset (None turns it off)
+    def set_eq( self, eq ):
+        self.equalizer = Equalizer( eq ) if eq != None else None
+
+    ## Runs a frame (PCM bytes) through the chain
+    def process( self, data, volume=None ):
+        if volume != None:
+            self.gain.level = volume
+
+        pcm = frame_view( data )
+        n = len( pcm )
+        samples = self._buffer[ :n ]
+        np.multiply( pcm, np.float32( SCALE ), out=samples )
+
+        self.gain.process( samples )
+        if self.equalizer != None:
+            self.equalizer.process( samples )
+        self.limiter.process( samples )
+
+        samples *= 32767
+        output = self._output[ :n ]
+        np.copyto( output, samples, casting='unsafe' )
+        return output.tobytes()
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
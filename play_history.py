@@ -0,0 +1,284 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# play_history.py
+#
+# This file contains the play history for the discord music bot: what every guild played, how often, who asked for
+# it, how often it got skipped and which tracks followed which. Autoplay (radio mode) picks its tracks from here,
+# so it never has to search YouTube.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import asyncio
+import collections
+import json
+import logging
+import math
+import random
+import time
+
+import sqlite_store
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+HISTORY_PATH = "play_history.db"
+
+# How long (in seconds) we gather plays and skips before writing them out in one go
+DEBOUNCE_SECONDS = 5.0
+
+# How many of a guild's most played tracks get loaded into its index
+MAX_TRACKS = 2000
+
+# Tracks played this recently (in tracks) don't get picked by autoplay again, unless there's nothing else
+RECENT_TRACKS = 25
+
+# How much "this usually comes next" counts for, next to how popular (and how rarely skipped) a track is
+TRANSITION_WEIGHT = 3.0
+
+# Autoplay picks at random among this many of the best candidates (weighted by score), so radio mode doesn't loop
+TOP_CANDIDATES = 5
+
+log = logging.getLogger( __name__ )
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+What we know about one track in one guild
+"""
+class TrackStats:
+
+    __slots__ = ( 'song', 'plays', 'skips', 'requester', 'last_played' )
+
+    ## Constructor (song is the track's to_dict() output, minus anything which expires)
+    def __init__( self, song, plays=0, skips=0, requester=None, last_played=0.0 ):
+        self.song = song
+        self.plays = plays
+        self.skips = skips
+        self.requester = requester
+        self.last_played = last_played
+
+    def skip_rate( self ):
+        return min( 1.0, self.skips / self.plays ) if self.plays else 0.0
+
+    ## How good a pick the track is on its own: popular, and not usually skipped
+    def score( self ):
+        return math.log1p( self.plays ) * ( 1.0 - self.skip_rate() )
+
+
+"""
+One guild's history, in memory: track stats, how often each track followed each other track, and what played last
+"""
+class GuildIndex:
+
+    ## Constructor
+    def __init__( self ):
+        self.tracks = {}
+        self.transitions = collections.defaultdict( collections.Counter )
+        self.recent = collections.deque( maxlen=RECENT_TRACKS )
+        self.last_id = None
+
+
+"""
+SQLite (WAL mode) backed play history, with an in-memory index per guild for ranking autoplay candidates.
+
+Plays and skips update the index right away, and get written out as increments after a short debounce, on a
+dedicated writer thread (like the queue store). A guild's index gets loaded from disk once, the first time
+something asks for it; whatever got recorded in the meantime is merged on top, so nothing gets lost.
+"""
+class PlayHistory( sqlite_store.DebouncedStore ):
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS tracks ( guild_id INTEGER, video_id TEXT, song TEXT, plays INTEGER, "
+        "skips INTEGER, requester INTEGER, last_played REAL, PRIMARY KEY ( guild_id, video_id ) )",
+        "CREATE TABLE IF NOT EXISTS transitions ( guild_id INTEGER, from_id TEXT, to_id TEXT, count INTEGER, "
+        "PRIMARY KEY ( guild_id, from_id, to_id ) )"
+    )
+
+    THREAD_NAME = "play-history"
+
+    ## Constructor
+    def __init__( self, path=HISTORY_PATH, debounce=DEBOUNCE_SECONDS, max_tracks=MAX_TRACKS ):
+        super().__init__( path, debounce )
+        self.max_tracks = max_tracks
+        self.indexes = {}
+
+        # Increments waiting to be written: ( guild id, video id ) -> [ song, plays, skips, requester, last played ]
+        # and ( guild id, from id, to id ) -> count
+        self._track_deltas = {}
+        self._transition_deltas = collections.Counter()
+        self._loading = {}
+
+    ## Grabs a guild's index (an empty one if it isn't loaded yet)
+    def _index( self, guild_id ):
+        index = self.indexes.get( guild_id )
+        if index == None:
+            index = self.indexes[ guild_id ] = GuildIndex()
+        return index
+
+    ## Records a song starting to play in a guild (and that it followed whatever played before it)
+    def record_play( self, guild_id, song ):
+        index = self._index( guild_id )
+        now = time.time()
+        song_dict = dict( song.to_dict(), url=None, expires_at=None, start_time=0, requester=None )
+
+        stats = index.tracks.get( song.id )
+        if stats == None:
+            stats = index.tracks[ song.id ] = TrackStats( song_dict )
+        stats.song = song_dict
+        stats.plays += 1
+        stats.last_played = now
+        if song.requester != None:
+            stats.requester = song.requester
+
+        delta = self._track_deltas.setdefault( ( guild_id, song.id ), [ song_dict, 0, 0, None, now ] )
+        delta[0], delta[1], delta[3], delta[4] = song_dict, delta[1] + 1, stats.requester, now
+
+        if index.last_id != None and index.last_id != song.id:
+            index.transitions[ index.last_id ][ song.id ] += 1
+            self._transition_deltas[ ( guild_id, index.last_id, song.id ) ] += 1
+        index.last_id = song.id
+        index.recent.append( song.id )
+        self._schedule_flush()
+
+    ## Records a song getting skipped in a guild
+    def record_skip( self, guild_id, song ):
+        stats = self._index( guild_id ).tracks.get( song.id )
+        if stats != None:
+            stats.skips += 1
+        delta = self._track_deltas.get( ( guild_id, song.id ) )
+        if delta == None:
+            song_dict = dict( song.to_dict(), url=None, expires_at=None, start_time=0, requester=None )
+            last_played = stats.last_played if stats != None else time.time()
+            delta = self._track_deltas[ ( guild_id, song.id ) ] = [ song_dict, 0, 0, song.requester, last_played ]
+        delta[2] += 1
+        self._schedule_flush()
+
+    ## Checks if a guild has any (loaded) history for autoplay to pick from
+    def has_history( self, guild_id ):
+        index = self.indexes.get( guild_id )
+        return index != None and len( index.tracks ) > 0
+
+    ## Picks the track autoplay should play after current_id (skipping the ids in exclude), as a song dict.
+    ## Tracks which usually follow the current one rank highest, then popular ones which rarely get skipped; the
+    ## pick is weighted random among the best few. Recently played tracks only come back when there's nothing else
+    ## (a short history). Returns None if the guild hasn't got any history (loaded), or nothing but the current song.
+    def recommend( self, guild_id, current_id, exclude=() ):
+        index = self.indexes.get( guild_id )
+        if index == None or not index.tracks:
+            return None
+
+        candidates = self._candidates( index, current_id, set( exclude ) | set( index.recent ) )
+        if not candidates:
+            candidates = self._candidates( index, current_id, exclude )
+        if not candidates:
+            return None
+
+        best = sorted( candidates, reverse=True )[ :TOP_CANDIDATES ]
+        _, video_id = random.choices( best, weights=[ score for score, _ in best ] )[0]
+        return dict( index.tracks[ video_id ].song )
+
+    ## Scores every track which could come after current_id (leaving out the ids in exclude), as ( score, id )
+    def _candidates( self, index, current_id, exclude ):
+        followers = index.transitions.get( current_id, {} )
+        total = sum( followers.values() ) or 1
+        candidates = []
+        for video_id, stats in index.tracks.items():
+            if video_id == current_id or video_id in exclude:
+                continue
+            score = TRANSITION_WEIGHT * followers.get( video_id, 0 ) / total + stats.score()
+            if score > 0:
+                candidates.append( ( score, video_id ) )
+        return candidates
+
+    ## Makes sure a guild's index gets loaded from disk (once); returns the loading task, for whoever wants to wait
+    def load( self, guild_id ):
+        task = self._loading.get( guild_id )
+        if task == None:
+            task = self._loading[ guild_id ] = asyncio.get_event_loop().create_task( self._load( guild_id ) )
+        return task
+
+    async def _load( self, guild_id ):
+        # The index starts over (keeping what played last), before anything gets awaited: from here on it only
+        # collects what isn't on disk yet. Whatever was recorded so far goes out first, so the disk has all of it.
+        previous = self._index( guild_id )
+        index = self.indexes[ guild_id ] = GuildIndex()
+        index.recent.extend( previous.recent )
+        index.last_id = previous.last_id
+        self._cancel_flush()
+        await self.flush()
+
+        try:
+            tracks, transitions = await self._run( self._read_guild, guild_id )
+        except Exception:
+            log.exception( "Error while loading play history guild=%s", guild_id )
+            self._loading.pop( guild_id, None )
+            return
+
+        for video_id, song, plays, skips, requester, last_played in tracks:
+            stats = index.tracks.get( video_id )
+            if stats == None:
+                index.tracks[ video_id ] = TrackStats( json.loads( song ), plays, skips, requester, last_played )
+            else:
+                # Recorded while the read ran: the disk only has what came before
+                stats.plays += plays
+                stats.skips += skips
+                stats.requester = stats.requester or requester
+        for from_id, to_id, count in transitions:
+            index.transitions[ from_id ][ to_id ] += count
+        log.info( "Loaded play history guild=%s tracks=%d", guild_id, len( index.tracks ) )
+
+    def _read_guild( self, guild_id ):
+        connection = self._connect()
+        tracks = connection.execute(
+            "SELECT video_id, song, plays, skips, requester, last_played FROM tracks WHERE guild_id = ? "
+            "ORDER BY plays DESC LIMIT ?", ( guild_id, self.max_tracks )
+        ).fetchall()
+        transitions = connection.execute(
+            "SELECT from_id, to_id, count FROM transitions WHERE guild_id = ?", ( guild_id, )
+        ).fetchall()
+        return tracks, transitions
+
+    ## Takes every pending increment, for the next write
+    def _take_batch( self ):
+        if not self._track_deltas and not self._transition_deltas:
+            return None
+
+        tracks = [ ( guild_id, video_id, json.dumps( song ), plays, skips, requester, last_played )
+                   for ( guild_id, video_id ), ( song, plays, skips, requester, last_played )
+                   in self._track_deltas.items() ]
+        transitions = [ ( guild_id, from_id, to_id, count )
+                        for ( guild_id, from_id, to_id ), count in self._transition_deltas.items() ]
+        self._track_deltas = {}
+        self._transition_deltas = collections.Counter()
+        return tracks, transitions
+
+    def _write( self, tracks, transitions ):
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                "INSERT INTO tracks VALUES ( ?, ?, ?, ?, ?, ?, ? ) ON CONFLICT ( guild_id, video_id ) DO UPDATE SET "
+                "song = excluded.song, plays = plays + excluded.plays, skips = skips + excluded.skips, "
+                "requester = COALESCE( excluded.requester, requester ), last_played = excluded.last_played", tracks
+            )
+            connection.executemany(
+                "INSERT INTO transitions VALUES ( ?, ?, ?, ? ) ON CONFLICT ( guild_id, from_id, to_id ) DO UPDATE SET "
+                "count = count + excluded.count", transitions
+            )
+
+    ## Drops a guild's index from memory (e.g. once its player is gone); it gets loaded again when it's needed
+    def forget( self, guild_id ):
+        self.indexes.pop( guild_id, None )
+        self._loading.pop( guild_id, None )
+
+    ## Returns the history counters
+    def stats( self ):
+        return {
+            'guilds': len( self.indexes ),
+            'tracks': sum( len( index.tracks ) for index in self.indexes.values() ),
+            'pending': len( self._track_deltas ) + len( self._transition_deltas )
+        }
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,134 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# queue_store.py
+#
+# This file contains the persistent player state store for the discord music bot. Queues, loop modes and playback
+# positions get saved to SQLite, so a restart (or a crash) doesn't wipe every guild's queue.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import json
+import logging
+import time
+
+import sqlite_store
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+STORE_PATH = "player_state.db"
+
+# How long (in seconds) we gather changes before writing them out in one go
+DEBOUNCE_SECONDS = 2.0
+
+log = logging.getLogger( __name__ )
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+SQLite (WAL mode) backed store of per-guild player state.
+
+Players only mark themselves dirty; after a short debounce, the states of all dirty players get snapshotted on the
+event loop and written in a single transaction on a dedicated writer thread, so playback never waits on the disk.
+
+A guild's settings (volume, EQ and so on) also go into a table of their own, which deleting its state leaves alone,
+so they outlive an evicted player. Every guild's settings are kept in memory too, for new players to start out with.
+"""
+class QueueStore( sqlite_store.DebouncedStore ):
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS players ( guild_id INTEGER PRIMARY KEY, state TEXT, updated_at REAL )",
+        "CREATE TABLE IF NOT EXISTS settings ( guild_id INTEGER PRIMARY KEY, settings TEXT )"
+    )
+
+    THREAD_NAME = "queue-store"
+
+    ## Constructor
+    def __init__( self, path=STORE_PATH, debounce=DEBOUNCE_SECONDS ):
+        super().__init__( path, debounce )
+        self._dirty = {}
+        self._deleted = set()
+
+        # Every guild's saved settings, and the ones which changed since the last write
+        self.settings = {}
+        self._changed_settings = {}
+
+    ## Marks a player as changed; it gets written out with the next batch
+    def mark_dirty( self, player ):
+        self._deleted.discard( player.guild_id )
+        self._dirty[ player.guild_id ] = player
+        self._schedule_flush()
+
+    ## Marks a guild's saved state (its queue and where it was) for deletion; its settings are kept
+    def mark_deleted( self, guild_id ):
+        player = self._dirty.pop( guild_id, None )
+        if player != None:
+            self._changed_settings[ guild_id ] = player.settings()
+        self._deleted.add( guild_id )
+        self._schedule_flush()
+
+    ## Snapshots every dirty player, for the next write
+    def _take_batch( self ):
+        if not self._dirty and not self._deleted and not self._changed_settings:
+            return None
+
+        now = time.time()
+        rows = [ ( guild_id, json.dumps( player.snapshot() ), now ) for guild_id, player in self._dirty.items() ]
+        deleted = [ ( guild_id, ) for guild_id in self._deleted ]
+        for guild_id, player in self._dirty.items():
+            self._changed_settings[ guild_id ] = player.settings()
+
+        # Settings hardly ever change, so only the ones that did get written
+        settings_rows = []
+        for guild_id, settings in self._changed_settings.items():
+            if self.settings.get( guild_id ) != settings:
+                self.settings[ guild_id ] = settings
+                settings_rows.append( ( guild_id, json.dumps( settings ) ) )
+
+        self._dirty.clear()
+        self._deleted.clear()
+        self._changed_settings.clear()
+        return rows, deleted, settings_rows
+
+    def _write( self, rows, deleted, settings_rows ):
+        connection = self._connect()
+        with connection:
+            connection.executemany( "INSERT OR REPLACE INTO players VALUES ( ?, ?, ? )", rows )
+            connection.executemany( "DELETE FROM players WHERE guild_id = ?", deleted )
+            connection.executemany( "INSERT OR REPLACE INTO settings VALUES ( ?, ? )", settings_rows )
+
+    ## Returns the ids of every guild with saved state
+    async def saved_guild_ids( self ):
+        return await self._run( self._read_guild_ids )
+
+    def _read_guild_ids( self ):
+        return [ row[0] for row in self._connect().execute( "SELECT guild_id FROM players" ) ]
+
+    ## Returns the saved state of a guild, or None if there isn't any
+    async def load( self, guild_id ):
+        return await self._run( self._read_state, guild_id )
+
+    def _read_state( self, guild_id ):
+        row = self._connect().execute( "SELECT state FROM players WHERE guild_id = ?", ( guild_id, ) ).fetchone()
+        return json.loads( row[0] ) if row != None else None
+
+    ## Returns a guild's latest settings (even if they haven't been written yet), None if it has none
+    def settings_of( self, guild_id ):
+        return self._changed_settings.get( guild_id, self.settings.get( guild_id ) )
+
+    ## Loads every guild's saved settings into memory
+    async def load_settings( self ):
+        saved = await self._run( self._read_settings )
+        # Whatever got saved while we were loading is newer
+        for guild_id, settings in saved.items():
+            self.settings.setdefault( guild_id, settings )
+        log.info( "Loaded player settings guilds=%d", len( saved ) )
+
+    def _read_settings( self ):
+        rows = self._connect().execute( "SELECT guild_id, settings FROM settings" )
+        return { guild_id: json.loads( settings ) for guild_id, settings in rows }
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,195 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# queue_view.py
+#
+# This file contains the paginated queue view behind m!list: one message per guild which gets edited in place as the
+# queue changes, with reactions to flip through the pages.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import asyncio
+import itertools
+import logging
+import time
+
+import discord
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+PAGE_SIZE = 10
+
+# Discord caps embed field values at 1024 characters; titles get cut short so a full page always fits
+FIELD_LIMIT = 1024
+TITLE_LIMIT = 80
+
+# The least time (in seconds) between two edits of the same view, so busy queues don't hit the rate limits
+UPDATE_INTERVAL = 2.0
+
+# How long (in seconds) a view keeps updating after it was last asked for (or paged through)
+VIEW_TIMEOUT = 600
+
+PREV_PAGE = "◀"
+NEXT_PAGE = "▶"
+
+EMBED_COLOUR = 0xEC6541
+
+log = logging.getLogger( __name__ )
+
+#-[ FUNCTION DEFS ]----------------------------------------------------------------------------------------------------#
+
+# Cuts a string down to a length, marking that it was cut
+def shorten( text, limit ):
+    return text if len( text ) <= limit else text[ :limit - 1 ] + "…"
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+The queue view of a single guild: the message it lives in, and the page it's on
+"""
+class QueueView:
+
+    ## Constructor
+    def __init__( self, player, message, author ):
+        self.player = player
+        self.message = message
+        self.author = author
+        self.page = 0
+        self.last_used = time.monotonic()
+        self.last_edit = 0.0
+        self.rendered = None
+        self.handle = None
+
+    ## Number of pages the queue takes up (an empty queue still gets one)
+    def page_count( self ):
+        return max( 1, -( -len( self.player.queue ) // PAGE_SIZE ) )
+
+    ## Builds the embed for the current page; only the songs on that page get formatted
+    def render( self ):
+        player = self.player
+        self.page = min( self.page, self.page_count() - 1 )
+        first = self.page * PAGE_SIZE
+
+        lines = []
+        for i, song in enumerate( itertools.islice( player.queue, first, first + PAGE_SIZE ), first + 1 ):
+            line = f"{i}:\t {shorten( song.title, TITLE_LIMIT )}"
+            if sum( len( other ) + 1 for other in lines ) + len( line ) > FIELD_LIMIT - 2:
+                lines.append( "…" )
+                break
+            lines.append( line )
+        queue_str = '\n'.join( lines ) if lines else "There are no songs in the queue!"
+
+        now_playing_title = "Now Playing (on repeat):" if player.loop_current else "Now Playing:"
+        now_playing_str = shorten( player.now_playing.title, FIELD_LIMIT ) if player.now_playing != None else "Nothing"
+
+        queue_title = "Music Queue (on loop)" if player.loop_queue else "Music Queue"
+        if player.queue.fair:
+            queue_title += " (fair)"
+
+        embed = discord.Embed( title=queue_title, colour=EMBED_COLOUR )
+        embed.set_author( name=self.author.display_name, icon_url=self.author.avatar_url )
+        embed.add_field( name="Up Next:", value=queue_str, inline=False )
+        embed.add_field( name=now_playing_title, value=now_playing_str, inline=False )
+        embed.set_footer( text=f"Page {self.page + 1}/{self.page_count()} · {len( player.queue )} song(s)" )
+        return embed
+
+    ## Edits the message, unless nothing visible changed since the last edit
+    async def refresh( self ):
+        self.handle = None
+        embed = self.render()
+        rendered = embed.to_dict()
+        if rendered == self.rendered:
+            return
+
+        self.last_edit = time.monotonic()
+        self.rendered = rendered
+        try:
+            await self.message.edit( embed=embed )
+        except discord.HTTPException as e:
+            log.warning( "Error while updating the queue view guild=%s error=%s", self.player.guild_id, e )
+
+
+"""
+Keeps the queue view of every guild, and pages through / refreshes them.
+
+Asking for the queue again in the same channel doesn't send anything new, it just refreshes the view that's already
+there. Edits are rate limited per view: changes that come in quick succession get batched into a single edit.
+"""
+class QueueViews:
+
+    ## Constructor
+    def __init__( self, update_interval=UPDATE_INTERVAL, timeout=VIEW_TIMEOUT ):
+        self.update_interval = update_interval
+        self.timeout = timeout
+        self.views = {}
+
+    ## Shows the queue of a player in the context's channel, reusing the view that's already there if it can
+    async def show( self, ctx, player ):
+        view = self._live_view( player.guild_id )
+        if view != None and view.message.channel.id == ctx.channel.id:
+            view.player = player
+            view.last_used = time.monotonic()
+            self._schedule( view )
+            return view
+
+        view = QueueView( player, None, ctx.message.author )
+        embed = view.render()
+        view.rendered = embed.to_dict()
+        view.last_edit = time.monotonic()
+        view.message = await ctx.send( embed=embed )
+        self.views[ player.guild_id ] = view
+
+        try:
+            await view.message.add_reaction( PREV_PAGE )
+            await view.message.add_reaction( NEXT_PAGE )
+        except discord.HTTPException as e:
+            log.warning( "Error while adding the page reactions guild=%s error=%s", player.guild_id, e )
+        return view
+
+    ## Lets a guild's view know the queue changed; it gets refreshed once the rate limit allows
+    def mark_changed( self, guild_id ):
+        view = self._live_view( guild_id )
+        if view != None and view.message != None:
+            self._schedule( view )
+
+    ## Flips a page if a reaction landed on a queue view; adding and removing a reaction both count as a click,
+    ## so nobody has to remove their reaction first (and the bot doesn't need permission to remove them)
+    def handle_reaction( self, message_id, emoji, user ):
+        if user.bot:
+            return
+        view = next( ( view for view in self.views.values()
+                       if view.message != None and view.message.id == message_id ), None )
+        if view == None or str( emoji ) not in ( PREV_PAGE, NEXT_PAGE ):
+            return
+
+        step = -1 if str( emoji ) == PREV_PAGE else 1
+        view.page = ( view.page + step ) % view.page_count()
+        view.last_used = time.monotonic()
+        self._schedule( view )
+
+    ## Forgets a guild's view (e.g. when the bot leaves)
+    def remove( self, guild_id ):
+        view = self.views.pop( guild_id, None )
+        if view != None and view.handle != None:
+            view.handle.cancel()
+
+    ## Returns a guild's view, dropping it if nobody has looked at it in a while
+    def _live_view( self, guild_id ):
+        view = self.views.get( guild_id )
+        if view != None and time.monotonic() - view.last_used > self.timeout:
+            self.remove( guild_id )
+            return None
+        return view
+
+    ## Refreshes a view as soon as the rate limit allows (only one refresh is ever pending per view)
+    def _schedule( self, view ):
+        if view.handle != None:
+            return
+        loop = asyncio.get_event_loop()
+        delay = max( 0.0, view.last_edit + self.update_interval - time.monotonic() )
+        view.handle = loop.call_later( delay, lambda: loop.create_task( view.refresh() ) )
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
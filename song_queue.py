@@ -0,0 +1,275 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# song_queue.py
+#
+# This file contains the song queue used by the guild players: a linked list with O(1) append, pop and removal (by
+# the handle put() hands back), which can also play fair between the people queueing songs.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import collections
+import itertools
+import random
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+A queued song. The queue hands these out as handles, so a song can be removed (or moved) later on without looking
+for it first. Every node sits in two lists: the queue's own order, and the list of songs of the same requester.
+"""
+class QueueEntry:
+
+    __slots__ = ( 'song', 'requester', 'prev', 'next', 'lane_prev', 'lane_next', 'owner' )
+
+    ## Constructor
+    def __init__( self, song, requester ):
+        self.song = song
+        self.requester = requester
+        self.prev = None
+        self.next = None
+        self.lane_prev = None
+        self.lane_next = None
+        self.owner = None
+
+
+class _Lane:
+
+    __slots__ = ( 'head', 'tail', 'count' )
+
+    def __init__( self ):
+        self.head = None
+        self.tail = None
+        self.count = 0
+
+
+"""
+Song queue with two ways of picking the next song:
+  - in order (the default): first come, first served
+  - fair: takes turns between requesters, so one person's 200 song playlist doesn't starve everyone else. Each
+    requester's songs still play in queue order.
+
+Appending, popping and removing by handle are O(1); moving and shuffling walk the queue, so they're O(n).
+"""
+class SongQueue:
+
+    ## Constructor
+    def __init__( self, fair=False ):
+        self.fair = fair
+        self._head = None
+        self._tail = None
+        self._count = 0
+        self._lanes = {}
+
+        # Requesters with songs waiting, in the order they get their next turn
+        self._turns = collections.OrderedDict()
+
+    def __len__( self ):
+        return self._count
+
+    def __bool__( self ):
+        return self._count > 0
+
+    ## Iterates over the songs in the order they'll play (lazily, so looking at the first few is cheap)
+    def __iter__( self ):
+        return ( entry.song for entry in self._iter_entries() )
+
+    ## Returns the entries in the order they'll play
+    def entries( self ):
+        return list( self._iter_entries() )
+
+    def _iter_entries( self ):
+        if not self.fair:
+            entry = self._head
+            while entry != None:
+                yield entry
+                entry = entry.next
+            return
+
+        # Play the turns out: every round, each requester (in turn order) gets their next song
+        cursors = [ self._lanes[ requester ].head for requester in self._turns ]
+        while cursors:
+            yield from cursors
+            cursors = [ entry.lane_next for entry in cursors if entry.lane_next != None ]
+
+    ## Returns the first few songs in the order they'll play
+    def peek( self, count ):
+        return list( itertools.islice( self, count ) )
+
+    ## Adds a song to the end of the queue (or the front), returns its handle
+    def append( self, song, requester=None, front=False ):
+        entry = QueueEntry( song, requester )
+        entry.owner = self
+        if front:
+            self._link_before( entry, self._head )
+        else:
+            self._link_after( entry, self._tail )
+        self._link_lane( entry )
+        if front and self.fair:
+            self._turns.move_to_end( requester, last=False )
+        return entry
+
+    ## Takes the next song off the queue, None if it's empty
+    def pop( self ):
+        if self._count == 0:
+            return None
+        if self.fair:
+            requester = next( iter( self._turns ) )
+            entry = self._lanes[ requester ].head
+        else:
+            entry = self._head
+        self.remove( entry )
+        # Whoever just had their turn goes to the back of the line
+        if entry.requester in self._turns:
+            self._turns.move_to_end( entry.requester )
+        return entry.song
+
+    ## Removes a song by its handle, returns False if it isn't on the queue (anymore)
+    def remove( self, entry ):
+        if entry.owner is not self:
+            return False
+        self._unlink( entry )
+        self._unlink_lane( entry )
+        entry.owner = None
+        return True
+
+    ## Moves a song to a position (in play order); returns False if the handle isn't on the queue.
+    ## In fair mode turns still alternate, so the song ends up as close to that position as taking turns allows.
+    def move( self, entry, index ):
+        if entry.owner is not self:
+            return False
+        order = [ other for other in self.entries() if other is not entry ]
+        order.insert( max( 0, min( index, len( order ) ) ), entry )
+        self._relink( order )
+        if self.fair:
+            # Turns go in the order the requesters first show up in the new order
+            requesters = [ other.requester for other in order ]
+            for requester in dict.fromkeys( requesters ):
+                self._turns.move_to_end( requester )
+        return True
+
+    ## Shuffles the queue (in fair mode, every requester's songs get shuffled, and the turn order too)
+    def shuffle( self ):
+        order = self.entries()
+        random.shuffle( order )
+        self._relink( order )
+        if self.fair:
+            requesters = list( self._turns )
+            random.shuffle( requesters )
+            for requester in requesters:
+                self._turns.move_to_end( requester )
+
+    ## Empties the queue
+    def clear( self ):
+        entry = self._head
+        while entry != None:
+            entry.owner = None
+            entry = entry.next
+        self._head = None
+        self._tail = None
+        self._count = 0
+        self._lanes.clear()
+        self._turns.clear()
+
+    ## Returns the entry at a position (in play order), None if there isn't one
+    def entry_at( self, index ):
+        if index < 0:
+            return None
+        return next( itertools.islice( self._iter_entries(), index, None ), None )
+
+    ## Rebuilds both lists from a play order
+    def _relink( self, order ):
+        turns = list( self._turns )
+        self._head = None
+        self._tail = None
+        self._count = 0
+        self._lanes.clear()
+        self._turns.clear()
+        for entry in order:
+            self._link_after( entry, self._tail )
+            self._link_lane( entry )
+        # Relinking shouldn't change whose turn it is
+        for requester in turns:
+            if requester in self._turns:
+                self._turns.move_to_end( requester )
+
+    def _link_after( self, entry, prev ):
+        entry.prev = prev
+        entry.next = prev.next if prev != None else None
+        if entry.next != None:
+            entry.next.prev = entry
+        if prev != None:
+            prev.next = entry
+        if self._head == None or prev == None:
+            self._head = entry
+        if self._tail == prev:
+            self._tail = entry
+        self._count += 1
+
+    def _link_before( self, entry, next_entry ):
+        if next_entry == None:
+            self._link_after( entry, self._tail )
+            return
+        entry.next = next_entry
+        entry.prev = next_entry.prev
+        if entry.prev != None:
+            entry.prev.next = entry
+        else:
+            self._head = entry
+        next_entry.prev = entry
+        self._count += 1
+
+    def _unlink( self, entry ):
+        if entry.prev != None:
+            entry.prev.next = entry.next
+        else:
+            self._head = entry.next
+        if entry.next != None:
+            entry.next.prev = entry.prev
+        else:
+            self._tail = entry.prev
+        entry.prev = entry.next = None
+        self._count -= 1
+
+    ## Puts an entry in its requester's lane, keeping the lane in queue order: at the front if the entry is the
+    ## queue's head, at the back otherwise (entries only ever get linked in at either end, or all in order)
+    def _link_lane( self, entry ):
+        lane = self._lanes.get( entry.requester )
+        if lane == None:
+            lane = self._lanes[ entry.requester ] = _Lane()
+            self._turns[ entry.requester ] = True
+
+        entry.lane_prev = entry.lane_next = None
+        if entry is self._head and lane.head != None:
+            entry.lane_next = lane.head
+            lane.head.lane_prev = entry
+            lane.head = entry
+        else:
+            entry.lane_prev = lane.tail
+            if lane.tail != None:
+                lane.tail.lane_next = entry
+            lane.tail = entry
+            if lane.head == None:
+                lane.head = entry
+        lane.count += 1
+
+    def _unlink_lane( self, entry ):
+        lane = self._lanes[ entry.requester ]
+        if entry.lane_prev != None:
+            entry.lane_prev.lane_next = entry.lane_next
+        else:
+            lane.head = entry.lane_next
+        if entry.lane_next != None:
+            entry.lane_next.lane_prev = entry.lane_prev
+        else:
+            lane.tail = entry.lane_prev
+        entry.lane_prev = entry.lane_next = None
+        lane.count -= 1
+        if lane.count == 0:
+            del self._lanes[ entry.requester ]
+            del self._turns[ entry.requester ]
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,105 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# sqlite_store.py
+#
+# This file contains the base class of the discord music bot's SQLite stores (player state, play history, loudness
+# gains): a WAL mode database which only one dedicated writer thread touches, and debounced batch writes.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import asyncio
+import concurrent.futures
+import logging
+import sqlite3
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+# How long (in seconds) we gather changes before writing them out in one go
+DEBOUNCE_SECONDS = 2.0
+
+log = logging.getLogger( __name__ )
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+SQLite (WAL mode) backed store, written in batches.
+
+Subclasses list their tables in SCHEMA, gather changes in memory (calling _schedule_flush()), and hand them over
+through _take_batch() (which returns the arguments for _write(), or None if there's nothing to write). After a short
+debounce, the batch gets written in a single transaction on a dedicated writer thread, so nobody waits on the disk.
+"""
+class DebouncedStore:
+
+    # CREATE TABLE statements, run when the database gets opened
+    SCHEMA = ()
+
+    THREAD_NAME = "sqlite-store"
+
+    ## Constructor
+    def __init__( self, path, debounce=DEBOUNCE_SECONDS ):
+        self.path = path
+        self.debounce = debounce
+        self.executor = concurrent.futures.ThreadPoolExecutor( max_workers=1, thread_name_prefix=self.THREAD_NAME )
+        self.connection = None
+
+        self._flush_handle = None
+
+    ## Opens the database (on the writer thread, which is the only one that ever touches it)
+    def _connect( self ):
+        if self.connection == None:
+            self.connection = sqlite3.connect( self.path, check_same_thread=False )
+            self.connection.execute( "PRAGMA journal_mode=WAL" )
+            self.connection.execute( "PRAGMA synchronous=NORMAL" )
+            for statement in self.SCHEMA:
+                self.connection.execute( statement )
+        return self.connection
+
+    ## Runs a function on the writer thread
+    async def _run( self, func, *args ):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor( self.executor, func, *args )
+
+    def _schedule_flush( self ):
+        if self._flush_handle == None:
+            loop = asyncio.get_event_loop()
+            self._flush_handle = loop.call_later( self.debounce, lambda: loop.create_task( self.flush() ) )
+
+    ## Drops the scheduled flush (for whoever is about to flush right away)
+    def _cancel_flush( self ):
+        if self._flush_handle != None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+    ## Takes everything pending off the store's hands; returns the arguments for _write(), None if there's nothing
+    def _take_batch( self ):
+        raise NotImplementedError
+
+    ## Writes a batch (on the writer thread)
+    def _write( self, *batch ):
+        raise NotImplementedError
+
+    ## Writes whatever is pending out in one transaction
+    async def flush( self ):
+        self._flush_handle = None
+        batch = self._take_batch()
+        if batch == None:
+            return
+
+        try:
+            await self._run( self._write, *batch )
+        except Exception:
+            log.exception( "Error while writing to %s", self.path )
+
+    ## Writes out whatever is pending and closes the database
+    async def close( self ):
+        self._cancel_flush()
+        await self.flush()
+        if self.connection != None:
+            await self._run( self.connection.close )
+        self.executor.shutdown( wait=False )
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,52 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# test_admission.py
+#
+# Tests for the admission control in front of the extraction-heavy commands.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import asyncio
+import pytest
+
+import admission
+
+#-[ TEST DEFS ]--------------------------------------------------------------------------------------------------------#
+
+def test_rejected_commands_cost_nothing():
+    async def run():
+        gate = admission.AdmissionController( max_pending_per_guild=1, user_rate=1e-6, guild_rate=1e-6 )
+        async with gate.admit( 1, 1 ):
+            for _ in range( 3 ):
+                with pytest.raises( admission.Rejected ) as rejected:
+                    async with gate.admit( 1, 2 ):
+                        pass
+                assert rejected.value.reason == admission.REASON_GUILD_BUSY
+        return gate
+
+    gate = asyncio.run( run() )
+    assert gate.user_buckets[2].tokens == pytest.approx( gate.user_burst )
+    assert gate.guild_buckets[1].tokens == pytest.approx( gate.guild_burst - 1 )
+    assert gate.pending == 0
+
+def test_playlist_cost_has_to_fit_in_the_buckets():
+    with pytest.raises( ValueError ):
+        admission.AdmissionController( user_burst=2, playlist_cost=3 )
+
+@pytest.mark.parametrize( 'url, cost', [
+    ( "https://www.youtube.com/playlist?list=PL123", 3 ),
+    ( "https://youtube.com/playlist/?list=PL123&si=abc", 3 ),
+    ( "https://music.youtube.com/browse?list=OLAK5uy", 3 ),
+    ( "https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=RDdQw4w9WgXcQ", 1 ),
+    ( "https://youtu.be/dQw4w9WgXcQ?list=PL123", 1 ),
+    ( "https://www.youtube.com/watch?v=dQw4w9WgXcQ", 1 ),
+    ( "https://example.com/playlists/song.mp3", 1 )
+] )
+def test_only_playlists_cost_more( url, cost ):
+    assert admission.AdmissionController( playlist_cost=3 ).cost_of( url ) == cost
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,51 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# test_bot_commands.py
+#
+# Tests for the helpers behind the bot's commands.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import asyncio
+import importlib
+import os
+import pytest
+import sys
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+REPO_DIR = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+#-[ FUNCTION DEFS ]----------------------------------------------------------------------------------------------------#
+
+# Imports the bot (without connecting it); it reads its configs relative to the repo
+@pytest.fixture
+def bot_module( monkeypatch ):
+    monkeypatch.chdir( REPO_DIR )
+    # discord.py grabs the current event loop when the bot gets built, and asyncio.run() (in other tests) leaves none
+    if 'discord_yt_audio_bot' not in sys.modules:
+        asyncio.set_event_loop( asyncio.new_event_loop() )
+    return importlib.import_module( 'discord_yt_audio_bot' )
+
+#-[ TEST DEFS ]--------------------------------------------------------------------------------------------------------#
+
+@pytest.mark.parametrize( 'timestamp, seconds', [
+    ( "90", 90 ),
+    ( "1:30", 90 ),
+    ( "1:02:03", 3723 ),
+    ( "1:00:00:00", 86400 ),
+    ( "0:1.5", 1.5 )
+] )
+def test_parse_timestamp( bot_module, timestamp, seconds ):
+    assert bot_module.parse_timestamp( timestamp ) == seconds
+
+@pytest.mark.parametrize( 'timestamp', [ "nan", "inf", "1:inf", "-5", "1:-30", "1:2:3:4:5", "abc", "" ] )
+def test_parse_timestamp_rejects_invalid_parts( bot_module, timestamp ):
+    with pytest.raises( ValueError ):
+        bot_module.parse_timestamp( timestamp )
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
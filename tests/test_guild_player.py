@@ -0,0 +1,171 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# test_guild_player.py
+#
+# Tests for the per-guild player's scheduler, run against the benchmarks' fake voice client (which plays on its own
+# thread, like discord.py's).
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import asyncio
+
+import guild_player
+import ytdl_utils
+from benchmarks import fakes
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+"""
+A source with a few frames of silence
+"""
+class FakeSource:
+
+    def __init__( self, frames=3 ):
+        self.frames = frames
+
+    def read( self ):
+        if self.frames == 0:
+            return b''
+        self.frames -= 1
+        return b'\0' * 3840
+
+    def is_opus( self ):
+        return False
+
+    def cleanup( self ):
+        pass
+
+#-[ FUNCTION DEFS ]----------------------------------------------------------------------------------------------------#
+
+def make_song( song_id, **fields ):
+    return ytdl_utils.YTStreamData.from_dict( dict( id=song_id, title=song_id, url="http://localhost/" + song_id,
+                                                    **fields ) )
+
+# Builds a player on a fake voice client; songs whose id is in failing can't be played
+def make_player( played, failing=() ):
+    def source_factory( song, guild_id, start ):
+        if song.id in failing:
+            raise OSError( "stream went away" )
+        played.append( ( song.id, start ) )
+        return FakeSource()
+
+    player = guild_player.GuildPlayer( 1, source_factory )
+    player.voice_client = fakes.FakeVoiceClient( fakes.FakeChannel( 2 ), paced=False )
+    return player
+
+# Runs the scheduler until the condition holds (or gives up after a few seconds)
+async def run_until( player, condition ):
+    player.start()
+    for _ in range( 500 ):
+        if condition():
+            return
+        await asyncio.sleep( 0.01 )
+    raise AssertionError( "timed out" )
+
+#-[ TEST DEFS ]--------------------------------------------------------------------------------------------------------#
+
+def test_failing_song_leaves_the_rotation( monkeypatch ):
+    monkeypatch.setattr( guild_player, 'START_BACKOFF_BASE', 0 )
+    played = []
+
+    async def run():
+        player = make_player( played, failing={ 'bad' } )
+        player.loop_queue = True
+        for song_id in ( 'a', 'bad', 'b' ):
+            player.put( make_song( song_id ) )
+        await run_until( player, lambda: len( played ) >= 3 )
+        queued = [ song.id for song in player.queue ]
+        player.stop()
+        return queued
+
+    assert 'bad' not in asyncio.run( run() )
+    assert [ song_id for song_id, _ in played[:3] ] == [ 'a', 'b', 'a' ]
+
+def test_scheduler_gives_up_after_failures_in_a_row( monkeypatch ):
+    monkeypatch.setattr( guild_player, 'START_BACKOFF_BASE', 0 )
+    played = []
+    failing = [ f"bad{n}" for n in range( guild_player.MAX_START_FAILURES + 1 ) ]
+
+    async def run():
+        player = make_player( played, failing=failing )
+        for song_id in failing:
+            player.put( make_song( song_id ) )
+        await run_until( player, lambda: len( player.queue ) == 1 and player.now_playing == None )
+        await asyncio.sleep( 0.05 )
+        gave_up = ( len( player.queue ), player.task.done() )
+
+        # Queueing something wakes it back up
+        player.put( make_song( 'good' ) )
+        await run_until( player, lambda: played )
+        player.stop()
+        return gave_up
+
+    assert asyncio.run( run() ) == ( 1, False )
+    assert played == [ ( 'good', 0 ) ]
+
+def test_ended_early():
+    player = make_player( [] )
+    song = player.now_playing = make_song( 'a', duration=100 )
+    player.source = guild_player.audio_sources.TrackedSource( FakeSource(), start=50 )
+    assert player._ended_early( song )
+
+    # Close enough to the end
+    player.source.start = 100 - guild_player.EARLY_EOF_TOLERANCE + 1
+    assert not player._ended_early( song )
+
+    # An error always means the stream got cut off, unless somebody skipped
+    player._track_error = OSError( "connection reset" )
+    assert player._ended_early( song )
+    player._stopped = True
+    assert not player._ended_early( song )
+
+    # Without a duration, only an error tells
+    player._stopped = False
+    player._track_error = None
+    song.duration = None
+    player.source.start = 0
+    assert not player._ended_early( song )
+
+def test_cut_off_stream_resumes_where_it_stopped( monkeypatch ):
+    monkeypatch.setattr( guild_player, 'RESUME_BACKOFF_BASE', 0 )
+    played = []
+
+    async def run():
+        player = make_player( played )
+        player.put( make_song( 'a', duration=100 ) )
+        player.put( make_song( 'b' ) )
+        await run_until( player, lambda: played and played[-1][0] == 'b' )
+        player.stop()
+
+    asyncio.run( run() )
+    starts = [ start for song_id, start in played if song_id == 'a' ]
+    assert len( starts ) == 1 + guild_player.MAX_RESUME_ATTEMPTS
+    assert starts == sorted( starts ) and starts[0] == 0 and starts[1] > 0
+
+def test_restored_position_only_applies_once():
+    played = []
+
+    async def run():
+        player = make_player( played )
+        player.restore( {
+            'loop_current': True,
+            'now_playing': make_song( 'a', start_time=5 ).to_dict(),
+            'position': 30
+        }, ytdl_utils.YTStreamData.from_dict )
+        await run_until( player, lambda: len( played ) >= 3 )
+        player.stop()
+
+    asyncio.run( run() )
+    assert played[:3] == [ ( 'a', 30 ), ( 'a', 5 ), ( 'a', 5 ) ]
+
+def test_new_players_start_with_the_saved_settings():
+    settings = { 'volume': 0.5, 'eq': 'bass', 'crossfade': 3, 'autoplay': True, 'fair': True }
+    registry = guild_player.PlayerRegistry( None, settings_of={ 1: settings }.get )
+    assert registry.get( 1 ).settings() == settings
+    assert registry.get( 2 ).settings()['volume'] == 1.0
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
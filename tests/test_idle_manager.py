@@ -0,0 +1,106 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# test_idle_manager.py
+#
+# Tests for finding the ffmpeg processes behind (wrapped) audio sources, which the idle manager must never kill, and
+# for taking broadcast stations nobody listens to off air.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import asyncio
+
+import broadcast
+import idle_manager
+
+#-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
+
+class FakeProcess:
+
+    def __init__( self, pid, returncode=None ):
+        self.pid = pid
+        self.returncode = returncode
+
+    def poll( self ):
+        return self.returncode
+
+
+# Like discord.FFmpegPCMAudio / FFmpegOpusAudio
+class FakeFFmpegSource:
+
+    def __init__( self, process ):
+        self._process = process
+
+
+# Like discord.PCMVolumeTransformer (and ytdl_utils.YTDLSource)
+class FakeVolumeTransformer:
+
+    def __init__( self, original ):
+        self.original = original
+
+
+# Like audio_sources.TrackedSource
+class FakeTrackedSource:
+
+    def __init__( self, source ):
+        self.source = source
+
+
+# Like audio_sources.CrossfadeSource
+class FakeCrossfadeSource:
+
+    def __init__( self, outgoing, incoming ):
+        self.outgoing = outgoing
+        self.incoming = incoming
+
+#-[ TEST DEFS ]--------------------------------------------------------------------------------------------------------#
+
+def test_finds_process_of_passthrough_source():
+    process = FakeProcess( 10 )
+    assert idle_manager.find_ffmpeg_processes( FakeTrackedSource( FakeFFmpegSource( process ) ) ) == [ process ]
+
+def test_finds_process_through_volume_transformer():
+    process = FakeProcess( 11 )
+    source = FakeTrackedSource( FakeVolumeTransformer( FakeFFmpegSource( process ) ) )
+    assert idle_manager.find_ffmpeg_processes( source ) == [ process ]
+
+def test_finds_both_processes_of_crossfade_current_first():
+    outgoing = FakeProcess( 12 )
+    incoming = FakeProcess( 13 )
+    source = FakeTrackedSource( FakeCrossfadeSource(
+        FakeVolumeTransformer( FakeFFmpegSource( outgoing ) ), FakeVolumeTransformer( FakeFFmpegSource( incoming ) )
+    ) )
+    assert idle_manager.find_ffmpeg_processes( source ) == [ incoming, outgoing ]
+
+def test_skips_exited_processes_and_missing_sources():
+    assert idle_manager.find_ffmpeg_processes( None ) == []
+    exited = FakeFFmpegSource( FakeProcess( 14, returncode=0 ) )
+    assert idle_manager.find_ffmpeg_processes( FakeTrackedSource( FakeVolumeTransformer( exited ) ) ) == []
+
+def test_unheard_stations_go_off_air():
+    async def run():
+        stations = broadcast.StationRegistry( None )
+        quiet = stations.get( "quiet" )
+        busy = stations.get( "busy" )
+        listener = busy.subscribe( 1 )
+        idler = idle_manager.IdleManager( None, alone_timeout=60 )
+
+        assert idler.reap_stations( stations, now=0 ) == 0
+        busy.unsubscribe( listener )
+        assert idler.reap_stations( stations, now=30 ) == 0
+
+        # Tuning back in starts the clock over
+        busy.subscribe( 2 )
+        assert idler.reap_stations( stations, now=60 ) == 1
+        on_air = set( stations.stations )
+        stations.remove( "busy" )
+        return on_air, quiet
+
+    on_air, quiet = asyncio.run( run() )
+    assert on_air == { "busy" }
+    assert quiet._stopped
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
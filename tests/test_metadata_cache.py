@@ -0,0 +1,75 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# test_metadata_cache.py
+#
+# Tests for the youtube_dl metadata cache: cache keys and expiry.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import time
+
+import metadata_cache
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+VIDEO_ID = "dQw4w9WgXcQ"
+
+#-[ TEST DEFS ]--------------------------------------------------------------------------------------------------------#
+
+def test_spellings_of_a_video_share_a_key():
+    keys = { metadata_cache.normalize_key( url ) for url in (
+        VIDEO_ID,
+        f"https://www.youtube.com/watch?v={VIDEO_ID}",
+        f"  youtube.com/watch?v={VIDEO_ID}&feature=share ",
+        f"https://m.youtube.com/watch?v={VIDEO_ID}",
+        f"https://youtu.be/{VIDEO_ID}",
+        f"https://www.youtube.com/shorts/{VIDEO_ID}",
+        f"https://music.youtube.com/watch?v={VIDEO_ID}&list=RDAMVM{VIDEO_ID}"
+    ) }
+    assert keys == { "yt:" + VIDEO_ID }
+
+def test_start_time_and_playlists_get_their_own_keys():
+    assert metadata_cache.normalize_key( f"https://youtu.be/{VIDEO_ID}?t=42" ) == f"yt:{VIDEO_ID}@42"
+    assert metadata_cache.normalize_key( "https://www.youtube.com/playlist?list=PL123" ) == "ytlist:PL123"
+    assert metadata_cache.normalize_key( "https://example.com/song.mp3" ) == "https://example.com/song.mp3"
+
+def test_entries_expire_with_their_stream_urls( monkeypatch ):
+    now = time.time()
+    cache = metadata_cache.MetadataCache()
+    cache.put( VIDEO_ID, { 'url': f"https://example.com/stream?expire={int( now ) + 3600}" } )
+    assert cache.get( f"https://youtu.be/{VIDEO_ID}" ) != None
+
+    # Expiry keeps a safety margin before the stream URL actually runs out
+    monkeypatch.setattr( time, 'time', lambda: now + 3600 - 30 )
+    assert cache.get( VIDEO_ID ) == None
+    assert len( cache ) == 0
+
+def test_already_expired_data_doesnt_get_cached():
+    cache = metadata_cache.MetadataCache()
+    cache.put( VIDEO_ID, { 'url': f"https://example.com/stream?expire={int( time.time() ) + 10}" } )
+    assert len( cache ) == 0
+
+def test_data_without_expiry_uses_the_default_ttl( monkeypatch ):
+    now = time.time()
+    cache = metadata_cache.MetadataCache( default_ttl=60 )
+    cache.put( VIDEO_ID, { 'url': "https://example.com/song.mp3" } )
+    monkeypatch.setattr( time, 'time', lambda: now + 59 )
+    assert cache.get( VIDEO_ID ) != None
+    monkeypatch.setattr( time, 'time', lambda: now + 61 )
+    assert cache.get( VIDEO_ID ) == None
+
+def test_least_recently_used_entries_get_evicted():
+    cache = metadata_cache.MetadataCache( max_entries=2 )
+    for url in ( "https://example.com/a", "https://example.com/b" ):
+        cache.put( url, { 'url': url } )
+    cache.get( "https://example.com/a" )
+    cache.put( "https://example.com/c", { 'url': "https://example.com/c" } )
+    assert cache.get( "https://example.com/b" ) == None
+    assert cache.get( "https://example.com/a" ) != None
+    assert cache.evictions == 1
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,48 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# test_queue_store.py
+#
+# Tests for the SQLite backed store of per-guild player state.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import asyncio
+
+import guild_player
+import queue_store
+
+#-[ TEST DEFS ]--------------------------------------------------------------------------------------------------------#
+
+def test_settings_outlive_the_saved_state( tmp_path ):
+    path = str( tmp_path / "player_state.db" )
+
+    async def run():
+        store = queue_store.QueueStore( path )
+        player = guild_player.GuildPlayer( 1, None )
+        player.volume = 0.25
+        player.autoplay = True
+        store.mark_dirty( player )
+        await store.flush()
+
+        # Eviction drops the queue, but not the settings
+        player.eq = 'bass'
+        store.mark_dirty( player )
+        store.mark_deleted( 1 )
+        assert store.settings_of( 1 )['eq'] == 'bass'
+        await store.close()
+
+        reopened = queue_store.QueueStore( path )
+        await reopened.load_settings()
+        state = await reopened.load( 1 )
+        await reopened.close()
+        return state, reopened.settings_of( 1 )
+
+    state, settings = asyncio.run( run() )
+    assert state == None
+    assert settings == { 'volume': 0.25, 'eq': 'bass', 'crossfade': 0, 'autoplay': True, 'fair': False }
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
@@ -0,0 +1,108 @@
+#----------------------------------------------------------------------------------------------------------------------#
+#
+# test_song_queue.py
+#
+# Tests for the guild players' song queue: play order, fair turns between requesters, moving and removing.
+#
+# Author: duckduckdoof
+#
+#----------------------------------------------------------------------------------------------------------------------#
+
+#-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
+
+import song_queue
+
+#-[ FUNCTION DEFS ]----------------------------------------------------------------------------------------------------#
+
+# Builds a queue from (song, requester) pairs, returns it and the handles
+def make_queue( songs, fair=False ):
+    queue = song_queue.SongQueue( fair=fair )
+    entries = [ queue.append( song, requester ) for song, requester in songs ]
+    return queue, entries
+
+def drain( queue ):
+    songs = []
+    while queue:
+        songs.append( queue.pop() )
+    return songs
+
+#-[ TEST DEFS ]--------------------------------------------------------------------------------------------------------#
+
+def test_in_order_by_default():
+    queue, _ = make_queue( [ ( 'a1', 'a' ), ( 'a2', 'a' ), ( 'b1', 'b' ) ] )
+    assert list( queue ) == [ 'a1', 'a2', 'b1' ]
+    assert drain( queue ) == [ 'a1', 'a2', 'b1' ]
+    assert queue.pop() == None
+
+def test_fair_mode_takes_turns():
+    queue, _ = make_queue( [ ( 'a1', 'a' ), ( 'a2', 'a' ), ( 'a3', 'a' ), ( 'b1', 'b' ), ( 'c1', 'c' ), ( 'b2', 'b' ) ],
+                           fair=True )
+    assert list( queue ) == [ 'a1', 'b1', 'c1', 'a2', 'b2', 'a3' ]
+    assert drain( queue ) == [ 'a1', 'b1', 'c1', 'a2', 'b2', 'a3' ]
+
+def test_fair_turns_carry_on_as_songs_get_added():
+    queue, _ = make_queue( [ ( 'a1', 'a' ), ( 'a2', 'a' ), ( 'b1', 'b' ) ], fair=True )
+    assert queue.pop() == 'a1'
+    queue.append( 'c1', 'c' )
+    assert list( queue ) == [ 'b1', 'a2', 'c1' ]
+
+def test_switching_modes_keeps_the_songs():
+    queue, _ = make_queue( [ ( 'a1', 'a' ), ( 'a2', 'a' ), ( 'b1', 'b' ) ] )
+    queue.fair = True
+    assert list( queue ) == [ 'a1', 'b1', 'a2' ]
+    queue.fair = False
+    assert list( queue ) == [ 'a1', 'a2', 'b1' ]
+
+def test_remove_by_handle():
+    queue, entries = make_queue( [ ( 'a1', 'a' ), ( 'b1', 'b' ), ( 'a2', 'a' ) ], fair=True )
+    assert queue.remove( entries[1] )
+    assert not queue.remove( entries[1] )
+    assert len( queue ) == 2
+    assert list( queue ) == [ 'a1', 'a2' ]
+
+    # A requester whose last song got removed loses their turn
+    assert queue.remove( entries[0] ) and queue.remove( entries[2] )
+    assert not queue
+    queue.append( 'c1', 'c' )
+    assert drain( queue ) == [ 'c1' ]
+
+def test_popped_handles_are_stale():
+    queue, entries = make_queue( [ ( 'a1', 'a' ), ( 'a2', 'a' ) ] )
+    queue.pop()
+    assert not queue.remove( entries[0] )
+    assert not queue.move( entries[0], 1 )
+    assert list( queue ) == [ 'a2' ]
+
+def test_move():
+    queue, entries = make_queue( [ ( 's0', None ), ( 's1', None ), ( 's2', None ), ( 's3', None ) ] )
+    assert queue.move( entries[3], 0 )
+    assert list( queue ) == [ 's3', 's0', 's1', 's2' ]
+    assert queue.move( entries[3], 99 )
+    assert list( queue ) == [ 's0', 's1', 's2', 's3' ]
+    assert queue.entry_at( 2 ) is entries[2]
+    assert queue.entry_at( 4 ) == None and queue.entry_at( -1 ) == None
+
+def test_move_in_fair_mode_keeps_turns_alternating():
+    queue, entries = make_queue( [ ( 'a1', 'a' ), ( 'a2', 'a' ), ( 'b1', 'b' ), ( 'b2', 'b' ) ], fair=True )
+    assert list( queue ) == [ 'a1', 'b1', 'a2', 'b2' ]
+
+    # Moving b2 to the front makes it b's next song, and b's turn first
+    assert queue.move( entries[3], 0 )
+    assert list( queue ) == [ 'b2', 'a1', 'b1', 'a2' ]
+    assert drain( queue ) == [ 'b2', 'a1', 'b1', 'a2' ]
+
+def test_front_append_goes_first():
+    queue, _ = make_queue( [ ( 'a1', 'a' ), ( 'b1', 'b' ) ], fair=True )
+    queue.append( 'b0', 'b', front=True )
+    assert list( queue ) == [ 'b0', 'a1', 'b1' ]
+
+def test_shuffle_keeps_every_song():
+    songs = [ ( f"s{n}", n % 3 ) for n in range( 30 ) ]
+    for fair in ( False, True ):
+        queue, _ = make_queue( songs, fair=fair )
+        queue.shuffle()
+        assert sorted( queue ) == sorted( song for song, _ in songs )
+        assert sorted( drain( queue ) ) == sorted( song for song, _ in songs )
+        assert len( queue ) == 0
+
+#-[ END ]--------------------------------------------------------------------------------------------------------------#
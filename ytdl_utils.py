@@ -11,70 +11,263 @@
 
 #-[ IMPORT DEFS ]------------------------------------------------------------------------------------------------------#
 
-import asyncio
 import discord
+import logging
+import re
+import sys
+import time
+
+from urllib.parse import urlparse, parse_qs
+
+#-[ CONST DEFS ]-------------------------------------------------------------------------------------------------------#
+
+# How close (in seconds) to its expiry we still trust a signed stream URL
+EXPIRY_MARGIN = 60
+
+YT_WATCH_URL = "https://www.youtube.com/watch?v="
+
+log = logging.getLogger( __name__ )
+
+#-[ FUNCTION DEFS ]----------------------------------------------------------------------------------------------------#
+
+# Reads the expiry (unix time) out of a signed googlevideo URL, returns None if it doesn't have one
+def get_url_expiry( url ):
+    if not url:
+        return None
+    parsed = urlparse( url )
+    expire = parse_qs( parsed.query ).get( 'expire' )
+    if expire:
+        return int( expire[0] )
+
+    # Some manifest URLs carry their parameters in the path instead (.../expire/1234567890/...)
+    match = re.search( r'/expire/(\d+)', parsed.path )
+    return int( match.group( 1 ) ) if match else None
 
 #-[ CLASS DEFS ]-------------------------------------------------------------------------------------------------------#
 
 """
-Class containing basic information of a YT video
+Class containing basic information of a YT video.
+
+Queued songs pile up across guilds (and looping queues), so this only keeps what playback needs, in slots. Heavy
+fields like the description and thumbnail are looked up in the metadata cache when somebody actually asks for them.
 """
 class YTStreamData:
-    
+
+    __slots__ = ( 'id', 'title', 'url', 'duration', 'start_time', 'requester', 'expires_at', 'acodec', 'gain',
+                  '_webpage_url' )
+
+    # Set by the bot, used for the lazily loaded fields
+    metadata_cache = None
+
     ## Constructor
-    def __init__( self, yt_raw_data ):
-        self.url = yt_raw_data['url']
+    def __init__( self, yt_raw_data, requester=None ):
         self.title = yt_raw_data['title']
         self.id = yt_raw_data['id']
-        self.description = yt_raw_data['description']
+        self.duration = yt_raw_data.get( 'duration' )
+        self.requester = requester
+
+        # Loudness normalization gain (linear), once the track has been measured
+        self.gain = None
+
+        # Flat playlist entries point at the video page (or are just the id) instead of a stream,
+        # so keep something we can resolve later
+        if yt_raw_data.get( '_type' ) == 'url':
+            self.webpage_url = yt_raw_data.get( 'url' )
+            self.url = None
+            self.expires_at = None
+            self.acodec = None
+        else:
+            self.webpage_url = yt_raw_data.get( 'webpage_url' )
+            self.update_stream( yt_raw_data )
 
         if 'start_time' in yt_raw_data:
             self.start_time = yt_raw_data['start_time']
         else:
             self.start_time = 0
 
+    ## The page we (re-)resolve the stream from; plain YouTube watch URLs aren't stored, the id is enough for those
+    @property
+    def webpage_url( self ):
+        return self._webpage_url or YT_WATCH_URL + self.id
+
+    @webpage_url.setter
+    def webpage_url( self, webpage_url ):
+        if webpage_url in ( None, self.id, YT_WATCH_URL + self.id ):
+            webpage_url = None
+        self._webpage_url = webpage_url
+
+    ## Grabs a heavy field from the cached metadata, None if it isn't cached (anymore)
+    def _cached_field( self, field ):
+        if YTStreamData.metadata_cache == None:
+            return None
+        data = YTStreamData.metadata_cache.get( self.webpage_url )
+        return data.get( field ) if data != None else None
+
+    @property
+    def description( self ):
+        return self._cached_field( 'description' )
+
+    @property
+    def thumbnail( self ):
+        return self._cached_field( 'thumbnail' )
+
+    ## Turns the song into a plain dict (for the queue store)
+    def to_dict( self ):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'url': self.url,
+            'duration': self.duration,
+            'start_time': self.start_time,
+            'requester': self.requester,
+            'expires_at': self.expires_at,
+            'acodec': self.acodec,
+            'gain': self.gain,
+            'webpage_url': self._webpage_url
+        }
+
+    ## Rebuilds a song from to_dict() output; a stream URL which hasn't expired yet gets reused as is
+    @classmethod
+    def from_dict( cls, song_dict ):
+        song = cls.__new__( cls )
+        song.id = song_dict['id']
+        song.title = song_dict['title']
+        song.url = song_dict.get( 'url' )
+        song.duration = song_dict.get( 'duration' )
+        song.start_time = song_dict.get( 'start_time' ) or 0
+        song.requester = song_dict.get( 'requester' )
+        song.expires_at = song_dict.get( 'expires_at' )
+        acodec = song_dict.get( 'acodec' )
+        song.acodec = sys.intern( acodec ) if acodec else None
+        song.gain = song_dict.get( 'gain' )
+        song.webpage_url = song_dict.get( 'webpage_url' )
+        return song
+
+    ## Takes the (direct) stream URL and its audio codec from a fresh set of raw data
+    def update_stream( self, yt_raw_data ):
+        self.url = yt_raw_data.get( 'url' )
+        self.expires_at = get_url_expiry( self.url )
+        acodec = yt_raw_data.get( 'acodec' )
+        # Only a handful of codec names exist, so share them instead of keeping a copy per song
+        self.acodec = sys.intern( acodec ) if acodec else None
+
+    ## Checks if the stream is already Opus (e.g. webm format 251), which discord can take without a transcode
+    def is_opus( self ):
+        return self.acodec == 'opus'
+
+    ## Checks if the stream URL is missing (flat entries) or about to expire
+    def needs_resolve( self, margin=EXPIRY_MARGIN ):
+        if not self.url or not self.url.startswith( 'http' ):
+            return True
+        if self.expires_at == None:
+            return False
+        return time.time() + margin >= self.expires_at
+
 
 """
-Retrieves audio data from youtube URL
+Retrieves audio data from youtube URL.
+Frames go through a PCM effect chain (gain, optional EQ, limiter) instead of the transformer's own gain.
 """
 class YTDLSource( discord.PCMVolumeTransformer ):
 
-    ## Constructor
-    def __init__( self, source, *, data, volume=1.0 ):
+    ## Constructor (eq is the name of an EQ preset, or None)
+    def __init__( self, source, *, data, volume=1.0, eq=None ):
         super().__init__( source, volume )
 
         self.data = data
         self.title = data.get( 'title' ) 
         self.url = data.get( 'url' )
 
-    ## Downloads the youtube audio from a URL
-    @classmethod
-    async def download_from_url( cls, url, ytdl, loop=None ):
-        loop = loop or asyncio.get_event_loop()
-        data = await loop.run_in_executor( None, lambda: ytdl.extract_info( url, download=True ) )
+        # The effect chain (and NumPy with it) only gets imported once a track needs decoding, not with the bot
+        import pcm_effects
+        self.effects = pcm_effects.EffectChain( volume=volume, eq=eq )
 
-        if 'entries' in data:
-            # take first item from a playlist
-            data = data['entries'][0]
+    ## Reads the next frame (runs on discord.py's audio thread)
+    def read( self ):
+        data = self.original.read()
+        if not data:
+            return data
+        return self.effects.process( data, self.volume )
 
-        filename = ytdl.prepare_filename( data )
+    ## Downloads the youtube audio from a URL (the pool takes the first item of a playlist)
+    @classmethod
+    async def download_from_url( cls, url, pool, guild_id=None, options=None ):
+        _, filename = await pool.download( url, guild_id=guild_id, options=options )
         return filename
 
-    ## Streams the youtube audio from a URL
+    ## Grabs the metadata for a URL, from the cache if we can (and into the cache if we can't)
     @classmethod
-    async def stream_from_url( cls, url, ytdl, loop=None ):
-        entries = []
-        loop = loop or asyncio.get_event_loop()
-        data = await loop.run_in_executor( None, lambda: ytdl.extract_info( url, download=False ) )
+    async def extract_info( cls, url, pool, cache=None, guild_id=None ):
+        data = cache.get( url ) if cache != None else None
+        if data != None:
+            log.debug( "Metadata cache hit url=%s", url )
+            return data
+
+        data = await pool.extract_info( url, guild_id=guild_id )
+
+        if cache != None:
+            cache.put( url, data )
+            # Playlist entries get cached on their own too, so queueing one of them later skips extraction
+            for video in data.get( 'entries' ) or []:
+                if video and video.get( 'webpage_url' ):
+                    cache.put( video['webpage_url'], video )
+        return data
+
+    ## Streams the youtube audio from a URL, one entry at a time.
+    ## Playlists only get a flat listing, so the first entry shows up right away instead of after every entry has
+    ## been extracted; the guild players resolve the stream URLs of the entries when they come up.
+    @classmethod
+    async def iter_stream_from_url( cls, url, pool, cache=None, guild_id=None, requester=None ):
+        data = cache.get( url ) if cache != None else None
+        if data == None:
+            data = await pool.extract_info( url, guild_id=guild_id, flat=True )
+            # Single videos come back fully extracted, the playlist listing isn't worth caching
+            if 'entries' not in data and cache != None:
+                cache.put( url, data )
 
         if 'entries' in data:
-            # take first item from a playlist
-            print( "Found multiple entries (it's a playlist)!" )
+            log.debug( "Found multiple entries (it's a playlist) url=%s", url )
             for video in data['entries']:
-                entries.append( YTStreamData( video ) )
+                if video:
+                    yield YTStreamData( video, requester )
         else:
-            entries = [ YTStreamData( data ) ]
+            yield YTStreamData( data, requester )
+
+    ## Searches YouTube, returning up to count (unresolved) results.
+    ## Only a flat listing gets extracted, so a search costs one round trip; the stream URL of whichever result gets
+    ## queued is resolved later on, like a playlist entry.
+    @classmethod
+    async def search( cls, query, pool, cache=None, guild_id=None, count=5, requester=None ):
+        # Searches which only differ in case or spacing share a cache entry
+        search_url = f"ytsearch{count}:{' '.join( query.lower().split() )}"
+        data = cache.get( search_url ) if cache != None else None
+        if data == None:
+            data = await pool.extract_info( search_url, guild_id=guild_id, flat=True )
+            if cache != None:
+                cache.put( search_url, data )
+
+        return [ YTStreamData( video, requester ) for video in data.get( 'entries' ) or [] if video ]
+
+    ## Re-resolves the direct stream URL of an already queued song (force skips the cache, e.g. for a dead URL)
+    @classmethod
+    async def resolve_stream( cls, song, pool, cache=None, guild_id=None, force=False ):
+        if force and cache != None:
+            cache.invalidate( song.webpage_url )
+        data = await cls.extract_info( song.webpage_url, pool, cache=cache, guild_id=guild_id )
+        if 'entries' in data:
+            data = data['entries'][0]
+        song.update_stream( data )
+
+        # Cached flat entries don't carry a stream URL, so those still need a proper extraction
+        if song.needs_resolve() and cache != None:
+            cache.invalidate( song.webpage_url )
+            data = await cls.extract_info( song.webpage_url, pool, cache=cache, guild_id=guild_id )
+            if 'entries' in data:
+                data = data['entries'][0]
+            song.update_stream( data )
 
-        return entries
+        if song.duration == None:
+            song.duration = data.get( 'duration' )
+        return song
 
 #-[ END ]--------------------------------------------------------------------------------------------------------------#